@@ -0,0 +1,296 @@
+'''
+A binary archive of games. Each move takes 16 bits: the from square in bits 0-5, the to
+square in bits 6-11 (square = rank*8 + file, as in bitboard) and the promotion in bits
+12-14 (0 for none, then 1-4 for Q, N, R, B). Only moves legal by the rules are written.
+
+    Header      b"CPGA", version (u16), unused (u16)
+    Games       plies (u16), tags length (u16), FEN length (u16), tags, FEN, moves (u16 each)
+    Index       offset of each game (u64), then the end of the last game
+    Footer      offset of the index (u64), number of games (u32), b"CPGA"
+
+All numbers are little-endian. Tags are "name\\tvalue" lines in UTF-8, and the FEN is empty
+for games from the usual starting position. Files are read through mmap, so any game, or
+any ply of one, is reached through the index without reading the rest of the file.
+
+    python archive.py convert games.pgn games.cga   PGN to archive
+    python archive.py convert games.cga games.pgn   Archive to PGN
+    python archive.py bench games.cga               Read throughput
+'''
+import sys
+import time
+import mmap
+import array
+import random
+import struct
+import pgn
+from gamestate import GameState
+
+MAGIC = b"CPGA"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+GAME = struct.Struct("<HHH")
+FOOTER = struct.Struct("<QI4s")
+PROMOTIONS = ["", "Q", "N", "R", "B"]
+
+def encodeMove(move):
+    '''
+    Returns the 16-bit code of a move
+        Tuple move: A (from, to, promotion) tuple as returned by legalMoves
+    '''
+    code = move[0][0]*8 + move[0][1] | (move[1][0]*8 + move[1][1]) << 6
+    if move[2] is not None:
+        code |= PROMOTIONS.index(move[2][1]) << 12
+    return code
+
+def decodeMove(code, whiteToMove):
+    '''
+    Returns the (from, to, promotion) tuple of a 16-bit move code
+        Int code: The code from encodeMove
+        Bool whiteToMove: Whether white is the side moving, for the promotion's colour
+    '''
+    pos1 = divmod(code & 63, 8)
+    pos2 = divmod(code >> 6 & 63, 8)
+    promotion = None
+    if code >> 12:
+        if whiteToMove:
+            promotion = "w" + PROMOTIONS[code >> 12]
+        else:
+            promotion = "b" + PROMOTIONS[code >> 12]
+    return (pos1, pos2, promotion)
+
+class ArchiveWriter:
+    def __init__(self, path):
+        '''
+        Writes games to a new archive file; close() must be called to write the index
+            String path: The file to create
+        '''
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0))
+        self.offsets = []
+
+    def add(self, tags, moves, startFen=None):
+        '''
+        Appends a game
+            Dict tags: The tag pairs of the game
+            List moves: The (from, to, promotion) tuples played
+            String startFen: The starting position, or None for the usual one
+        '''
+        tagData = "".join("{a}\t{b}\n".format(a=name, b=value) for name, value in tags.items()).encode("utf-8")
+        fenData = (startFen or "").encode("ascii")
+        codes = array.array("H", [encodeMove(move) for move in moves])
+        if sys.byteorder != "little":
+            codes.byteswap()
+        self.offsets.append(self.file.tell())
+        self.file.write(GAME.pack(len(codes), len(tagData), len(fenData)))
+        self.file.write(tagData)
+        self.file.write(fenData)
+        self.file.write(codes.tobytes())
+        return
+
+    def close(self):
+        '''
+        Writes the index and footer and closes the file
+        '''
+        indexOffset = self.file.tell()
+        index = array.array("Q", self.offsets + [indexOffset])
+        if sys.byteorder != "little":
+            index.byteswap()
+        self.file.write(index.tobytes())
+        self.file.write(FOOTER.pack(indexOffset, len(self.offsets), MAGIC))
+        self.file.close()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+class Archive:
+    def __init__(self, path):
+        '''
+        Random access to the games of an archive file through mmap
+            String path: The file to open
+        '''
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, unused = HEADER.unpack_from(self.data, 0)
+        indexOffset, self.count, end = FOOTER.unpack_from(self.data, len(self.data) - FOOTER.size)
+        if magic != MAGIC or end != MAGIC or version != VERSION:
+            raise ValueError("{a} is not a version {b} game archive".format(a=path, b=VERSION))
+        # A view of the index straight out of the mapped file, on little-endian machines
+        self.index = memoryview(self.data)[indexOffset:indexOffset + 8*(self.count + 1)]
+        if sys.byteorder == "little":
+            self.index = self.index.cast("Q")
+        else:
+            index = array.array("Q", self.index)
+            index.byteswap()
+            self.index = index
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.index = None
+        self.data.close()
+        self.file.close()
+        return
+
+    def codes(self, i):
+        '''
+        Returns the 16-bit move codes of game i
+            Int i: The number of the game, from 0
+        '''
+        offset = self.index[i]
+        plies, tagLength, fenLength = GAME.unpack_from(self.data, offset)
+        start = offset + GAME.size + tagLength + fenLength
+        codes = array.array("H", self.data[start:start + 2*plies])
+        if sys.byteorder != "little":
+            codes.byteswap()
+        return codes
+
+    def tags(self, i):
+        '''
+        Returns the tag pairs and starting FEN (or None) of game i
+            Int i: The number of the game, from 0
+        '''
+        offset = self.index[i]
+        plies, tagLength, fenLength = GAME.unpack_from(self.data, offset)
+        start = offset + GAME.size
+        tags = {}
+        for line in self.data[start:start + tagLength].decode("utf-8").splitlines():
+            name, sep, value = line.partition("\t")
+            tags[name] = value
+        fen = self.data[start + tagLength:start + tagLength + fenLength].decode("ascii")
+        return tags, fen or None
+
+    def moves(self, i):
+        '''
+        Returns the (from, to, promotion) tuples of game i, without replaying it
+            Int i: The number of the game, from 0
+        '''
+        tags, fen = self.tags(i)
+        whiteToMove = fen is None or fen.split()[1] == "w"
+        moves = []
+        for code in self.codes(i):
+            moves.append(decodeMove(code, whiteToMove))
+            whiteToMove = not whiteToMove
+        return moves
+
+    def position(self, i, ply, gs=None):
+        '''
+        Returns a GameState of game i after the given number of plies
+            Int i: The number of the game, from 0
+            Int ply: The number of moves to play from the start
+            GameState gs: A GameState to reuse, or None for a new one
+        '''
+        if gs is None:
+            gs = GameState()
+        tags, fen = self.tags(i)
+        if fen is None:
+            gs.makeDefaultBoard()
+        else:
+            gs.loadFen(fen)
+        for code in self.codes(i)[:ply]:
+            gs.makeMove(*decodeMove(code, gs.whitesTurn()))
+        return gs
+
+def pgnToArchive(pgnPath, archivePath):
+    '''
+    Converts a PGN file to an archive, skipping games with illegal moves.
+    Returns (games written, games skipped)
+        String pgnPath: The PGN file to read
+        String archivePath: The archive file to create
+    '''
+    written = 0
+    skipped = 0
+    gs = GameState()
+    with open(pgnPath, encoding="utf-8", errors="replace") as f, ArchiveWriter(archivePath) as out:
+        for tags, movetext in pgn.readGames(f):
+            try:
+                gs, moves = pgn.replayGame(tags, movetext, gs)
+            except ValueError:
+                skipped += 1
+                continue
+            startFen = tags.pop("FEN", None)
+            tags.pop("SetUp", None)
+            out.add(tags, moves, startFen)
+            written += 1
+    return written, skipped
+
+def archiveToPgn(archivePath, pgnPath):
+    '''
+    Converts an archive to a PGN file. Returns the number of games written
+        String archivePath: The archive to read
+        String pgnPath: The PGN file to create
+    '''
+    games = Archive(archivePath)
+    with open(pgnPath, "w", encoding="utf-8") as out:
+        for i in range(len(games)):
+            tags, fen = games.tags(i)
+            pgn.writeGame(out, tags, games.moves(i), fen)
+    count = len(games)
+    games.close()
+    return count
+
+def benchArchive(path, samples=1000):
+    '''
+    Reports the read throughput of an archive: decoding every move, random access to games,
+    and jumping to a random ply of a random game
+        String path: The archive to read
+        Int samples: The number of random games and plies to read
+    '''
+    games = Archive(path)
+    count = len(games)
+    rng = random.Random(0)
+
+    start = time.perf_counter()
+    plies = 0
+    for i in range(count):
+        plies += len(games.moves(i))
+    elapsed = time.perf_counter() - start
+    print("sequential {a} games, {b} plies in {c:.2f} s: {d:.0f} games/s, {e:.0f} plies/s".format(
+        a=count, b=plies, c=elapsed, d=count / max(elapsed, 1e-9), e=plies / max(elapsed, 1e-9)))
+    if count == 0:
+        # No games to pick at random
+        games.close()
+        return
+
+    start = time.perf_counter()
+    for j in range(samples):
+        games.moves(rng.randrange(count))
+    elapsed = time.perf_counter() - start
+    print("random     {a} games: {b:.1f} us per game".format(a=samples, b=elapsed / samples * 1e6))
+
+    gs = GameState()
+    samples = min(samples, 100)
+    start = time.perf_counter()
+    for j in range(samples):
+        i = rng.randrange(count)
+        games.position(i, rng.randrange(len(games.codes(i)) + 1), gs)
+    elapsed = time.perf_counter() - start
+    print("position   {a} random plies: {b:.2f} ms per position".format(a=samples, b=elapsed / samples * 1e3))
+    games.close()
+    return
+
+def main(argv):
+    if len(argv) == 3 and argv[0] == "convert":
+        start = time.perf_counter()
+        if argv[1].endswith(".pgn"):
+            written, skipped = pgnToArchive(argv[1], argv[2])
+            print("{a} games written, {b} skipped".format(a=written, b=skipped))
+        else:
+            written = archiveToPgn(argv[1], argv[2])
+            print("{a} games written".format(a=written))
+        elapsed = time.perf_counter() - start
+        print("{a:.2f} s, {b:.1f} games/s".format(a=elapsed, b=written / max(elapsed, 1e-9)))
+        return 0
+    elif len(argv) == 2 and argv[0] == "bench":
+        benchArchive(argv[1])
+        return 0
+    print(__doc__)
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,409 @@
+import os
+import sys
+import time
+import copy
+import subprocess
+import tracemalloc
+import rules
+import engine
+import parallel
+import positions
+from gamestate import GameState
+
+# Positions reached from the starting position, given as moves in coordinate notation
+POSITIONS = {
+    "start": [],
+    "italian": ["e2e4", "e7e5", "g1f3", "b8c6", "f1c4", "f8c5", "c2c3", "g8f6"],
+    "scholar": ["e2e4", "e7e5", "f1c4", "b8c6", "d1h5", "g8f6", "h5f7"],
+    "fool": ["f2f3", "e7e5", "g2g4", "d8h4"]
+}
+
+def makePosition(moves, backend="piece"):
+    '''
+    Returns a new GameState with the given moves played from the starting position
+        List moves: Moves in coordinate notation, e.g. "e2e4"
+        String backend: The move generation backend the GameState uses
+    '''
+    gs = GameState(backend)
+    gs.makeDefaultBoard()
+    for move in moves:
+        gs.makeMove(*rules.parseMove(gs, move))
+    return gs
+
+def timeIt(func, repeat):
+    '''
+    Returns the average number of seconds taken by one call to func
+        Function func: The function being timed, called without arguments
+        Int repeat: The number of times to call it
+    '''
+    start = time.perf_counter()
+    for i in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+def legacyCheckKingSafety(gs, colour, activepos, newpos):
+    '''
+    The original king safety check, which plays the move on a deep copy of the game
+    '''
+    ts = copy.deepcopy(gs)
+    ts = rules.movePiece(ts, ts.getBoard()[activepos[0]][activepos[1]], newpos)
+    return not ts.inCheck(colour)
+
+def trialCanMove(gs, safety):
+    '''
+    How updateGameStatus looked for a legal move before the legal move generator:
+    trying the moves of each piece in turn until one leaves the king safe
+        GameState gs: The current Game State object
+        Function safety: checkKingSafety or legacyCheckKingSafety
+    '''
+    if gs.whitesTurn():
+        colour = "w"
+    else:
+        colour = "b"
+    for r in gs.getBoard():
+        for p in r:
+            if p.getColour() == colour:
+                pos = p.getPos()
+                for move in gs.checkValidMoves(p):
+                    if safety(gs, colour, pos, move):
+                        return True
+    return False
+
+def uncachedStatus(gs):
+    '''
+    Calls updateGameStatus with an empty cache, so the position is worked out again
+    '''
+    rules.STATUS_CACHE.clear()
+    return rules.updateGameStatus(gs)
+
+def benchStatus(repeat=20):
+    '''
+    Compares updateGameStatus, with and without its cache, against trying moves with
+    makeMove/unmakeMove and with deepcopy
+    '''
+    for name, moves in POSITIONS.items():
+        gs = makePosition(moves)
+        gs.history = [] # So the deepcopy path copies only what it always has
+        status = uncachedStatus(gs)
+        legal = timeIt(lambda: uncachedStatus(gs), repeat)
+        cached = timeIt(lambda: rules.updateGameStatus(gs), repeat)
+        trial = timeIt(lambda: trialCanMove(gs, rules.checkKingSafety), repeat)
+        slow = timeIt(lambda: trialCanMove(gs, legacyCheckKingSafety), repeat)
+        print("status  {a:8} {b}  legal {c:7.3f} ms  cached {d:7.3f} ms  make/unmake {e:7.3f} ms  deepcopy {f:7.3f} ms".format(
+            a=name, b=status, c=legal*1000, d=cached*1000, e=trial*1000, f=slow*1000))
+    return
+
+def benchBackends(repeat=200):
+    '''
+    Compares updatePotentialMoves between the Piece, bitboard and mailbox backends
+    '''
+    for name, moves in POSITIONS.items():
+        times = []
+        for backend in ["piece", "bitboard", "mailbox"]:
+            gs = makePosition(moves, backend)
+            times.append(timeIt(gs.updatePotentialMoves, repeat))
+        print("backend {a:8} piece {b:8.3f} ms  bitboard {c:8.3f} ms  mailbox {d:8.3f} ms".format(
+            a=name, b=times[0]*1000, c=times[1]*1000, d=times[2]*1000))
+    return
+
+def generateAll(gs):
+    '''
+    Asks every piece on the board for its moves and watched squares, as updatePotentialMoves does
+    '''
+    board = gs.getBoard()
+    for rank in board:
+        for p in rank:
+            p.checkValidMoves(board)
+            p.checkWatchedSquares(board)
+    return
+
+def benchPieces(repeat=200):
+    '''
+    Times the Piece move generators, which walk the tables built when piece is imported
+    '''
+    for name, moves in POSITIONS.items():
+        gs = makePosition(moves)
+        print("pieces  {a:8} {b:8.3f} ms".format(a=name, b=timeIt(lambda: generateAll(gs), repeat)*1000))
+    return
+
+def legacyDrawBoard(screen, colours, pg, size):
+    '''
+    The original drawBoard, which draws all 64 squares every frame
+    '''
+    for r in range(8):
+        for c in range(8):
+            pg.draw.rect(screen, colours[(c + r) % 2], pg.Rect(c*size, r*size, size, size))
+    return
+
+def benchRender(repeat=200):
+    '''
+    Times drawing frames: the board with 64 rects against the cached board, and the Renderer
+    for a frame where nothing changed and one where a piece is dragged
+    '''
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    # Imported here so the other benchmarks run without pygame
+    import pygame as pg
+    import game
+    pg.init()
+    screen = pg.display.set_mode((game.WIDTH, game.HEIGHT))
+    colours = game.changeTheme(1)
+    images = game.loadImages()
+    gs = makePosition(POSITIONS["italian"])
+    renderer = game.Renderer(screen, colours, images)
+    renderer.draw(gs, None, [], None, None)
+    moves = [(5, 3), (4, 3)]
+    path = [(x, 300) for x in range(100, 600, 5)]
+
+    def dragFrame():
+        # The d-pawn follows the mouse along a line, a new point each frame
+        path.append(path.pop(0))
+        renderer.draw(gs, (6, 3), moves, ("wp",) + path[0], None)
+        return
+
+    times = [
+        timeIt(lambda: legacyDrawBoard(screen, colours, pg, game.SQ_SIZE), repeat),
+        timeIt(lambda: game.drawBoard(screen, colours), repeat),
+        timeIt(lambda: renderer.draw(gs, None, [], None, None), repeat),
+        timeIt(dragFrame, repeat)
+    ]
+    print("render  board rects {a:6.3f} ms  cached {b:6.3f} ms  idle frame {c:6.3f} ms  drag frame {d:6.3f} ms".format(
+        a=times[0]*1000, b=times[1]*1000, c=times[2]*1000, d=times[3]*1000))
+    pg.quit()
+    return
+
+def benchSprites(sizes=(45, 60, 90, 135)):
+    '''
+    Times getting the piece sprites at each size: drawing them from the SVGs, reading the
+    atlas saved by an earlier run, and from memory as after a resize back to the size
+    '''
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    # Imported here so the other benchmarks run without pygame
+    import tempfile
+    import pygame as pg
+    import sprites
+    pg.init()
+    pg.display.set_mode((720, 720))
+    with tempfile.TemporaryDirectory() as cacheDir:
+        for size in sizes:
+            times = []
+            for cache in [sprites.SpriteCache("./Pieces/", cacheDir), sprites.SpriteCache("./Pieces/", cacheDir)]:
+                cache.get(size)
+                times.append(cache.lastTime)
+            cache.get(size)
+            times.append(cache.lastTime)
+            print("sprites {a:4}px  drawn {b:7.2f} ms  disk {c:7.2f} ms  memory {d:7.3f} ms".format(
+                a=size, b=times[0]*1000, c=times[1]*1000, d=times[2]*1000))
+    pg.quit()
+    return
+
+def benchMakeMove(repeat=20):
+    '''
+    Times makeMove followed by unmakeMove over every legal move of each position
+    '''
+    for name, moves in POSITIONS.items():
+        times = []
+        for backend in ["piece", "bitboard", "mailbox"]:
+            gs = makePosition(moves, backend)
+            legal = rules.legalMoves(gs)
+            if not legal:
+                break
+            def makeAll():
+                for move in legal:
+                    gs.makeMove(*move)
+                    gs.unmakeMove()
+            times.append(timeIt(makeAll, repeat) / len(legal))
+        if not times:
+            continue
+        print("move    {a:8} piece {b:8.1f} us  bitboard {c:8.1f} us  mailbox {d:8.1f} us  per make/unmake".format(
+            a=name, b=times[0]*1e6, c=times[1]*1e6, d=times[2]*1e6))
+    return
+
+def benchMemory(repeat=20):
+    '''
+    Measures the memory held by a GameState and the memory allocated by make/unmake
+    '''
+    for name, moves in POSITIONS.items():
+        tracemalloc.start()
+        gs = makePosition(moves)
+        size = tracemalloc.get_traced_memory()[0]
+        legal = rules.legalMoves(gs)
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(repeat):
+            for move in legal:
+                gs.makeMove(*move)
+                gs.unmakeMove()
+        churn = tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+        print("memory  {a:8} gamestate {b:8} bytes  make/unmake peak {c:8} bytes".format(
+            a=name, b=size, c=churn))
+    return
+
+def benchFen(repeat=200):
+    '''
+    Times FEN export and bulk loading of the positions through one reused GameState
+    '''
+    fens = [makePosition(moves).getFen() for moves in POSITIONS.values()] * repeat
+    start = time.perf_counter()
+    for gs in positions.readFens(fens):
+        pass
+    elapsed = time.perf_counter() - start
+    gs = makePosition(POSITIONS["italian"])
+    export = timeIt(gs.getFen, repeat)
+    print("fen     load {a:8.0f} positions/s  export {b:7.1f} us".format(
+        a=len(fens) / elapsed, b=export*1e6))
+    return
+
+# Modules which must import without pygame, so batch tools and worker processes start quickly
+HEADLESS = ["piece", "zobrist", "material", "bitboard", "mailbox120", "gamestate", "rules", "engine",
+    "perft", "parallel", "positions", "pgn", "archive", "explorer", "evaluation", "uci", "server", "selfplay"]
+
+def importTime(module, repeat=5):
+    '''
+    Returns the fastest time in seconds to import a module in a fresh interpreter, and whether
+    importing it loaded pygame
+        String module: The name of the module
+        Int repeat: The number of interpreters to start
+    '''
+    script = ("import sys, time; start = time.perf_counter(); import {a}; "
+              "print(time.perf_counter() - start, 'pygame' in sys.modules)").format(a=module)
+    best = None
+    pygame = False
+    for i in range(repeat):
+        out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+            env=dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT="1"))
+        if out.returncode != 0:
+            return None, False
+        elapsed, loaded = out.stdout.split()
+        if best is None or float(elapsed) < best:
+            best = float(elapsed)
+        pygame = pygame or loaded == "True"
+    return best, pygame
+
+def benchImports():
+    '''
+    Times a cold import of each headless module against the pygame interface. Returns False
+    if a headless module fails to import or loads pygame
+    '''
+    passed = True
+    for module in HEADLESS + ["game"]:
+        elapsed, pygame = importTime(module)
+        if elapsed is None:
+            print("import  {a:10} failed".format(a=module))
+            passed = False
+            continue
+        if module in HEADLESS and pygame:
+            result = "IMPORTS PYGAME"
+            passed = False
+        else:
+            result = "ok"
+        print("import  {a:10} {b:8.1f} ms  {c}".format(a=module, b=elapsed*1000, c=result))
+    return passed
+
+def benchEngine(depth=3):
+    '''
+    Searches each position to a fixed depth, reporting nodes per second
+    '''
+    for name, moves in POSITIONS.items():
+        gs = makePosition(moves)
+        result = engine.Engine().search(gs, depth)
+        print("engine  {a:8} {b}".format(a=name, b=result))
+    return
+
+def benchEvaluation(count=2000):
+    '''
+    Compares working out the material score from scratch, engine.evaluate reading the score
+    kept up to date, and scoring the same positions in one call to evaluation.evaluateBatch,
+    on positions from random games. Then times moves with and without an Accumulator
+    '''
+    # Imported here so the other benchmarks run without NumPy
+    import random
+    import evaluation
+    rng = random.Random(0)
+    fens = []
+    while len(fens) < count:
+        gs = makePosition([])
+        for i in range(rng.randrange(1, 80)):
+            legal = rules.legalMoves(gs)
+            if not legal:
+                break
+            rules.playMove(gs, rng.choice(legal))
+            fens.append(gs.getFen())
+    fens = fens[:count]
+    boards, whiteToMove, mobility = evaluation.encodePositions(positions.readFens(fens))
+    loaded = []
+    for fen in fens:
+        gs = GameState()
+        gs.loadFen(fen)
+        loaded.append(gs)
+    full = timeIt(lambda: [gs.computeMaterial() for gs in loaded], 5) / count
+    single = timeIt(lambda: [engine.evaluate(gs) for gs in loaded], 5) / count
+    batch = timeIt(lambda: evaluation.evaluateBatch(boards, whiteToMove, mobility), 5) / count
+    encode = timeIt(lambda: evaluation.encodePositions(loaded), 5) / count
+    print("evaluation {a} positions  full {b:6.2f} us  incremental {c:6.2f} us  batch {d:6.2f} us  encoding {e:6.2f} us  per position".format(
+        a=count, b=full*1e6, c=single*1e6, d=batch*1e6, e=encode*1e6))
+
+    # The cost the accumulator adds to making and taking back a move
+    gs = makePosition(POSITIONS["italian"])
+    moves = rules.legalMoves(gs)
+    def makeAll():
+        for move in moves:
+            gs.makeMove(*move)
+            gs.unmakeMove()
+    plain = timeIt(makeAll, 20) / len(moves)
+    evaluation.Accumulator().attach(gs)
+    followed = timeIt(makeAll, 20) / len(moves)
+    print("evaluation makeMove+unmakeMove {a:6.1f} us, following an accumulator {b:6.1f} us".format(
+        a=plain*1e6, b=followed*1e6))
+    return
+
+def benchParallel(depth=3):
+    '''
+    Compares the time to reach a fixed depth with one process against the parallel search
+    with an increasing number of workers
+    '''
+    counts = [1]
+    while counts[-1] * 2 <= (os.cpu_count() or 1):
+        counts.append(counts[-1] * 2)
+    for name, moves in POSITIONS.items():
+        gs = makePosition(moves)
+        result = engine.Engine().search(gs, depth)
+        print("parallel {a:8} single   {b:7.2f} s".format(a=name, b=result.elapsed))
+        for workers in counts:
+            searcher = parallel.ParallelSearch(workers)
+            searcher.search(gs, 1) # Start the worker processes before timing
+            result = searcher.search(gs, depth)
+            searcher.close()
+            print("parallel {a:8} {b:2} cores {c:7.2f} s  {d}".format(
+                a=name, b=workers, c=result.elapsed, d=result))
+    return
+
+BENCHMARKS = {
+    "status": benchStatus,
+    "backend": benchBackends,
+    "pieces": benchPieces,
+    "render": benchRender,
+    "sprites": benchSprites,
+    "makemove": benchMakeMove,
+    "memory": benchMemory,
+    "fen": benchFen,
+    "imports": benchImports,
+    "engine": benchEngine,
+    "evaluation": benchEvaluation,
+    "parallel": benchParallel
+}
+
+def main(names):
+    '''
+    Runs the named benchmarks, or all of them. Returns 1 if any check made along the way failed
+        List names: Keys of BENCHMARKS
+    '''
+    status = 0
+    for name in names or BENCHMARKS:
+        # Benchmarks which also check something return False when it fails
+        if BENCHMARKS[name]() is False:
+            status = 1
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,209 @@
+'''
+Bitboard move generation. Square (r, f) of the board is bit r*8 + f of each bitboard,
+so bit 0 is a8 and bit 63 is h1. Produces exactly the same moves as the Piece classes.
+'''
+from piece import NAMES
+
+INDEX = {name: i for i, name in enumerate(NAMES)}
+SQUARES = [(sq // 8, sq % 8) for sq in range(64)]
+FULL = (1 << 64) - 1
+
+def makeLeaperTable(steps):
+    '''
+    Returns a list of bitboards of the squares a piece taking the given steps attacks from each square
+        List steps: (rank, file) offsets the piece can jump by
+    '''
+    table = []
+    for r, f in SQUARES:
+        bb = 0
+        for dr, df in steps:
+            if 0 <= r + dr <= 7 and 0 <= f + df <= 7:
+                bb |= 1 << ((r + dr) * 8 + f + df)
+        table.append(bb)
+    return table
+
+def makeRayTable(dr, df):
+    '''
+    Returns a list of bitboards of every square in one direction from each square
+        Int dr: The rank step of the direction
+        Int df: The file step of the direction
+    '''
+    table = []
+    for r, f in SQUARES:
+        bb = 0
+        i = 1
+        while 0 <= r + i*dr <= 7 and 0 <= f + i*df <= 7:
+            bb |= 1 << ((r + i*dr) * 8 + f + i*df)
+            i += 1
+        table.append(bb)
+    return table
+
+KNIGHT = makeLeaperTable([(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)])
+KING = makeLeaperTable([(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)])
+
+# Rays are split by whether the squares along them increase or decrease in index,
+# which decides whether the nearest blocker is the lowest or highest set bit
+DIAGONALS_UP = [makeRayTable(1, 1), makeRayTable(1, -1)]
+DIAGONALS_DOWN = [makeRayTable(-1, 1), makeRayTable(-1, -1)]
+STRAIGHTS_UP = [makeRayTable(1, 0), makeRayTable(0, 1)]
+STRAIGHTS_DOWN = [makeRayTable(-1, 0), makeRayTable(0, -1)]
+
+def slide(sq, occupied, up, down):
+    '''
+    Returns the bitboard of squares reached along the given rays, up to and including the first blocker
+        Int sq: The square the piece is on
+        Int occupied: Bitboard of every square holding a piece
+        List up: Ray tables running towards higher squares
+        List down: Ray tables running towards lower squares
+    '''
+    attacks = 0
+    for table in up:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= table[(blockers & -blockers).bit_length() - 1]
+        attacks |= ray
+    for table in down:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= table[blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+def squares(bb):
+    '''
+    Returns the positions of every set bit of a bitboard
+        Int bb: The bitboard
+    '''
+    positions = []
+    while bb:
+        low = bb & -bb
+        positions.append(SQUARES[low.bit_length() - 1])
+        bb ^= low
+    return positions
+
+class Position:
+    def __init__(self, board):
+        '''
+        Bitboard copy of a board, kept in sync through setSquare
+            List board: A list of lists of pieces, each corresponding to a rank
+        '''
+        self.pieces = [0] * 12      # One bitboard per piece name, in the order of NAMES
+        self.colours = [0, 0]       # Occupancy of white and black
+        self.passant = 0            # En passant placeholders ("-e")
+        self.unmoved = 0            # Pieces that have not moved yet
+        self.codes = [-1] * 64      # Index into NAMES of the piece on each square
+        for r in range(8):
+            for f in range(8):
+                self.setSquare((r, f), board[r][f])
+
+    def setSquare(self, pos, p):
+        '''
+        Records that the piece p now stands at pos
+            Tuple pos: The position on the board
+            Piece p: The piece now on that square
+        '''
+        sq = pos[0]*8 + pos[1]
+        bit = 1 << sq
+        old = self.codes[sq]
+        if old >= 0:
+            self.pieces[old] &= ~bit
+            self.colours[old // 6] &= ~bit
+        self.passant &= ~bit
+        self.unmoved &= ~bit
+
+        name = p.getName()
+        if name[0] == "-":
+            self.codes[sq] = -1
+            if name[1] == "e":
+                self.passant |= bit
+        else:
+            code = INDEX[name]
+            self.codes[sq] = code
+            self.pieces[code] |= bit
+            self.colours[code // 6] |= bit
+            if not p.hasMoved():
+                self.unmoved |= bit
+        return
+
+    def attacks(self, sq):
+        '''
+        Returns the bitboard of moves of the piece on a square, matching its checkValidMoves
+            Int sq: The square of the piece
+        '''
+        code = self.codes[sq]
+        if code < 0:
+            return 0
+        side = code // 6
+        kind = code % 6
+        own = self.colours[side]
+        occupied = self.colours[0] | self.colours[1]
+        bit = 1 << sq
+
+        if kind == 0:   # Pawn
+            empty = ~(occupied | self.passant) & FULL
+            captures = self.colours[1 - side] | self.passant
+            f = sq % 8
+            if side == 0:
+                push = (bit >> 8) & empty
+                moves = push
+                if f > 0:
+                    moves |= (bit >> 9) & captures
+                if f < 7:
+                    moves |= (bit >> 7) & captures
+                if push and bit & self.unmoved:
+                    moves |= (push >> 8) & empty
+            else:
+                push = (bit << 8) & empty
+                moves = push
+                if f > 0:
+                    moves |= (bit << 7) & captures
+                if f < 7:
+                    moves |= (bit << 9) & captures
+                if push and bit & self.unmoved:
+                    moves |= (push << 8) & empty
+            return moves
+        elif kind == 1: # Knight
+            return KNIGHT[sq] & ~own
+        elif kind == 2: # Bishop
+            return slide(sq, occupied, DIAGONALS_UP, DIAGONALS_DOWN) & ~own
+        elif kind == 3: # Rook
+            return slide(sq, occupied, STRAIGHTS_UP, STRAIGHTS_DOWN) & ~own
+        elif kind == 4: # Queen
+            return (slide(sq, occupied, DIAGONALS_UP, DIAGONALS_DOWN) |
+                    slide(sq, occupied, STRAIGHTS_UP, STRAIGHTS_DOWN)) & ~own
+
+        # King
+        moves = KING[sq] & ~own
+        if bit & self.unmoved:
+            rooks = (self.pieces[3] | self.pieces[9]) & self.unmoved
+            rank = sq - sq % 8
+            empty = ~(occupied | self.passant) & FULL
+            kingside = (1 << (rank+5)) | (1 << (rank+6))
+            if empty & kingside == kingside and rooks & (1 << (rank+7)):
+                moves |= 1 << (rank+6)
+            queenside = (1 << (rank+1)) | (1 << (rank+2)) | (1 << (rank+3))
+            if empty & queenside == queenside and rooks & (1 << rank):
+                moves |= 1 << (rank+2)
+        return moves
+
+    def checkValidMoves(self, pos):
+        '''
+        Returns the moves of the piece at pos as a list of positions
+            Tuple pos: The position of the piece
+        '''
+        return squares(self.attacks(pos[0]*8 + pos[1]))
+
+    def potentialMoves(self):
+        '''
+        Returns the sets of squares white and black can move to, like GameState.updatePotentialMoves
+        '''
+        moves = [0, 0]
+        for side in range(2):
+            bb = self.colours[side]
+            while bb:
+                low = bb & -bb
+                moves[side] |= self.attacks(low.bit_length() - 1)
+                bb ^= low
+        return set(squares(moves[0])), set(squares(moves[1]))
@@ -0,0 +1,409 @@
+'''
+A Chess engine: iterative deepening negamax alpha-beta search over a GameState, with
+quiescence search, a transposition table and MVV-LVA, killer and history move ordering.
+'''
+import time
+import rules
+from material import VALUES
+
+MATE = 100000
+MATE_BOUND = MATE - 1000    # Scores beyond this are mates
+INFINITY = MATE + 1
+
+# Transposition table entry flags
+EXACT = 0
+LOWER = 1   # The score is at least this (the search failed high)
+UPPER = 2   # The score is at most this (the search failed low)
+
+def evaluate(gs):
+    '''
+    Returns the static evaluation of the position in centipawns from the side to move's view
+        GameState gs: The current Game State object
+    '''
+    # GameState keeps the material and piece-square score up to date as pieces move
+    if gs.whitesTurn():
+        return gs.getMaterial()
+    return -gs.getMaterial()
+
+def capturedPiece(board, move):
+    '''
+    Returns the type of piece a move captures, e.g. "N", or None if it is not a capture
+        List board: A list of lists of pieces, each corresponding to a rank
+        Tuple move: A (from, to, promotion) tuple
+    '''
+    name = board[move[1][0]][move[1][1]].getName()
+    if name[0] != "-":
+        return name[1]
+    if name[1] == "e" and board[move[0][0]][move[0][1]].getName()[1] == "p":
+        return "p"
+    return None
+
+class SearchResult:
+    def __init__(self, move, score, depth, nodes, elapsed, pv):
+        '''
+        The outcome of a search, or of one iteration of it
+            Tuple move: The best move found, as a (from, to, promotion) tuple
+            Int score: Its score in centipawns from the side to move's view
+            Int depth: The depth fully searched
+            Int nodes: The number of nodes visited
+            Float elapsed: The time taken in seconds
+            List pv: The principal variation, starting with move
+        '''
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.nps = int(nodes / max(elapsed, 1e-9))
+        self.pv = pv
+
+    def __str__(self):
+        return "depth {a} score {b} nodes {c} nps {d} time {e:.2f} pv {f}".format(
+            a=self.depth, b=self.score, c=self.nodes, d=self.nps, e=self.elapsed,
+            f=" ".join(rules.moveName(m) for m in self.pv))
+
+class Engine:
+    def __init__(self, tableSize=1 << 18):
+        '''
+        A searcher which keeps its transposition table and move ordering data between searches
+            Int tableSize: The number of entries in the transposition table
+        '''
+        self.tableSize = tableSize
+        self.table = [None] * tableSize     # (key, depth, score, flag, move, age) entries
+        self.age = 0                        # Which search an entry was stored by
+        self.killers = []                   # Two quiet moves per ply which caused cutoffs
+        self.history = {}                   # (from, to) -> how often a quiet move caused a cutoff
+        self.nodes = 0
+        self.stopped = False
+        self.deadline = None
+        self.maxNodes = None
+        self.rootMove = None                # Best move of the last root search
+        self.previous = set()               # Keys of positions played before the searched one
+        self.stopEvent = None               # multiprocessing.Event which stops the search when set
+        self.sharedNodes = None             # multiprocessing.Value of the nodes every process has
+                                            # searched, counted against maxNodes instead of nodes
+        self.counted = 0                    # Nodes of this search already added to sharedNodes
+
+    def stop(self):
+        '''
+        Asks a running search to finish as soon as possible; it returns the best move found so far
+        '''
+        self.stopped = True
+        return
+
+    def clear(self):
+        '''
+        Forgets everything learned from earlier searches
+        '''
+        self.table = [None] * self.tableSize
+        self.history = {}
+        return
+
+    def hashfull(self):
+        '''
+        Returns how full the transposition table is, in thousandths, from a sample of entries
+        '''
+        sample = self.table[:1000]
+        return sum(1 for entry in sample if entry is not None and entry[5] == self.age) * 1000 // len(sample)
+
+    def search(self, gs, depth=64, movetime=None, nodes=None, info=None):
+        '''
+        Searches the position by iterative deepening until a budget runs out and returns a
+        SearchResult for the deepest iteration completed
+            GameState gs: The position to search; it is left as it was found
+            Int depth: The deepest iteration to run
+            Float movetime: The number of seconds to stop after, or None
+            Int nodes: The number of nodes to stop after, or None
+            Function info: Called with a SearchResult after each completed iteration
+        '''
+        start = time.perf_counter()
+        self.prepare(depth, movetime, nodes)
+
+        moves = rules.legalMoves(gs)
+        if not moves:
+            return SearchResult(None, 0, 0, 0, 0, [])
+        result = SearchResult(moves[0], 0, 0, 0, 0, [moves[0]])
+
+        for d in range(1, depth + 1):
+            score = self.negamax(gs, d, -INFINITY, INFINITY, 0)
+            if self.stopped:
+                break
+            pv = self.principalVariation(gs, d)
+            if not pv or pv[0] != self.rootMove:
+                pv = [self.rootMove]
+            result = SearchResult(self.rootMove, score, d, self.nodes, time.perf_counter() - start, pv)
+            if info is not None:
+                info(result)
+            # No point searching deeper once a forced mate has been found
+            if abs(score) > MATE_BOUND:
+                break
+
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        result.nps = int(result.nodes / max(result.elapsed, 1e-9))
+        return result
+
+    def prepare(self, depth, movetime, nodes):
+        '''
+        Resets the counters and budget at the start of a search
+            Int depth: The deepest iteration that will be run
+            Float movetime: The number of seconds to stop after, or None
+            Int nodes: The number of nodes to stop after, or None
+        '''
+        self.nodes = 0
+        self.counted = 0
+        self.stopped = False
+        self.age += 1
+        self.killers = [[None, None] for i in range(depth + 64)]
+        self.maxNodes = nodes
+        if movetime is None:
+            self.deadline = None
+        else:
+            self.deadline = time.perf_counter() + movetime
+        return
+
+    def countNodes(self):
+        '''
+        Returns the nodes counted against maxNodes, first adding those searched since the last
+        call to sharedNodes if the budget is shared with other processes
+        '''
+        if self.sharedNodes is None:
+            return self.nodes
+        with self.sharedNodes.get_lock():
+            self.sharedNodes.value += self.nodes - self.counted
+            used = self.sharedNodes.value
+        self.counted = self.nodes
+        return used
+
+    def checkBudget(self):
+        '''
+        Stops the search if it is out of time or nodes
+        '''
+        if self.maxNodes is not None and self.countNodes() >= self.maxNodes:
+            self.stopped = True
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.stopped = True
+        if self.stopEvent is not None and self.stopEvent.is_set():
+            self.stopped = True
+        return
+
+    def isRepetition(self, gs):
+        '''
+        Returns whether the position has occurred before, which the search scores as a draw
+            GameState gs: The current Game State object
+        '''
+        key = gs.getZobrist()
+        if key in self.previous:
+            return True
+        # Positions before the last capture or pawn move cannot be the same
+        for record in gs.history[max(len(gs.history) - gs.halfmoves, 0):]:
+            if record.zobrist == key:
+                return True
+        return False
+
+    def probe(self, key):
+        '''
+        Returns the transposition table entry for a key, or None
+            Int key: The Zobrist key of the position
+        '''
+        entry = self.table[key % self.tableSize]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, score, flag, move, ply):
+        '''
+        Stores a search result, replacing the entry in its slot unless that entry is from this
+        search and was searched deeper
+            Int key: The Zobrist key of the position
+            Int depth: The depth searched
+            Int score: The score found
+            Int flag: EXACT, LOWER or UPPER
+            Tuple move: The best move found, or None
+            Int ply: The distance from the root, to store mate scores relative to this position
+        '''
+        index = key % self.tableSize
+        old = self.table[index]
+        if old is not None and old[5] == self.age and old[1] > depth and old[0] != key:
+            return
+        if score > MATE_BOUND:
+            score += ply
+        elif score < -MATE_BOUND:
+            score -= ply
+        self.table[index] = (key, depth, score, flag, move, self.age)
+        return
+
+    def orderMoves(self, gs, moves, ttMove, ply):
+        '''
+        Sorts moves so the most promising are searched first: the transposition table move,
+        captures by most valuable victim then least valuable attacker, killers, then history
+            GameState gs: The current Game State object
+            List moves: The legal moves of the position
+            Tuple ttMove: The best move stored for the position, or None
+            Int ply: The distance from the root
+        '''
+        board = gs.getBoard()
+        killers = self.killers[ply]
+        scores = {}
+        for move in moves:
+            if move == ttMove:
+                scores[move] = 1000000
+                continue
+            victim = capturedPiece(board, move)
+            if victim is not None:
+                attacker = board[move[0][0]][move[0][1]].getName()[1]
+                scores[move] = 100000 + VALUES[victim] * 10 - VALUES[attacker] // 100
+            elif move[2] is not None:
+                scores[move] = 90000 + VALUES[move[2][1]]
+            elif move == killers[0]:
+                scores[move] = 80000
+            elif move == killers[1]:
+                scores[move] = 79000
+            else:
+                scores[move] = self.history.get((move[0], move[1]), 0)
+        moves.sort(key=scores.get, reverse=True)
+        return moves
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        '''
+        Returns the score of the position searched to the given depth with alpha-beta pruning
+            GameState gs: The current Game State object
+            Int depth: The remaining depth
+            Int alpha: The score the side to move is already guaranteed
+            Int beta: The score the opponent is already guaranteed
+            Int ply: The distance from the root
+        '''
+        if gs.whitesTurn():
+            colour = "w"
+        else:
+            colour = "b"
+        check = gs.inCheck(colour)
+        # Look one ply further when in check so mates are not missed at the horizon
+        if check:
+            depth += 1
+        if depth <= 0:
+            return self.quiesce(gs, alpha, beta, ply)
+
+        self.nodes += 1
+        if self.nodes & 255 == 0:
+            self.checkBudget()
+        if ply > 0 and (gs.halfmoves >= 100 or self.isRepetition(gs)):
+            return 0
+
+        key = gs.getZobrist()
+        entry = self.probe(key)
+        ttMove = None
+        if entry is not None:
+            ttMove = entry[4]
+            if ply > 0 and entry[1] >= depth:
+                score = entry[2]
+                if score > MATE_BOUND:
+                    score -= ply
+                elif score < -MATE_BOUND:
+                    score += ply
+                if entry[3] == EXACT:
+                    return score
+                elif entry[3] == LOWER and score >= beta:
+                    return score
+                elif entry[3] == UPPER and score <= alpha:
+                    return score
+
+        moves = rules.legalMoves(gs)
+        if not moves:
+            if check:
+                return -MATE + ply
+            return 0
+        self.orderMoves(gs, moves, ttMove, ply)
+
+        alphaOrig = alpha
+        best = -INFINITY
+        bestMove = None
+        board = gs.getBoard()
+        for move in moves:
+            quiet = capturedPiece(board, move) is None and move[2] is None
+            gs.makeMove(*move)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.unmakeMove()
+            if self.stopped:
+                return 0
+            if score > best:
+                best = score
+                bestMove = move
+                if ply == 0:
+                    self.rootMove = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if quiet:
+                    killers = self.killers[ply]
+                    if killers[0] != move:
+                        killers[1] = killers[0]
+                        killers[0] = move
+                    self.history[(move[0], move[1])] = self.history.get((move[0], move[1]), 0) + depth * depth
+                break
+
+        if best <= alphaOrig:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.store(key, depth, best, flag, bestMove, ply)
+        return best
+
+    def quiesce(self, gs, alpha, beta, ply):
+        '''
+        Returns the score of the position once captures have been played out, so the search
+        does not stop in the middle of an exchange
+            GameState gs: The current Game State object
+            Int alpha: The score the side to move is already guaranteed
+            Int beta: The score the opponent is already guaranteed
+            Int ply: The distance from the root
+        '''
+        self.nodes += 1
+        if self.nodes & 255 == 0:
+            self.checkBudget()
+
+        standPat = evaluate(gs)
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+
+        board = gs.getBoard()
+        captures = []
+        for move in rules.legalMoves(gs):
+            if move[2] is not None or capturedPiece(board, move) is not None:
+                captures.append(move)
+        self.orderMoves(gs, captures, None, ply)
+
+        for move in captures:
+            gs.makeMove(*move)
+            score = -self.quiesce(gs, -beta, -alpha, ply + 1)
+            gs.unmakeMove()
+            if self.stopped:
+                return 0
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def principalVariation(self, gs, depth):
+        '''
+        Returns the line of best moves stored in the transposition table from the position
+            GameState gs: The current Game State object
+            Int depth: The longest line to return
+        '''
+        pv = []
+        seen = set()
+        while len(pv) < depth and gs.getZobrist() not in seen:
+            seen.add(gs.getZobrist())
+            entry = self.probe(gs.getZobrist())
+            if entry is None or entry[4] is None or entry[4] not in rules.legalMoves(gs):
+                break
+            pv.append(entry[4])
+            gs.makeMove(*entry[4])
+        for move in pv:
+            gs.unmakeMove()
+        return pv
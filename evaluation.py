@@ -0,0 +1,273 @@
+'''
+A static evaluation over NumPy arrays, for scoring many positions at once in training and
+analysis jobs. Each position is encoded as 64 bytes, the mailbox120 code of every square
+without its MOVED bit, and a batch of positions is one (N, 64) array scored with
+whole-array operations. Only the first term, material and piece-square tables from
+material.SCORES, is shared with engine.evaluate, which scores nothing else; mobility from
+whiteMoves/blackMoves and doubled, isolated and passed pawns are this module's own, so its
+scores differ from the engine's by them. A single position is scored from the material
+GameState keeps up to date and pawn structures cached by pawn key, and Accumulator follows
+a GameState's board as the first layer of an NNUE-style network.
+
+    python evaluation.py suite.epd > labelled.epd     Adds "ce <score>" to every position
+'''
+import sys
+import time
+import numpy as np
+import material
+import mailbox120
+from piece import NAMES
+
+MOBILITY = 2            # Centipawns for each square a side's pieces can move to
+DOUBLED_PAWN = -10      # For each pawn on a file after the first
+ISOLATED_PAWN = -15     # For each pawn with no pawns of its colour on the files beside it
+# For a white pawn with no black pawns ahead of it on its own file or those beside it, by
+# rank from the 8th; black pawns use the same bonuses from the 1st
+PASSED_PAWN = [0, 90, 60, 35, 20, 10, 5, 0]
+CHUNK = 4096            # Positions encoded at a time when scoring a stream of them
+PAWN_CACHE_SIZE = 1 << 16   # Pawn structures remembered by evaluate
+HIDDEN = 256            # Size of the accumulator's layer with random weights
+ACTIVATION_LIMIT = 127  # The clipped ReLU on the accumulator
+OUTPUT_SCALE = 1024     # Divides the network's output to give centipawns
+
+WHITE_PAWN = mailbox120.CODE_OF["wp"]
+BLACK_PAWN = mailbox120.CODE_OF["bp"]
+ROWS = np.arange(8).reshape(1, 8, 1)    # The rank of each square of an (N, 8, 8) board, from the 8th
+
+# The material and piece-square score of each code on each square, from material.SCORES
+PIECE_SQUARES = np.array([material.SCORES[name] for name in mailbox120.CODES], np.int32)
+
+PAWN_CACHE = {}         # Pawn key -> pawn structure score, from white's view
+
+# The inputs of the accumulator are ordered by piece, then square
+FEATURES = {name: i for i, name in enumerate(NAMES)}
+FLIPPED = {name: {"w": "b", "b": "w"}[name[0]] + name[1] for name in NAMES}
+
+def encodePositions(states):
+    '''
+    Returns (boards, whiteToMove, mobility) for an iterable of GameStates: an (N, 64) uint8
+    array of square codes, an (N,) bool array and an (N, 2) int16 array of the number of
+    squares white and black can move to. Each GameState is read as it comes, so the same
+    one may be returned again set up with the next position, as by positions.readFens
+        Iterable states: The positions
+    '''
+    codes = mailbox120.CODE_OF
+    data = bytearray()
+    whiteToMove = []
+    mobility = []
+    for gs in states:
+        # Read straight off the board rather than through pack, as whether a piece has
+        # moved does not change its score
+        data += bytes([codes[p.name] for rank in gs.board for p in rank])
+        whiteToMove.append(gs.whitesTurn())
+        mobility.append((len(gs.getPotentialMoves("w")), len(gs.getPotentialMoves("b"))))
+    boards = np.frombuffer(bytes(data), np.uint8).reshape(-1, 64)
+    return boards, np.array(whiteToMove, bool), np.array(mobility, np.int16).reshape(-1, 2)
+
+def materialScores(boards):
+    '''
+    Returns the material and piece-square score of each board, from white's view
+        Array boards: (N, 64) square codes
+    '''
+    return PIECE_SQUARES[boards, np.arange(64)].sum(axis=1, dtype=np.int32)
+
+def neighbours(files, combine):
+    '''
+    Returns, for each file, a value combined from the files either side of it
+        Array files: (N, 8) values by file
+        Function combine: How two values are combined, e.g. np.maximum
+    '''
+    result = np.empty_like(files)
+    result[:, 0] = files[:, 1]
+    result[:, 7] = files[:, 6]
+    result[:, 1:7] = combine(files[:, :6], files[:, 2:])
+    return result
+
+def pawnScores(boards):
+    '''
+    Returns the score for the pawn structure of each board, from white's view
+        Array boards: (N, 64) square codes
+    '''
+    white = (boards == WHITE_PAWN).reshape(-1, 8, 8)
+    black = (boards == BLACK_PAWN).reshape(-1, 8, 8)
+    whiteFiles = white.sum(axis=1, dtype=np.int32)
+    blackFiles = black.sum(axis=1, dtype=np.int32)
+
+    doubled = np.maximum(whiteFiles - 1, 0) - np.maximum(blackFiles - 1, 0)
+    isolated = (whiteFiles * (neighbours(whiteFiles, np.maximum) == 0)
+        - blackFiles * (neighbours(blackFiles, np.maximum) == 0))
+
+    # The most advanced enemy pawn on each file and the files beside it: a pawn is passed if
+    # none is ahead of it
+    blackFront = np.where(black, ROWS, 8).min(axis=1)
+    blackFront = np.minimum(blackFront, neighbours(blackFront, np.minimum))
+    whiteFront = np.where(white, ROWS, -1).max(axis=1)
+    whiteFront = np.maximum(whiteFront, neighbours(whiteFront, np.maximum))
+    bonus = np.array(PASSED_PAWN, np.int32).reshape(1, 8, 1)
+    passed = ((white & (blackFront[:, None, :] >= ROWS)) * bonus
+        - (black & (whiteFront[:, None, :] <= ROWS)) * bonus[:, ::-1]).sum(axis=(1, 2))
+
+    return (doubled.sum(axis=1) * DOUBLED_PAWN + isolated.sum(axis=1) * ISOLATED_PAWN + passed).astype(np.int32)
+
+def evaluateBatch(boards, whiteToMove, mobility):
+    '''
+    Returns an (N,) int32 array of the static evaluation of each position in centipawns,
+    from the side to move's view
+        Array boards: (N, 64) square codes, as returned by encodePositions
+        Array whiteToMove: (N,) whether it is white's turn
+        Array mobility: (N, 2) squares white and black can move to
+    '''
+    scores = materialScores(boards) + pawnScores(boards)
+    scores += (mobility[:, 0].astype(np.int32) - mobility[:, 1]) * MOBILITY
+    return np.where(whiteToMove, scores, -scores)
+
+def pawnScore(gs):
+    '''
+    Returns the score for the pawn structure of one position from white's view, remembered
+    by the position's pawn key as pawns move far less often than the other pieces
+        GameState gs: The current Game State object
+    '''
+    key = gs.getPawnKey()
+    if key not in PAWN_CACHE:
+        if len(PAWN_CACHE) >= PAWN_CACHE_SIZE:
+            PAWN_CACHE.clear()
+        PAWN_CACHE[key] = int(pawnScores(encodePositions([gs])[0])[0])
+    return PAWN_CACHE[key]
+
+def evaluate(gs):
+    '''
+    Returns the static evaluation of one position in centipawns from the side to move's view,
+    the same as evaluateBatch but from the terms GameState keeps up to date
+        GameState gs: The current Game State object
+    '''
+    score = gs.getMaterial() + pawnScore(gs)
+    score += (len(gs.getPotentialMoves("w")) - len(gs.getPotentialMoves("b"))) * MOBILITY
+    if gs.whitesTurn():
+        return score
+    return -score
+
+class Accumulator:
+    def __init__(self, weights=None, hidden=HIDDEN, seed=0):
+        '''
+        The first layer of an NNUE-style network, kept up to date with a GameState's board: one
+        input for each piece on each square, and for each side a sum of the weights of the
+        inputs present as that side sees the board, changed by a row or two as pieces move
+            Dict weights: "features" (768, hidden), "bias" (hidden,), "output" (2 * hidden,)
+                          and "outputBias" integer arrays, e.g. from np.load; None for random
+                          weights to time it with
+            Int hidden: The size of the layer when the weights are random
+            Int seed: Picks the random weights
+        '''
+        if weights is None:
+            rng = np.random.default_rng(seed)
+            weights = {"features": rng.integers(-64, 64, (len(FEATURES) * 64, hidden)),
+                "bias": rng.integers(-64, 64, hidden), "output": rng.integers(-64, 64, 2 * hidden),
+                "outputBias": 0}
+        self.features = np.asarray(weights["features"], np.int32)
+        self.bias = np.asarray(weights["bias"], np.int32)
+        self.output = np.asarray(weights["output"], np.int32)
+        self.outputBias = int(weights["outputBias"])
+        self.values = np.zeros((2, len(self.bias)), np.int32)  # White's and black's sums
+
+    def attach(self, gs):
+        '''
+        Starts following the board of a GameState
+            GameState gs: The position to follow
+        '''
+        gs.accumulator = self
+        # A GameState with no position yet is followed from when one is set up
+        if gs.getBoard():
+            self.refresh(gs.getBoard())
+        return
+
+    def inputs(self, name, pos):
+        '''
+        Returns the rows of the weights for a piece on a square, as white and as black see it:
+        black sees the board flipped with the colours swapped, so both sides share the weights
+            String name: The name of the piece
+            Tuple pos: The position of the piece
+        '''
+        sq = pos[0]*8 + pos[1]
+        return [FEATURES[name]*64 + sq, FEATURES[FLIPPED[name]]*64 + (sq ^ 56)]
+
+    def compute(self, board):
+        '''
+        Returns the sums for a board worked out from scratch
+            List board: A list of lists of pieces, each corresponding to a rank
+        '''
+        values = np.tile(self.bias, (2, 1))
+        for r in range(8):
+            for f in range(8):
+                name = board[r][f].getName()
+                if name in FEATURES:
+                    values += self.features[self.inputs(name, (r, f))]
+        return values
+
+    def refresh(self, board):
+        self.values = self.compute(board)
+        return
+
+    def check(self, board):
+        return np.array_equal(self.values, self.compute(board))
+
+    def setSquare(self, pos, old, new):
+        '''
+        Called by GameState as a square changes
+            Tuple pos: The square
+            String old: The name of the piece that was there
+            String new: The name of the piece placed
+        '''
+        if old in FEATURES:
+            self.values -= self.features[self.inputs(old, pos)]
+        if new in FEATURES:
+            self.values += self.features[self.inputs(new, pos)]
+        return
+
+    def evaluate(self, gs):
+        '''
+        Returns the network's output from the side to move's view
+            GameState gs: The position being followed
+        '''
+        if gs.whitesTurn():
+            ours, theirs = self.values
+        else:
+            theirs, ours = self.values
+        layer = np.clip(np.concatenate([ours, theirs]), 0, ACTIVATION_LIMIT)
+        return int(layer @ self.output + self.outputBias) // OUTPUT_SCALE
+
+def evaluateStream(states, chunk=CHUNK):
+    '''
+    Generates the evaluation of each position of an iterable of GameStates, encoding and
+    scoring them a chunk at a time so a stream of any length takes little memory
+        Iterable states: The positions, e.g. from positions.readFens
+        Int chunk: The number of positions scored in one call
+    '''
+    states = iter(states)
+    while True:
+        batch = encodePositions(gs for i, gs in zip(range(chunk), states))
+        if len(batch[0]) == 0:
+            break
+        for score in evaluateBatch(*batch).tolist():
+            yield score
+    return
+
+def main(argv):
+    # Imported here as only labelling files needs it
+    import positions
+    for path in argv:
+        count = 0
+        start = time.perf_counter()
+        with open(path) as f:
+            # The lines readFens loads, so each score can be written after its own position
+            fens = [line.split(";")[0].split()[:4] for line in f]
+        fens = [" ".join(fields) for fields in fens if fields and not fields[0].startswith("#")]
+        for fen, score in zip(fens, evaluateStream(positions.readFens(fens))):
+            print("{a} ce {b};".format(a=fen, b=score))
+            count += 1
+        elapsed = time.perf_counter() - start
+        print("{a}: {b} positions in {c:.2f} s, {d:.0f} positions/s".format(
+            a=path, b=count, c=elapsed, d=count / max(elapsed, 1e-9)), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,223 @@
+'''
+An opening explorer: for every position reached in the games of an archive, which moves
+were played there, how often, and how they scored. Records are sorted by the position's
+Zobrist key in a file of fixed-size records, so a lookup is a binary search through mmap.
+
+Building streams the games once, sorting records in memory in runs of a fixed size which
+are written to temporary files, then merges the runs, so it works on collections larger
+than memory.
+
+    python explorer.py build games.cga games.idx    Indexes an archive
+    python explorer.py bench games.idx games.cga    Times lookups of positions from the games
+'''
+import os
+import sys
+import time
+import mmap
+import heapq
+import random
+import struct
+import tempfile
+import archive
+from gamestate import GameState
+
+# One occurrence of a move while building: key, move code, result
+RUN = struct.Struct("<QHB")
+# One move of the index: key, move code, white wins, draws, black wins, games
+RECORD = struct.Struct("<QHIIII")
+RESULTS = {"1-0": 0, "1/2-1/2": 1, "0-1": 2}
+UNKNOWN = 3
+
+def writeRun(records, directory):
+    '''
+    Sorts some records and writes them to a temporary file, returning its path
+        List records: (key, move code, result) tuples
+        String directory: Where to put the file
+    '''
+    records.sort()
+    fd, path = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        f.write(b"".join(RUN.pack(*record) for record in records))
+    return path
+
+def readRun(path, chunk=1 << 16):
+    '''
+    Generates the records of a run file in order
+        String path: The run file
+        Int chunk: The number of records to read at a time
+    '''
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(RUN.size * chunk)
+            if not data:
+                break
+            for record in RUN.iter_unpack(data):
+                yield record
+    return
+
+def buildIndex(archivePath, indexPath, runSize=1 << 20, directory=None):
+    '''
+    Indexes every position of the games in an archive. Returns the number of moves indexed
+        String archivePath: The game archive to read
+        String indexPath: The index file to create
+        Int runSize: The number of records sorted in memory at once
+        String directory: Where to put temporary files, by default next to the index
+    '''
+    if directory is None:
+        directory = os.path.dirname(os.path.abspath(indexPath))
+    games = archive.Archive(archivePath)
+    gs = GameState()
+    runs = []
+    records = []
+    for i in range(len(games)):
+        tags, fen = games.tags(i)
+        result = RESULTS.get(tags.get("Result"), UNKNOWN)
+        if fen is None:
+            gs.makeDefaultBoard()
+        else:
+            gs.loadFen(fen)
+        for code in games.codes(i):
+            records.append((gs.getZobrist(), code, result))
+            gs.makeMove(*archive.decodeMove(code, gs.whitesTurn()))
+        if len(records) >= runSize:
+            runs.append(writeRun(records, directory))
+            records = []
+    games.close()
+    if records:
+        runs.append(writeRun(records, directory))
+
+    # Merge the runs, adding up the records of each move in each position
+    count = 0
+    with open(indexPath, "wb") as out:
+        current = None
+        totals = [0, 0, 0, 0]
+        for key, code, result in heapq.merge(*[readRun(path) for path in runs]):
+            if (key, code) != current:
+                if current is not None:
+                    out.write(RECORD.pack(current[0], current[1], *totals))
+                    count += 1
+                current = (key, code)
+                totals = [0, 0, 0, 0]
+            if result != UNKNOWN:
+                totals[result] += 1
+            totals[3] += 1
+        if current is not None:
+            out.write(RECORD.pack(current[0], current[1], *totals))
+            count += 1
+    for path in runs:
+        os.remove(path)
+    return count
+
+class PositionIndex:
+    def __init__(self, path):
+        '''
+        Lookups in an index made by buildIndex
+            String path: The index file
+        '''
+        self.file = open(path, "rb")
+        size = os.path.getsize(path)
+        self.count = size // RECORD.size
+        self.data = None
+        if size:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+        self.file.close()
+        return
+
+    def find(self, key):
+        '''
+        Returns the number of the first record of a key, or of the first after it
+            Int key: The Zobrist key of a position
+        '''
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            if struct.unpack_from("<Q", self.data, middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def lookup(self, gs):
+        '''
+        Returns what was played in a position, most played first, as a list of
+        (move, games, white wins, draws, black wins) with moves as (from, to, promotion)
+            GameState gs: The position
+        '''
+        key = gs.getZobrist()
+        moves = []
+        i = self.find(key)
+        while i < self.count:
+            record = RECORD.unpack_from(self.data, i * RECORD.size)
+            if record[0] != key:
+                break
+            move = archive.decodeMove(record[1], gs.whitesTurn())
+            moves.append((move, record[5], record[2], record[3], record[4]))
+            i += 1
+        moves.sort(key=lambda m: m[1], reverse=True)
+        return moves
+
+def score(white, draws, black, whiteToMove):
+    '''
+    Returns the share of points the side to move scored, from 0 to 1
+        Int white: Games won by white
+        Int draws: Games drawn
+        Int black: Games won by black
+        Bool whiteToMove: Whether the side asking is white
+    '''
+    games = white + draws + black
+    if games == 0:
+        return 0.5
+    if whiteToMove:
+        return (white + draws / 2) / games
+    return (black + draws / 2) / games
+
+def benchLookups(indexPath, archivePath=None, samples=10000):
+    '''
+    Times lookups of positions from the starting position, or from random plies of an archive
+        String indexPath: The index to read
+        String archivePath: The archive the index was built from, or None
+        Int samples: The number of lookups
+    '''
+    index = PositionIndex(indexPath)
+    positions = []
+    if archivePath is not None:
+        games = archive.Archive(archivePath)
+        rng = random.Random(0)
+        for j in range(min(samples, 200)):
+            i = rng.randrange(len(games))
+            positions.append(games.position(i, rng.randrange(min(len(games.codes(i)), 20) + 1)))
+        games.close()
+    else:
+        gs = GameState()
+        gs.makeDefaultBoard()
+        positions.append(gs)
+
+    found = 0
+    start = time.perf_counter()
+    for j in range(samples):
+        found += len(index.lookup(positions[j % len(positions)]))
+    elapsed = time.perf_counter() - start
+    print("{a} records, {b} lookups: {c:.1f} us per lookup".format(
+        a=index.count, b=samples, c=elapsed / samples * 1e6))
+    index.close()
+    return
+
+def main(argv):
+    if len(argv) == 3 and argv[0] == "build":
+        start = time.perf_counter()
+        count = buildIndex(argv[1], argv[2])
+        print("{a} moves indexed in {b:.2f} s".format(a=count, b=time.perf_counter() - start))
+        return 0
+    elif len(argv) in [2, 3] and argv[0] == "bench":
+        benchLookups(*argv[1:])
+        return 0
+    print(__doc__)
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,26 +1,50 @@
+import os
+import time
 import pygame as pg
 # from pygame.math import enable_swizzling
 from gamestate import GameState
-import copy
+from rules import movePiece, promotePawn, playMove, filterValidMoves, updateGameStatus
+from explorer import PositionIndex, score
+from pgn import sanName
+import engine
+from sprites import SpriteCache
 
 #Globals
 WIDTH = 720
 HEIGHT = 720
 SQ_SIZE = HEIGHT // 8
+MIN_SQ_SIZE = 16
 MAX_FPS = 120
+IDLE_WAIT = 1000    # Milliseconds to sleep waiting for an event while nothing on screen changes
+FRAME_REPORT = 10.0 # Seconds between reports of the time taken to draw frames
+ENGINE_TIME = 2.0   # Seconds the engine thinks for when asked to move
+EXPLORER_INDEX = "openings.idx" # Position index from explorer.py shown in the title, if it exists
+
+SPRITES = None  # The SpriteCache, made when the pieces are first loaded
 
 #Load resources
 def loadImages():
-    images = {} #Dictionary of images with 2-character keys
-    pieces = ["R", "N", "B", "Q", "K", "p"]
-    dir = "./Pieces/"
-    for piece in pieces:
-        w = "w" + piece
-        b = "b" + piece
-        images[w] = pg.transform.scale(pg.image.load(dir + w + ".png"), (SQ_SIZE, SQ_SIZE))
-        images[b] = pg.transform.scale(pg.image.load(dir + b + ".png"), (SQ_SIZE, SQ_SIZE))
+    '''
+    Returns a dictionary of piece images with 2-character keys, at the current square size
+    '''
+    global SPRITES
+    # Made here rather than on import, as it reads ./Pieces/ from the working directory
+    if SPRITES is None:
+        SPRITES = SpriteCache("./Pieces/")
+    return SPRITES.get(SQ_SIZE)
 
-    return images
+def setWindowSize(size):
+    '''
+    Resizes the window to the largest board that fits in a size, returning the new display surface
+        Int size: The width or height asked for, whichever is smaller
+    '''
+    global WIDTH, HEIGHT, SQ_SIZE
+    SQ_SIZE = max(size // 8, MIN_SQ_SIZE)
+    WIDTH = SQ_SIZE * 8
+    HEIGHT = SQ_SIZE * 8
+    # The cached surfaces are all the size of the squares or the board
+    SURFACES.clear()
+    return pg.display.set_mode((WIDTH, HEIGHT), pg.RESIZABLE)
 
 def changeTheme(n):
     '''
@@ -36,31 +60,79 @@ def changeTheme(n):
 
     return colourThemes[n-1]
 
-def drawPieces(screen, board, images):
+def drawPieces(screen, gs, images):
     '''
     Draws the chess pieces
         pygame.Surface screen: The display window for the application
-        List board: A list of lists of pieces, each corresponding to a rank
+        GameState gs: The current Game State object
         Dict images: A dictionary containing path locations for images
     '''
-    for r in range(len(board)):
-        for c in range(len(board)):
-            name = board[r][c].getName()
+    for r in range(8):
+        for c in range(8):
+            name = gs.getName((r, c))
             if name[0] != "-":
                 screen.blit(images[name], (c*SQ_SIZE, r*SQ_SIZE))
 
     return
 
+# Surfaces which look the same every time they are drawn, made the first time they are needed
+SURFACES = {}
+
+def boardSurface(colours):
+    '''
+    Returns the background of the chess board in a colour theme, drawn once per theme
+        List colours: A list of colours used for the light and dark squares
+    '''
+    key = ("board", tuple(colours[0]), tuple(colours[1]))
+    if key not in SURFACES:
+        surface = pg.Surface((WIDTH, HEIGHT)).convert()
+        for r in range(8):
+            for c in range(8):
+                colour = colours[((c + r) % 2)]
+                pg.draw.rect(surface, colour, pg.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+        SURFACES[key] = surface
+    return SURFACES[key]
+
+def ghostSurface():
+    '''
+    Returns the translucent white square drawn above the piece being held
+    '''
+    if "ghost" not in SURFACES:
+        whiteSquare = pg.Surface((SQ_SIZE, SQ_SIZE)).convert()
+        whiteSquare.set_alpha(128)
+        whiteSquare.fill((255, 255, 255))
+        SURFACES["ghost"] = whiteSquare
+    return SURFACES["ghost"]
+
+def dotSurface():
+    '''
+    Returns a square with the circle marking a valid move in its centre, transparent elsewhere
+    '''
+    if "dot" not in SURFACES:
+        dot = pg.Surface((SQ_SIZE, SQ_SIZE), pg.SRCALPHA).convert_alpha()
+        dot.fill((0, 0, 0, 0))
+        pg.draw.circle(dot, pg.Color("green"), (SQ_SIZE // 2, SQ_SIZE // 2), SQ_SIZE//6)
+        SURFACES["dot"] = dot
+    return SURFACES["dot"]
+
+def fadeSurface():
+    '''
+    Returns the translucent white layer over the board behind the promotion choices
+    '''
+    if "fade" not in SURFACES:
+        fade = pg.Surface((WIDTH, HEIGHT)).convert()
+        fade.set_alpha(150)
+        fade.fill((255, 255, 255))
+        SURFACES["fade"] = fade
+    return SURFACES["fade"]
+
 def drawBoard(screen, colours):
     '''
     Draws the background of the chess board
         pygame.Surface screen: The display window for the application
         List colours: A list of colours used for the light and dark squares
     '''
-    for r in range(8):
-        for c in range(8):
-            colour = colours[((c + r) % 2)]
-            pg.draw.rect(screen, colour, pg.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    screen.blit(boardSurface(colours), (0, 0))
     return
 
 def drawGhost(screen, rank, file):
@@ -70,10 +142,7 @@ def drawGhost(screen, rank, file):
         Int rank: Corresponds to the rank of the piece on the board minus 1
         Int file: Corresponds to the file of the piece on the board minus 1
     '''
-    whiteSquare = pg.Surface((SQ_SIZE, SQ_SIZE))
-    whiteSquare.set_alpha(128)
-    whiteSquare.fill((255, 255, 255))
-    screen.blit(whiteSquare, (file*SQ_SIZE, rank*SQ_SIZE))
+    screen.blit(ghostSurface(), (file*SQ_SIZE, rank*SQ_SIZE))
     return
 
 def drawValidMoves(screen, moves):
@@ -82,9 +151,9 @@ def drawValidMoves(screen, moves):
         pygame.Surface screen: The display window for the application
         List moves: A list of tuples corresponding to the valid moves
     '''
+    dot = dotSurface()
     for move in moves:
-        m = (move[1]*SQ_SIZE + (SQ_SIZE // 2), move[0]*SQ_SIZE + (SQ_SIZE // 2))
-        pg.draw.circle(screen, pg.Color("green"), m, SQ_SIZE//6)
+        screen.blit(dot, (move[1]*SQ_SIZE, move[0]*SQ_SIZE))
     return
 
 def pieceFollowMouse(screen, name, images, x, y):
@@ -111,10 +180,7 @@ def drawPromotionChoices(screen, promotionSquare, images):
     pieces = ["Q", "N", "R", "B"]
     promotionOptions = []
 
-    fade = pg.Surface((WIDTH, HEIGHT))
-    fade.set_alpha(150)
-    fade.fill((255, 255, 255))
-    screen.blit(fade, (0, 0))
+    screen.blit(fadeSurface(), (0, 0))
 
     if r == 0:  # A white pawn is promoting
         for i in range(4):
@@ -133,6 +199,174 @@ def drawPromotionChoices(screen, promotionSquare, images):
 
     return promotionOptions
 
+def squaresUnder(x, y):
+    '''
+    Returns the squares a piece drawn centred on a point overlaps, as indices rank*8 + file
+        Int x: The x-position of the centre
+        Int y: The y-position of the centre
+    '''
+    left = max((x - SQ_SIZE//2) // SQ_SIZE, 0)
+    right = min((x - SQ_SIZE//2 + SQ_SIZE - 1) // SQ_SIZE, 7)
+    top = max((y - SQ_SIZE//2) // SQ_SIZE, 0)
+    bottom = min((y - SQ_SIZE//2 + SQ_SIZE - 1) // SQ_SIZE, 7)
+    return [r*8 + c for r in range(top, bottom + 1) for c in range(left, right + 1)]
+
+class Renderer:
+    def __init__(self, screen, colours, images):
+        '''
+        Draws each frame, repainting and updating only the squares which look different from
+        the frame before
+            pygame.Surface screen: The display window for the application
+            List colours: A list of colours used for the light and dark squares
+            Dict images: A dictionary containing path locations for images
+        '''
+        self.screen = screen
+        self.colours = colours
+        self.images = images
+        self.squares = None         # What each square showed in the last frame, or None to draw them all
+        self.drag = None            # (name, x, y) of the piece that followed the mouse in the last frame
+        self.promotion = None       # The square whose promotion choices are showing
+        self.promotionOptions = []
+
+    def invalidate(self):
+        '''
+        Makes the next frame draw the whole window, e.g. after it was uncovered
+        '''
+        self.squares = None
+        return
+
+    def drawSquare(self, r, c, state):
+        '''
+        Draws one square with everything on it
+            Int r: The rank of the square on the window
+            Int c: The file of the square on the window
+            Tuple state: (piece name, ghost, valid move dot, piece drawn above the ghost)
+        '''
+        name, ghost, dot, raised = state
+        area = pg.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(boardSurface(self.colours), area, area)
+        if name[0] != "-":
+            self.screen.blit(self.images[name], (c*SQ_SIZE, r*SQ_SIZE))
+        if ghost:
+            drawGhost(self.screen, r, c)
+        if dot:
+            drawValidMoves(self.screen, [(r, c)])
+        if raised and name[0] != "-":
+            self.screen.blit(self.images[name], (c*SQ_SIZE, r*SQ_SIZE))
+        return
+
+    def draw(self, gs, active, moves, drag, promotion):
+        '''
+        Draws the frame and updates the parts of the window that changed. Returns the rects
+        updated, an empty list when the frame looks the same as the last one
+            GameState gs: The current Game State object
+            Tuple active: The square of the piece that was picked up, or None
+            List moves: The squares the active piece can move to
+            Tuple drag: (name, x, y) of the piece following the mouse, or None
+            Tuple promotion: The square a pawn is promoting on, or None
+        '''
+        if promotion != self.promotion:
+            self.promotion = promotion
+            self.squares = None
+
+        # The promotion choices cover the whole board, which cannot change under them
+        if promotion is not None:
+            if self.squares is not None:
+                return []
+            drawBoard(self.screen, self.colours)
+            drawPieces(self.screen, gs, self.images)
+            self.promotionOptions = drawPromotionChoices(self.screen, promotion, self.images)
+            self.squares = [None] * 64
+            self.drag = None
+            pg.display.flip()
+            return [self.screen.get_rect()]
+
+        moves = set(moves)
+        states = []
+        for r in range(8):
+            for c in range(8):
+                ghost = (r, c) == active
+                states.append((gs.getName((r, c)), ghost, (r, c) in moves, ghost and drag is None))
+        full = self.squares is None
+        if full:
+            dirty = set(range(64))
+        else:
+            dirty = set(i for i in range(64) if states[i] != self.squares[i])
+        # The squares the dragged piece covered and now covers are drawn again under it
+        if drag != self.drag:
+            if self.drag is not None:
+                dirty.update(squaresUnder(self.drag[1], self.drag[2]))
+            if drag is not None:
+                dirty.update(squaresUnder(drag[1], drag[2]))
+        elif drag is not None and dirty.intersection(squaresUnder(drag[1], drag[2])):
+            dirty.update(squaresUnder(drag[1], drag[2]))
+
+        for i in dirty:
+            self.drawSquare(i // 8, i % 8, states[i])
+        if drag is not None and dirty:
+            pieceFollowMouse(self.screen, drag[0], self.images, drag[1], drag[2])
+        self.squares = states
+        self.drag = drag
+
+        if full:
+            pg.display.flip()
+            return [self.screen.get_rect()]
+        rects = [pg.Rect(i % 8 * SQ_SIZE, i // 8 * SQ_SIZE, SQ_SIZE, SQ_SIZE) for i in dirty]
+        if rects:
+            pg.display.update(rects)
+        return rects
+
+class FrameTimer:
+    def __init__(self, interval=FRAME_REPORT):
+        '''
+        Counts frames and the time taken drawing them, printing a summary every so often
+            Float interval: Seconds between summaries
+        '''
+        self.interval = interval
+        self.reset()
+
+    def reset(self):
+        self.frames = 0         # Times round the event loop
+        self.drawn = 0          # Frames which changed something on the window
+        self.total = 0.0        # Seconds spent drawing those
+        self.worst = 0.0
+        self.started = time.perf_counter()
+        return
+
+    def add(self, seconds, drawn):
+        '''
+        Counts one frame
+            Float seconds: The time it took to draw
+            Bool drawn: Whether anything on the window changed
+        '''
+        self.frames += 1
+        if drawn:
+            self.drawn += 1
+            self.total += seconds
+            self.worst = max(self.worst, seconds)
+        if time.perf_counter() - self.started >= self.interval:
+            self.report()
+            self.reset()
+        return
+
+    def report(self):
+        if self.frames:
+            print("frames: {a} loops, {b} drawn, {c:.2f} ms mean, {d:.2f} ms worst".format(a=self.frames,
+                b=self.drawn, c=self.total / max(self.drawn, 1) * 1000, d=self.worst * 1000))
+        return
+
+def explorerCaption(gs, index):
+    '''
+    Returns the window title listing the moves most played in the position and how they scored
+        GameState gs: The current Game State object
+        PositionIndex index: The opening explorer's index
+    '''
+    caption = "Python Chess"
+    for move, games, white, draws, black in index.lookup(gs)[:5]:
+        caption += "   {a} {b} ({c:.0%})".format(a=sanName(gs, move), b=games,
+            c=score(white, draws, black, gs.whitesTurn()))
+    return caption
+
 def squareDict(order, whitePOV):
     '''
     Returns a dictionary for converting window positions to rank or file names
@@ -148,164 +382,21 @@ def squareDict(order, whitePOV):
     
     return sd
 
-def movePiece(gs, activePiece, newpos):
-    '''
-    Moves the active piece to the specified new position on the board
-        GameState gs: The current Game State object
-        Piece activePiece: The piece which is moving to a new position
-        Tuple newpos: The position to which the active piece is moving
-    '''
-    activeType = activePiece.getName()[1]
-
-    # Checking if move is an En Passant
-    if activeType == "p" and gs.getBoard()[newpos[0]][newpos[1]].getName()[1] == "e":
-        gs.enPassant()
-
-    # Forgetting previous En Passant vulnerabilities
-    if gs.isVuln():
-        gs.disableEnPassant()
-
-    # Setting up En Passants if applicable
-    if activeType == "p" and not activePiece.hasMoved():
-        if ((activePiece.getPos()[1] - newpos[1]) % 2) == 0: # If the pawn moved two squares
-            if activePiece.getColour() == "w":
-                gs.enableEnPassant((newpos[0]+1, newpos[1]))
-            else:
-                gs.enableEnPassant((newpos[0]-1, newpos[1]))
-
-    #Checking for castling
-    if activeType == "K" and not activePiece.hasMoved():
-        if newpos[1] in [2, 6]:
-            gs.castle(activePiece.getColour(), newpos[1])
-
-    # Normal board update
-    gs.updateBoard(activePiece, gs.getBoard()[newpos[0]][newpos[1]])
-    gs.nextTurn()
-    return gs
-
-def promotePawn(gs, activePiece, promotionSquare, rank):
-    '''
-    Promoting the active pawn to a piece determined by the rank
-        GameState gs: The current Game State object
-        Piece activePiece: The piece which is being promoted
-    '''
-    r = activePiece.getPos()[0]
-    f = activePiece.getPos()[1]
-    colour = activePiece.getColour()
-    if rank in [0, 7]:
-        t = "Q"
-    elif rank in [1, 6]:
-        t = "N"
-    elif rank in [2, 5]:
-        t = "R"
-    else:
-        t = "B"
-    name = colour + t
-    gs.promote(activePiece, name)
-    gs = movePiece(gs, gs.getBoard()[r][f], promotionSquare)
-
-    return gs
-
-def checkKingSafety(gs, colour, activepos, newpos):
-    '''
-    Checks whether or not the given move would leave the player's king immediately vulnerable
-        GameState gs: The current Game State object
-        String colour: The colour of the player whose turn it is
-        Tuple activepos: The current position of the piece being moved
-        Tuple newpos: The new position of the active piece if the move is played
-    '''
-    ts = copy.deepcopy(gs)
-    ts = movePiece(ts, ts.getBoard()[activepos[0]][activepos[1]], newpos)
-    
-    return not ts.inCheck(colour)
-
-def filterValidMoves(gs, activePiece, moves):
-    '''
-    Given a list of moves, returns all moves where the king is not under attack
-        GameState gs: The current Game State object
-        Piece activePiece: The piece whose moves are being validated
-        List moves: The moves to check the validity of
-    '''
-    activePos = (activePiece.getPos())
-    r = activePos[0]
-    f = activePos[1]
-    colour = activePiece.getColour()
-    safeMoves = []
-    if colour == "w":
-        relevantMoves = gs.getPotentialMoves("b")
-    else:
-        relevantMoves = gs.getPotentialMoves("w")
-    for move in moves:
-        if checkKingSafety(gs, colour, activePos, move):
-            safeMoves.append(move)
-
-    # Check for castling while in check
-    if activePiece.getName()[1] == "K" and not activePiece.hasMoved():
-        # Cannot castle while in check
-        if gs.inCheck(colour):
-            safeMoves = [m for m in safeMoves if m[1] not in [2, 6]]
-        else:
-            # Check if kingside castling is safe
-            squares = [(r, f+1), (r, f+2)]
-            for square in squares:
-                if square in relevantMoves:
-                    safeMoves = [m for m in safeMoves if m[1] != 6]
-                    break
-
-            # Check if queenside castling is safe
-            squares = [(r, f-1), (r, f-2), (r, f-3)]
-            for square in squares:
-                if square in relevantMoves:
-                    safeMoves = [m for m in safeMoves if m[1] != 2]
-                    break
-
-    return safeMoves
-
-def updateGameStatus(gs):
-    '''
-    Returns the status of the game; i.e. playing, check, checkmate, stalemate
-        GameState gs: The current Game State object
-    '''
-    if gs.whitesTurn():
-        colour = "w"
-    else:
-        colour = "b"
-    board = gs.getBoard()
-
-    # Check if there are any moves that can be made by the active player
-    canMove = False
-    for r in board:
-        if not canMove:
-            for p in r:
-                if p.getColour() == colour:
-                    if len(filterValidMoves(gs, p, p.checkValidMoves(board))) > 0:
-                        canMove = True
-                        break
-    
-    # Check if the active side is in check
-    check = gs.inCheck(colour)
-
-    if check:
-        if canMove:
-            return "+"  # Check
-        else:
-            return "#"  # Checkmate
-    else:
-        if canMove:
-            return "."  # Playing
-        else:
-            return "-"  # Stalemate
-
 def main():
     # Initialize the game
     pg.init()
-    screen = pg.display.set_mode((WIDTH, HEIGHT))
+    screen = setWindowSize(HEIGHT)
     pg.display.set_caption("Python Chess")
     clock = pg.time.Clock()
     colours = changeTheme(1) # Default Colour Theme
     gs = GameState()
     gs.makeDefaultBoard()
-    status = "."    # Whether in check, checkmate, stalemate, or playing
+    status = "."    # Whether in check, checkmate, stalemate, drawn, or playing
+    ai = engine.Engine()
+    explorer = None
+    if os.path.exists(EXPLORER_INDEX):
+        explorer = PositionIndex(EXPLORER_INDEX)
+    shownKey = None     # Zobrist key of the position the explorer last showed
 
     # Creating a dictionary for squares based on the position on the window
     ranks = "87654321"
@@ -335,15 +426,33 @@ def main():
     clickedWhilePromoting = False
 
     images = loadImages()
-    drawBoard(screen, colours)
+    print("sprites: {a}px {b} in {c:.1f} ms".format(a=SQ_SIZE, b=SPRITES.lastSource, c=SPRITES.lastTime*1000))
+    renderer = Renderer(screen, colours, images)
+    frameTimer = FrameTimer()
+    idle = False    # Whether the last frame looked the same as the one before
 
     # Event Loop
     running = True
     while running:
-        for e in pg.event.get():
+        events = pg.event.get()
+        if idle and not events:
+            # Nothing on screen is changing, so sleep until something happens
+            events = [pg.event.wait(IDLE_WAIT)]
+        for e in events:
             if e.type == pg.QUIT:
                 running = False
 
+            elif e.type in [pg.VIDEOEXPOSE, pg.WINDOWEXPOSED]:
+                renderer.invalidate()
+
+            elif e.type == pg.VIDEORESIZE:
+                start = time.perf_counter()
+                screen = setWindowSize(min(e.w, e.h))
+                images = loadImages()
+                renderer = Renderer(screen, colours, images)
+                print("resized to {a}px squares in {b:.1f} ms, sprites {c}".format(a=SQ_SIZE,
+                    b=(time.perf_counter() - start)*1000, c=SPRITES.lastSource))
+
             elif e.type == pg.MOUSEBUTTONDOWN:
                 if e.button == 1:   #Left Mouse Button
                     holdingLMB = True
@@ -362,7 +471,7 @@ def main():
                         (not gs.whitesTurn() and gs.getBoard()[rank][file].getColour() == "b"):
                             pieceActive = True
                             activePiece = gs.getBoard()[rank][file]
-                            activePossibleMoves = activePiece.checkValidMoves(gs.getBoard())
+                            activePossibleMoves = gs.checkValidMoves(activePiece)
                             activeValidMoves = filterValidMoves(gs, activePiece, activePossibleMoves)
                             print(activeValidMoves)
                         else:
@@ -426,30 +535,45 @@ def main():
                 elif e.button == 3:
                     holdingRMB = False
 
+            elif e.type == pg.KEYDOWN:
+                # Space asks the engine to play the side to move
+                if e.key == pg.K_SPACE and not promoting and status in [".", "+"]:
+                    result = ai.search(gs, movetime=ENGINE_TIME)
+                    print(result)
+                    gs = playMove(gs, result.move)
+                    status = updateGameStatus(gs)
+                    print(status)
+                    pieceActive = False
+                    activePiece = None
+
             elif e.type == pg.MOUSEMOTION:
                 xpos = e.pos[0]
                 ypos = e.pos[1]
                 
-        # Draw the board and pieces
-        drawBoard(screen, colours)
-        drawPieces(screen, gs.getBoard(), images)
-
-        # Draw extra things on top of those
+        # Only look the position up when it changes
+        if explorer is not None and gs.getZobrist() != shownKey:
+            shownKey = gs.getZobrist()
+            pg.display.set_caption(explorerCaption(gs, explorer))
+
+        # Draw only what changed since the last frame
+        active = None
+        drag = None
+        promotion = None
         if pieceActive:
             if promoting:
-                promotionOptions = drawPromotionChoices(screen, promotionSquare, images)
+                promotion = promotionSquare
             else:
-                drawGhost(screen, rank, file)
-                drawValidMoves(screen, activeValidMoves)
-                name = gs.getBoard()[rank][file].getName()
+                active = (rank, file)
                 if holdingLMB:
-                    pieceFollowMouse(screen, name, images, xpos, ypos)
-                else:
-                    screen.blit(images[name], pg.Rect(file*SQ_SIZE, rank*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+                    drag = (gs.getName((rank, file)), xpos, ypos)
+        start = time.perf_counter()
+        idle = not renderer.draw(gs, active, activeValidMoves if active else [], drag, promotion)
+        frameTimer.add(time.perf_counter() - start, not idle)
+        promotionOptions = renderer.promotionOptions
 
         clock.tick(MAX_FPS)
-        pg.display.flip()
 
+    frameTimer.report()
     return
 
 if __name__ == "__main__":
@@ -1,4 +1,15 @@
 import piece
+import bitboard
+import mailbox120
+import zobrist
+import material
+
+# Check the incremental Zobrist key, evaluation terms and any accumulator against a full
+# recomputation after every move
+DEBUG = False
+
+# The usual starting position
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
 
 def makePiece(name):
     if name[1] == "p":
@@ -14,11 +25,61 @@ def makePiece(name):
     elif name[1] == "K":
         return piece.King(name)
     else:
-        return piece.Space("--")
+        return piece.EMPTY
+
+# Piece names and their FEN letters
+FEN_LETTERS = {"wp": "P", "wN": "N", "wB": "B", "wR": "R", "wQ": "Q", "wK": "K",
+               "bp": "p", "bN": "n", "bB": "b", "bR": "r", "bQ": "q", "bK": "k"}
+FEN_NAMES = {letter: name for name, letter in FEN_LETTERS.items()}
+
+def makePieceFromCode(code):
+    '''
+    Returns the piece for a square's code from mailbox120, which also says whether it has moved
+        Int code: An index into mailbox120.CODES, plus mailbox120.MOVED once the piece has moved
+    '''
+    p = makePiece(mailbox120.CODES[code & ~mailbox120.MOVED])
+    if code & mailbox120.MOVED:
+        p.move()
+    return p
+
+class MoveRecord:
+    def __init__(self, gs, pos1, pos2, promotion):
+        '''
+        Everything needed to take back a move made with GameState.makeMove
+            GameState gs: The Game State before the move is made
+            Tuple pos1: The position the piece is moving from
+            Tuple pos2: The position the piece is moving to
+            String promotion: The name of the piece being promoted to, or None
+        '''
+        self.pos1 = pos1
+        self.pos2 = pos2
+        self.piece = gs.board[pos1[0]][pos1[1]]
+        self.moved = self.piece.hasMoved()
+        self.captured = gs.board[pos2[0]][pos2[1]]
+        self.promotion = promotion
+        self.castle = None          # File of the rook's new square if castling
+        self.squares = []           # (rank, file, piece) for every square overwritten
+        self.tempVuln = gs.tempVuln
+        self.vuln = gs.vuln
+        self.kingpos = gs.kingpos[:]
+        self.attacks = []           # (position, previous entry) for every piece whose moves were updated
+        self.whiteInCheck = gs.whiteInCheck
+        self.blackInCheck = gs.blackInCheck
+        self.halfmoves = gs.halfmoves
+        self.zobrist = gs.zobrist
 
 class GameState:
 
-    def __init__(self):
+    def __init__(self, backend="piece"):
+        '''
+        Data structure for the state of a game of Chess
+            String backend: How moves are generated; "piece" asks each Piece object,
+                            "bitboard" uses the bitboard.Position kept alongside the board,
+                            "mailbox" the mailbox120.Position
+        '''
+        self.backend = backend
+        self.bitboards = None   #bitboard.Position mirroring the board, if used
+        self.mailbox = None     #mailbox120.Position mirroring the board, if used
         self.board = []         #List of Pieces
         self.whiteToMove = True
         self.tempVuln = (-1, -1)
@@ -28,6 +89,17 @@ class GameState:
         self.blackInCheck = False
         self.whiteMoves = set()
         self.blackMoves = set()
+        self.pieceMoves = {}    #Position -> (colour index, moves, watched squares) of each piece
+        self.watchers = {}      #Square -> positions of the pieces whose moves depend on it
+        self.attackers = [{}, {}]   #Square -> how many white and black pieces can move to it
+        self.history = []       #List of MoveRecords, most recent last
+        self.record = None      #MoveRecord of the move currently being made
+        self.zobrist = 0        #Zobrist key of the position
+        self.material = 0       #Material and piece-square score from white's view
+        self.pawnKey = 0        #Zobrist key of the pawns alone, for caching pawn structure scores
+        self.accumulator = None #Object told of every square that changes, e.g. evaluation.Accumulator
+        self.halfmoves = 0      #Plies since the last capture or pawn move, for the fifty-move rule
+        self.fullmoves = 1      #The number of the current move, which goes up after black moves
 
     def makeDefaultBoard(self):
         default = [
@@ -41,21 +113,322 @@ class GameState:
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
         ]
 
-        self.board = []
-        for rank in default:
-            self.board.append([makePiece(name) for name in rank])
+        self.loadPosition(default)
+        return
+
+    def loadPosition(self, layout, whiteToMove=True, castling="KQkq", enPassant=None, halfmoves=0, fullmoves=1):
+        '''
+        Sets up the board from a list of piece names, like the default board
+            List layout: A list of 8 lists of piece names, each corresponding to a rank
+            Bool whiteToMove: Whether it is white's turn
+            String castling: The castling rights still available, e.g. "KQkq", or "" for none
+            Tuple enPassant: The square a pawn just skipped by moving two squares, or None
+            Int halfmoves: Plies since the last capture or pawn move
+            Int fullmoves: The number of the current move, starting at 1
+        '''
+        # The ranks, and pieces which are the same as before, are reused when loading many positions
+        if len(self.board) != 8:
+            self.board = [[None] * 8 for r in range(8)]
+        for r in range(8):
+            rank = self.board[r]
+            for f in range(8):
+                name = layout[r][f]
+                p = rank[f]
+                if p is not None and p.getName() == name:
+                    p.setMoved(False)
+                else:
+                    rank[f] = makePiece(name)
+
+        # Rooks and kings which have not moved are the ones that may still castle
+        unmoved = []
+        if "K" in castling:
+            unmoved += [(7, 4), (7, 7)]
+        if "Q" in castling:
+            unmoved += [(7, 4), (7, 0)]
+        if "k" in castling:
+            unmoved += [(0, 4), (0, 7)]
+        if "q" in castling:
+            unmoved += [(0, 4), (0, 0)]
 
         for r in range(8):
             for c in range(8):
-                self.board[r][c].setPos((r, c))
-            
-        self.kingpos = [(7, 4), (0, 4)]
+                p = self.board[r][c]
+                name = p.getName()
+                if name[1] in "KR" and (r, c) not in unmoved:
+                    p.move()
+                # Only pawns on their starting rank can still move two squares
+                elif (name == "wp" and r != 6) or (name == "bp" and r != 1):
+                    p.move()
+
+        self.resetState(whiteToMove, enPassant)
+        self.halfmoves = halfmoves
+        self.fullmoves = fullmoves
+        return
+
+    def loadFen(self, fen):
+        '''
+        Sets up the position from Forsyth-Edwards Notation. Fields after the placement may be
+        left out, defaulting to white to move, no castling, no en passant and clocks of 0 and 1.
+        Raises ValueError if the FEN is malformed, leaving the position as it was
+            String fen: The position, e.g. "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1"
+        '''
+        fields = fen.split()
+        if not 1 <= len(fields) <= 6:
+            raise ValueError("Invalid FEN {a!r}: expected 1 to 6 fields".format(a=fen))
+        layout = []
+        for row in fields[0].split("/"):
+            rank = []
+            for c in row:
+                if c.isdigit():
+                    rank += ["--"] * int(c)
+                elif c in FEN_NAMES:
+                    rank.append(FEN_NAMES[c])
+                else:
+                    raise ValueError("Invalid FEN piece {a!r} in {b!r}".format(a=c, b=fen))
+            if len(rank) != 8:
+                raise ValueError("Invalid FEN rank {a!r} in {b!r}".format(a=row, b=fen))
+            layout.append(rank)
+        if len(layout) != 8:
+            raise ValueError("Invalid FEN placement in {a!r}".format(a=fen))
+
+        fields += ["w", "-", "-", "0", "1"][len(fields) - 1:]
+        if fields[1] not in ["w", "b"]:
+            raise ValueError("Invalid FEN side to move {a!r} in {b!r}".format(a=fields[1], b=fen))
+        whiteToMove = fields[1] == "w"
+        castling = fields[2]
+        if castling != "-" and (any(c not in "KQkq" for c in castling) or len(set(castling)) != len(castling)):
+            raise ValueError("Invalid FEN castling rights {a!r} in {b!r}".format(a=castling, b=fen))
+        if not fields[4].isdigit() or not fields[5].isdigit():
+            raise ValueError("Invalid FEN move counters in {a!r}".format(a=fen))
+
+        enPassant = None
+        if fields[3] != "-":
+            # The skipped square must be empty with the pawn that skipped it in front of it,
+            # on the side which has just moved
+            square = fields[3]
+            if whiteToMove:
+                rank, pawn, ahead = "6", "bp", 1
+            else:
+                rank, pawn, ahead = "3", "wp", -1
+            if len(square) != 2 or square[0] not in "abcdefgh" or square[1] != rank:
+                raise ValueError("Invalid FEN en passant square {a!r} in {b!r}".format(a=square, b=fen))
+            enPassant = (8 - int(square[1]), "abcdefgh".index(square[0]))
+            if layout[enPassant[0]][enPassant[1]] != "--" or layout[enPassant[0] + ahead][enPassant[1]] != pawn:
+                raise ValueError("Invalid FEN en passant square {a!r} in {b!r}".format(a=square, b=fen))
+        self.loadPosition(layout, whiteToMove, castling, enPassant, int(fields[4]), int(fields[5]))
+        return
+
+    def getFen(self):
+        '''
+        Returns the position in Forsyth-Edwards Notation
+        '''
+        rows = []
+        for rank in self.board:
+            row = ""
+            empty = 0
+            for p in rank:
+                name = p.getName()
+                if name[0] == "-":
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += FEN_LETTERS[name]
+            if empty:
+                row += str(empty)
+            rows.append(row)
+
+        rights = self.castlingRights()
+        castling = ""
+        for bit, letter in [(zobrist.WHITE_KINGSIDE, "K"), (zobrist.WHITE_QUEENSIDE, "Q"),
+                            (zobrist.BLACK_KINGSIDE, "k"), (zobrist.BLACK_QUEENSIDE, "q")]:
+            if rights & bit:
+                castling += letter
+        enPassant = "-"
+        if self.vuln:
+            enPassant = "abcdefgh"[self.tempVuln[1]] + str(8 - self.tempVuln[0])
+        if self.whiteToMove:
+            side = "w"
+        else:
+            side = "b"
+        return "{a} {b} {c} {d} {e} {f}".format(a="/".join(rows), b=side, c=castling or "-",
+            d=enPassant, e=self.halfmoves, f=self.fullmoves)
+
+    def resetState(self, whiteToMove, enPassant):
+        '''
+        Works out everything else about a position once its pieces are on the board
+            Bool whiteToMove: Whether it is white's turn
+            Tuple enPassant: The square a pawn just skipped by moving two squares, or None
+        '''
+        self.kingpos = [(-1, -1), (-1, -1)]
+        for r in range(8):
+            for c in range(8):
+                p = self.board[r][c]
+                p.setPos((r, c))
+                if p.getName() == "wK":
+                    self.kingpos[0] = (r, c)
+                elif p.getName() == "bK":
+                    self.kingpos[1] = (r, c)
+
+        self.whiteToMove = whiteToMove
+        self.tempVuln = (-1, -1)
+        self.vuln = False
+        self.history = []
+        self.record = None
+        self.halfmoves = 0
+        self.fullmoves = 1
+        self.bitboards = None
+        self.mailbox = None
+        if enPassant is not None:
+            self.enableEnPassant(enPassant)
+        if self.backend == "bitboard":
+            self.bitboards = bitboard.Position(self.board)
+        elif self.backend == "mailbox":
+            self.mailbox = mailbox120.Position(self.board)
+
         self.updatePotentialMoves()
+        self.whiteInCheck = self.attackers[1].get(self.kingpos[0], 0) > 0
+        self.blackInCheck = self.attackers[0].get(self.kingpos[1], 0) > 0
+        self.zobrist = self.computeZobrist()
+        self.material = self.computeMaterial()
+        self.pawnKey = self.computePawnKey()
+        if self.accumulator is not None:
+            self.accumulator.refresh(self.board)
+        return
+
+    def pack(self):
+        '''
+        Returns the position as 65 bytes, for sending to other processes or storing: the
+        mailbox120 code of each square, then the side to move
+        '''
+        if self.mailbox is not None:
+            # Each rank is already a run of 8 bytes in the mailbox
+            squares = self.mailbox.squares
+            data = bytearray()
+            for r in range(8):
+                data += squares[(r + 2)*10 + 1:(r + 2)*10 + 9]
+        else:
+            data = bytearray(mailbox120.encode(p) for rank in self.board for p in rank)
+        data.append(self.whiteToMove)
+        return bytes(data)
+
+    def unpack(self, data):
+        '''
+        Sets up the position from the bytes returned by pack; the move history is not kept
+            Bytes data: The packed position
+        '''
+        self.board = []
+        enPassant = None
+        for r in range(8):
+            rank = []
+            for f in range(8):
+                code = data[r*8 + f]
+                if code == mailbox120.PASSANT:
+                    enPassant = (r, f)
+                    code = mailbox120.EMPTY
+                rank.append(makePieceFromCode(code))
+            self.board.append(rank)
+        self.resetState(bool(data[64]), enPassant)
         return
 
     def getBoard(self):
         return self.board
 
+    def getName(self, pos):
+        '''
+        Returns the name of the piece at pos, read from the mailbox when there is one
+            Tuple pos: The position on the board
+        '''
+        if self.mailbox is not None:
+            return self.mailbox.getName(pos)
+        return self.board[pos[0]][pos[1]].getName()
+
+    def getZobrist(self):
+        return self.zobrist
+
+    def getMaterial(self):
+        return self.material
+
+    def getPawnKey(self):
+        return self.pawnKey
+
+    def castlingRights(self):
+        '''
+        Returns the castling rights left as bits of zobrist.WHITE_KINGSIDE etc.;
+        a right remains while the king and that rook are unmoved on their squares
+        '''
+        rights = 0
+        for r, colour, kingside, queenside in [(7, "w", zobrist.WHITE_KINGSIDE, zobrist.WHITE_QUEENSIDE),
+                                               (0, "b", zobrist.BLACK_KINGSIDE, zobrist.BLACK_QUEENSIDE)]:
+            king = self.board[r][4]
+            if king.getName() == colour + "K" and not king.hasMoved():
+                rook = self.board[r][7]
+                if rook.getName() == colour + "R" and not rook.hasMoved():
+                    rights |= kingside
+                rook = self.board[r][0]
+                if rook.getName() == colour + "R" and not rook.hasMoved():
+                    rights |= queenside
+        return rights
+
+    def computeZobrist(self):
+        '''
+        Returns the Zobrist key of the position worked out from scratch
+        '''
+        key = 0
+        for r in range(8):
+            for f in range(8):
+                key ^= zobrist.pieceKey(self.board[r][f].getName(), (r, f))
+        if not self.whiteToMove:
+            key ^= zobrist.BLACK_TO_MOVE
+        key ^= zobrist.CASTLING[self.castlingRights()]
+        if self.vuln:
+            key ^= zobrist.EN_PASSANT[self.tempVuln[1]]
+        return key
+
+    def computeMaterial(self):
+        '''
+        Returns the material and piece-square score of the position worked out from scratch
+        '''
+        score = 0
+        for r in range(8):
+            for f in range(8):
+                score += material.squareScore(self.board[r][f].getName(), (r, f))
+        return score
+
+    def computePawnKey(self):
+        '''
+        Returns the Zobrist key of the pawns worked out from scratch
+        '''
+        key = 0
+        for r in range(8):
+            for f in range(8):
+                key ^= zobrist.PAWNS[self.board[r][f].getName()][r*8 + f]
+        return key
+
+    def checkIncremental(self, when):
+        '''
+        Asserts that everything kept up to date move by move matches a full recomputation
+            String when: Named in the message if not, e.g. "makeMove"
+        '''
+        assert self.zobrist == self.computeZobrist(), "Zobrist key out of step after " + when
+        assert self.material == self.computeMaterial(), "Material out of step after " + when
+        assert self.pawnKey == self.computePawnKey(), "Pawn key out of step after " + when
+        if self.accumulator is not None:
+            assert self.accumulator.check(self.board), "Accumulator out of step after " + when
+        return
+
+    def repetitions(self):
+        '''
+        Returns how many times the current position has occurred in the game, including now.
+        Only positions since the last capture or pawn move can be the same
+        '''
+        count = 1
+        for record in self.history[max(len(self.history) - self.halfmoves, 0):]:
+            if record.zobrist == self.zobrist:
+                count += 1
+        return count
+
     def isVuln(self):
         return self.vuln
 
@@ -71,8 +444,36 @@ class GameState:
         else:
             return self.blackMoves
 
+    def setSquare(self, pos, p):
+        '''
+        Places the piece p on the board at pos, remembering what was there if a move is being made
+            Tuple pos: The position on the board being overwritten
+            Piece p: The piece being placed
+        '''
+        r = pos[0]
+        f = pos[1]
+        if self.record is not None:
+            self.record.squares.append((r, f, self.board[r][f]))
+        old = self.board[r][f].getName()
+        new = p.getName()
+        self.zobrist ^= zobrist.pieceKey(old, pos) ^ zobrist.pieceKey(new, pos)
+        # Taking a move back places the old pieces again, which undoes these too
+        sq = r*8 + f
+        self.material += material.SCORES[new][sq] - material.SCORES[old][sq]
+        self.pawnKey ^= zobrist.PAWNS[old][sq] ^ zobrist.PAWNS[new][sq]
+        if self.accumulator is not None:
+            self.accumulator.setSquare(pos, old, new)
+        self.board[r][f] = p
+        p.setPos(pos)
+        if self.bitboards is not None:
+            self.bitboards.setSquare(pos, p)
+        elif self.mailbox is not None:
+            self.mailbox.setSquare(pos, p)
+        return
+
     def nextTurn(self):
         self.whiteToMove = not self.whiteToMove
+        self.zobrist ^= zobrist.BLACK_TO_MOVE
 
     def whitesTurn(self):
         return self.whiteToMove
@@ -82,16 +483,17 @@ class GameState:
         f = pos[1]
         self.tempVuln = (r, f)
         self.vuln = True
-        self.board[r][f] = piece.Space("-e")
-        self.board[r][f].setPos((r, f))
+        self.zobrist ^= zobrist.EN_PASSANT[f]
+        self.setSquare((r, f), piece.PASSANT)
         return
 
     def disableEnPassant(self):
         r = self.tempVuln[0]
         f = self.tempVuln[1]
         if self.board[r][f].getName()[0] == "-":
-            self.board[r][f] = piece.Space("--")
-            self.board[r][f].setPos((r, f))
+            self.setSquare((r, f), piece.EMPTY)
+        if self.vuln:
+            self.zobrist ^= zobrist.EN_PASSANT[f]
         self.tempVuln = (-1, -1)
         self.vuln = False
         return
@@ -103,8 +505,7 @@ class GameState:
             direction = -1
         r = self.tempVuln[0] + direction
         f = self.tempVuln[1]
-        self.board[r][f] = piece.Space("--")
-        self.board[r][f].setPos((r, f))
+        self.setSquare((r, f), piece.EMPTY)
 
     def promote(self, p, name):
         '''
@@ -114,8 +515,7 @@ class GameState:
         '''
         r = p.getPos()[0]
         f = p.getPos()[1]
-        self.board[r][f] = makePiece(name)
-        self.board[r][f].setPos((r, f))
+        self.setSquare((r, f), makePiece(name))
 
     def castle(self, colour, file):
         '''
@@ -134,40 +534,146 @@ class GameState:
         else:
             r = 0
         name = colour + "R"
-        self.board[r][newfile] = makePiece(name)
-        self.board[r][newfile].setPos((r, newfile))
-        self.board[r][oldfile] = piece.Space("--")
-        self.board[r][oldfile].setPos((r, oldfile))
+        self.setSquare((r, newfile), makePiece(name))
+        self.setSquare((r, oldfile), piece.EMPTY)
+        if self.record is not None:
+            self.record.castle = newfile
+        return
+
+    def checkValidMoves(self, p):
+        '''
+        Returns all valid moves that the piece p can make, using the chosen backend
+            Piece p: The piece whose moves are wanted
+        '''
+        if self.bitboards is not None:
+            return self.bitboards.checkValidMoves(p.getPos())
+        elif self.mailbox is not None:
+            return self.mailbox.checkValidMoves(p.getPos())
+        return p.checkValidMoves(self.board)
+
+    def setPieceMoves(self, pos, entry):
+        '''
+        Replaces the moves stored for the piece at pos, keeping the attacker counts and
+        whiteMoves/blackMoves in step. Returns the entry that was replaced
+            Tuple pos: The position of the piece
+            Tuple entry: (colour index, moves, watched squares), or None for no piece
+        '''
+        old = self.pieceMoves.pop(pos, None)
+        if entry is not None:
+            self.pieceMoves[pos] = entry
+
+        # Most refreshed pieces keep the same moves or watched squares, so only differences are applied
+        if old is not None and entry is not None and old[0] == entry[0]:
+            if old[1] != entry[1]:
+                self.countMoves(old[0], old[1], -1)
+                self.countMoves(entry[0], entry[1], 1)
+            if old[2] != entry[2]:
+                self.watchSquares(pos, old[2], False)
+                self.watchSquares(pos, entry[2], True)
+        else:
+            if old is not None:
+                self.countMoves(old[0], old[1], -1)
+                self.watchSquares(pos, old[2], False)
+            if entry is not None:
+                self.countMoves(entry[0], entry[1], 1)
+                self.watchSquares(pos, entry[2], True)
+        return old
+
+    def countMoves(self, colour, moves, n):
+        '''
+        Adds n to the attacker counts of the given moves, updating whiteMoves/blackMoves
+            Int colour: 0 for white's moves, 1 for black's
+            List moves: The squares being counted
+            Int n: 1 to add the moves, -1 to take them away
+        '''
+        counts = self.attackers[colour]
+        if colour == 0:
+            targets = self.whiteMoves
+        else:
+            targets = self.blackMoves
+        for move in moves:
+            c = counts.get(move, 0) + n
+            counts[move] = c
+            if c == 0:
+                targets.discard(move)
+            elif c == n:
+                targets.add(move)
+        return
+
+    def watchSquares(self, pos, squares, watching):
+        '''
+        Adds or removes pos from the watchers of the given squares
+            Tuple pos: The position of the watching piece
+            List squares: The squares it watches
+            Bool watching: True to start watching them, False to stop
+        '''
+        watchers = self.watchers
+        for square in squares:
+            if watching:
+                if square in watchers:
+                    watchers[square].add(pos)
+                else:
+                    watchers[square] = {pos}
+            else:
+                watchers[square].discard(pos)
         return
 
+    def findPieceMoves(self, pos):
+        '''
+        Returns the entry for setPieceMoves describing the piece currently at pos
+            Tuple pos: The position on the board
+        '''
+        p = self.board[pos[0]][pos[1]]
+        colour = p.getColour()
+        if colour == "w":
+            return (0, self.checkValidMoves(p), p.checkWatchedSquares(self.board))
+        elif colour == "b":
+            return (1, self.checkValidMoves(p), p.checkWatchedSquares(self.board))
+        return None
+
     def updatePotentialMoves(self):
+        '''
+        Regenerates the moves of every piece from scratch
+        '''
         self.whiteMoves = set()
         self.blackMoves = set()
-        for r in self.board:
-            for p in r:
-                if p.getColour() == "w":
-                    for move in p.checkValidMoves(self.board):
-                        self.whiteMoves.add(move)
-                elif p.getColour() == "b":
-                    for move in p.checkValidMoves(self.board):
-                        self.blackMoves.add(move)
+        self.pieceMoves = {}
+        self.watchers = {}
+        self.attackers = [{}, {}]
+        for r in range(8):
+            for f in range(8):
+                entry = self.findPieceMoves((r, f))
+                if entry is not None:
+                    self.setPieceMoves((r, f), entry)
         return
 
-    def updateBoard(self, p1, p2):
+    def refreshPotentialMoves(self, squares):
         '''
-        Moves the piece p1 to the position of piece p2 and deletes p2
+        Regenerates the moves of only the pieces affected by changes to the given squares:
+        the pieces on them and the pieces watching them. Returns (position, previous entry)
+        pairs which setPieceMoves can put back to undo the refresh
+            List squares: The squares whose contents changed
+        '''
+        affected = set(squares)
+        for square in squares:
+            if square in self.watchers:
+                affected |= self.watchers[square]
+        changes = []
+        for pos in affected:
+            changes.append((pos, self.setPieceMoves(pos, self.findPieceMoves(pos))))
+        return changes
+
+    def updateBoard(self, p1, pos2):
+        '''
+        Moves the piece p1 to pos2, replacing whatever was there
             Piece p1: The active piece which is moving
-            Piece p2: The piece being replaced
+            Tuple pos2: The position it moves to
         '''
         name = p1.getName()
         pos1 = p1.getPos()
-        pos2 = p2.getPos()
-        p2 = None
-        self.board[pos2[0]][pos2[1]] = p1
-        p1.setPos(pos2)
         p1.move()
-        self.board[pos1[0]][pos1[1]] = piece.Space("--")
-        self.board[pos1[0]][pos1[1]].setPos(pos1)
+        self.setSquare(pos2, p1)
+        self.setSquare(pos1, piece.EMPTY)
 
         # Update king position
         if name[1] == "K":
@@ -177,10 +683,97 @@ class GameState:
                 i = 1
             self.kingpos[i] = pos2
 
-        self.updatePotentialMoves()
+        if self.record is not None:
+            # Only the replaced entries are kept: unmakeMove puts them back, which takes the
+            # counts and move sets back too, so nothing needs copying
+            self.record.attacks = self.refreshPotentialMoves([(r, f) for r, f, p in self.record.squares])
+        else:
+            self.updatePotentialMoves()
 
         # Check for a side in check
-        self.whiteInCheck = self.kingpos[0] in self.blackMoves
-        self.blackInCheck = self.kingpos[1] in self.whiteMoves
+        self.whiteInCheck = self.attackers[1].get(self.kingpos[0], 0) > 0
+        self.blackInCheck = self.attackers[0].get(self.kingpos[1], 0) > 0
+
+        return
+
+    def makeMove(self, pos1, pos2, promotion=None):
+        '''
+        Plays a move on the board in place, handling en passant, castling and promotion.
+        Returns the MoveRecord needed to take it back with unmakeMove
+            Tuple pos1: The position of the piece which is moving
+            Tuple pos2: The position to which the piece is moving
+            String promotion: The name of the piece a pawn is promoting to, or None
+        '''
+        record = MoveRecord(self, pos1, pos2, promotion)
+        self.record = record
+        rights = self.castlingRights()
+
+        if promotion is not None:
+            self.promote(self.board[pos1[0]][pos1[1]], promotion)
+        p = self.board[pos1[0]][pos1[1]]
+        activeType = p.getName()[1]
+
+        # Checking if move is an En Passant
+        if activeType == "p" and self.board[pos2[0]][pos2[1]].getName()[1] == "e":
+            self.enPassant()
+
+        # Forgetting previous En Passant vulnerabilities
+        if self.vuln:
+            self.disableEnPassant()
 
-        return
\ No newline at end of file
+        # Setting up En Passants if applicable
+        if activeType == "p" and not p.hasMoved():
+            if abs(pos1[0] - pos2[0]) == 2: # If the pawn moved two squares
+                if p.getColour() == "w":
+                    self.enableEnPassant((pos2[0]+1, pos2[1]))
+                else:
+                    self.enableEnPassant((pos2[0]-1, pos2[1]))
+
+        # Checking for castling
+        if activeType == "K" and not p.hasMoved():
+            if pos2[1] in [2, 6]:
+                self.castle(p.getColour(), pos2[1])
+
+        if record.piece.getName()[1] == "p" or record.captured.getColour() != "-":
+            self.halfmoves = 0
+        else:
+            self.halfmoves += 1
+
+        if not self.whiteToMove:
+            self.fullmoves += 1
+
+        # Normal board update
+        self.updateBoard(p, pos2)
+        self.nextTurn()
+        self.zobrist ^= zobrist.CASTLING[rights] ^ zobrist.CASTLING[self.castlingRights()]
+
+        self.record = None
+        self.history.append(record)
+        if DEBUG:
+            self.checkIncremental("makeMove")
+        return record
+
+    def unmakeMove(self):
+        '''
+        Takes back the most recent move made with makeMove, restoring the exact previous state
+        '''
+        record = self.history.pop()
+        record.piece.setMoved(record.moved)
+        for r, f, p in reversed(record.squares):
+            self.setSquare((r, f), p)
+
+        self.tempVuln = record.tempVuln
+        self.vuln = record.vuln
+        self.kingpos = record.kingpos
+        for pos, entry in record.attacks:
+            self.setPieceMoves(pos, entry)
+        self.whiteInCheck = record.whiteInCheck
+        self.blackInCheck = record.blackInCheck
+        self.whiteToMove = not self.whiteToMove
+        if not self.whiteToMove:
+            self.fullmoves -= 1
+        self.halfmoves = record.halfmoves
+        self.zobrist = record.zobrist
+        if DEBUG:
+            self.checkIncremental("unmakeMove")
+        return record
@@ -0,0 +1,143 @@
+'''
+Mailbox-120 move generation. The board is one bytearray of 12 rows of 10 bytes: the 8x8
+board sits in the middle, surrounded by OFFBOARD sentinels two rows deep above and below
+and one column deep at the sides, so no step of a piece needs a bounds check. Square (r, f)
+is byte (r+2)*10 + f+1. Produces exactly the same moves as the Piece classes.
+'''
+from piece import NAMES
+
+# Small integer codes for the contents of a square
+CODES = ["--"] + NAMES + ["-e"]
+CODE_OF = {name: i for i, name in enumerate(CODES)}
+EMPTY = 0
+PASSANT = 13
+MOVED = 128     # Added to the code of a piece once it has moved
+OFFBOARD = 255
+
+def index(pos):
+    '''
+    Returns the byte of the mailbox holding a square
+        Tuple pos: The position on the board
+    '''
+    return (pos[0] + 2)*10 + pos[1] + 1
+
+SQUARES = [None] * 120      # Byte of the mailbox -> (rank, file), or None off the board
+for r in range(8):
+    for f in range(8):
+        SQUARES[index((r, f))] = (r, f)
+
+# Side of each byte value: 0 for an empty square, 1 white, 2 black, 3 off the board
+SIDE = [0] * 256
+for code in range(1, 7):
+    SIDE[code] = SIDE[code | MOVED] = 1
+    SIDE[code + 6] = SIDE[(code + 6) | MOVED] = 2
+SIDE[OFFBOARD] = 3
+
+KNIGHT_STEPS = [-21, -19, -12, -8, 8, 12, 19, 21]
+KING_STEPS = [-11, -10, -9, -1, 1, 9, 10, 11]
+DIAGONAL_STEPS = [-11, -9, 9, 11]
+STRAIGHT_STEPS = [-10, -1, 1, 10]
+
+def encode(p):
+    '''
+    Returns the byte stored for a piece
+        Piece p: The piece
+    '''
+    code = CODE_OF[p.getName()]
+    if code != EMPTY and code != PASSANT and p.hasMoved():
+        code |= MOVED
+    return code
+
+class Position:
+    def __init__(self, board):
+        '''
+        Mailbox copy of a board, kept in sync through setSquare. The bytes can be copied,
+        stored or shared between processes as a single buffer
+            List board: A list of lists of pieces, each corresponding to a rank
+        '''
+        self.squares = bytearray([OFFBOARD]) * 120
+        for r in range(8):
+            for f in range(8):
+                self.setSquare((r, f), board[r][f])
+
+    def setSquare(self, pos, p):
+        '''
+        Records that the piece p now stands at pos
+            Tuple pos: The position on the board
+            Piece p: The piece now on that square
+        '''
+        self.squares[(pos[0] + 2)*10 + pos[1] + 1] = encode(p)
+        return
+
+    def getName(self, pos):
+        '''
+        Returns the name of the piece at pos
+            Tuple pos: The position on the board
+        '''
+        return CODES[self.squares[(pos[0] + 2)*10 + pos[1] + 1] & ~MOVED]
+
+    def checkValidMoves(self, pos):
+        '''
+        Returns the moves of the piece at pos as a list of positions, matching its checkValidMoves
+            Tuple pos: The position of the piece
+        '''
+        squares = self.squares
+        sq = (pos[0] + 2)*10 + pos[1] + 1
+        code = squares[sq]
+        side = SIDE[code]
+        kind = (code & ~MOVED) % 6
+        moves = []
+        if side == 0:
+            return moves
+
+        if kind == 1:   # Pawn
+            if side == 1:
+                step = -10
+                enemy = 2
+            else:
+                step = 10
+                enemy = 1
+            if squares[sq + step] == EMPTY:
+                moves.append(SQUARES[sq + step])
+                if not code & MOVED and squares[sq + 2*step] == EMPTY:
+                    moves.append(SQUARES[sq + 2*step])
+            for target in [sq + step - 1, sq + step + 1]:
+                if SIDE[squares[target]] == enemy or squares[target] == PASSANT:
+                    moves.append(SQUARES[target])
+            return moves
+        elif kind == 2: # Knight
+            for step in KNIGHT_STEPS:
+                if SIDE[squares[sq + step]] in (0, 3 - side):
+                    moves.append(SQUARES[sq + step])
+            return moves
+        elif kind == 0: # King
+            for step in KING_STEPS:
+                if SIDE[squares[sq + step]] in (0, 3 - side):
+                    moves.append(SQUARES[sq + step])
+            if not code & MOVED:
+                # The rook in the corner may be of either colour, as in King.checkValidMoves
+                corner = sq - pos[1]
+                if squares[corner + 5] == EMPTY and squares[corner + 6] == EMPTY and \
+                squares[corner + 7] in (CODE_OF["wR"], CODE_OF["bR"]):
+                    moves.append(SQUARES[corner + 6])
+                if squares[corner + 1] == EMPTY and squares[corner + 2] == EMPTY and \
+                squares[corner + 3] == EMPTY and squares[corner] in (CODE_OF["wR"], CODE_OF["bR"]):
+                    moves.append(SQUARES[corner + 2])
+            return moves
+
+        if kind == 3:   # Bishop
+            steps = DIAGONAL_STEPS
+        elif kind == 4: # Rook
+            steps = STRAIGHT_STEPS
+        else:           # Queen
+            steps = DIAGONAL_STEPS + STRAIGHT_STEPS
+        for step in steps:
+            target = sq + step
+            s = SIDE[squares[target]]
+            while s == 0:
+                moves.append(SQUARES[target])
+                target += step
+                s = SIDE[squares[target]]
+            if s == 3 - side:
+                moves.append(SQUARES[target])
+        return moves
@@ -0,0 +1,78 @@
+'''
+Material and piece-square scores. A position's score is the sum of the scores of each piece
+on its square, positive for white and negative for black, and is kept up to date by GameState
+as pieces are placed, as its Zobrist key is.
+'''
+from piece import NAMES
+
+VALUES = {"p": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 20000}
+
+# Piece-square tables from white's point of view, rank 8 first, as on GameState.board
+TABLES = {
+    "p": [0, 0, 0, 0, 0, 0, 0, 0,
+          50, 50, 50, 50, 50, 50, 50, 50,
+          10, 10, 20, 30, 30, 20, 10, 10,
+          5, 5, 10, 25, 25, 10, 5, 5,
+          0, 0, 0, 20, 20, 0, 0, 0,
+          5, -5, -10, 0, 0, -10, -5, 5,
+          5, 10, 10, -20, -20, 10, 10, 5,
+          0, 0, 0, 0, 0, 0, 0, 0],
+    "N": [-50, -40, -30, -30, -30, -30, -40, -50,
+          -40, -20, 0, 0, 0, 0, -20, -40,
+          -30, 0, 10, 15, 15, 10, 0, -30,
+          -30, 5, 15, 20, 20, 15, 5, -30,
+          -30, 0, 15, 20, 20, 15, 0, -30,
+          -30, 5, 10, 15, 15, 10, 5, -30,
+          -40, -20, 0, 5, 5, 0, -20, -40,
+          -50, -40, -30, -30, -30, -30, -40, -50],
+    "B": [-20, -10, -10, -10, -10, -10, -10, -20,
+          -10, 0, 0, 0, 0, 0, 0, -10,
+          -10, 0, 5, 10, 10, 5, 0, -10,
+          -10, 5, 5, 10, 10, 5, 5, -10,
+          -10, 0, 10, 10, 10, 10, 0, -10,
+          -10, 10, 10, 10, 10, 10, 10, -10,
+          -10, 5, 0, 0, 0, 0, 5, -10,
+          -20, -10, -10, -10, -10, -10, -10, -20],
+    "R": [0, 0, 0, 0, 0, 0, 0, 0,
+          5, 10, 10, 10, 10, 10, 10, 5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          0, 0, 0, 5, 5, 0, 0, 0],
+    "Q": [-20, -10, -10, -5, -5, -10, -10, -20,
+          -10, 0, 0, 0, 0, 0, 0, -10,
+          -10, 0, 5, 5, 5, 5, 0, -10,
+          -5, 0, 5, 5, 5, 5, 0, -5,
+          0, 0, 5, 5, 5, 5, 0, -5,
+          -10, 5, 5, 5, 5, 5, 0, -10,
+          -10, 0, 5, 0, 0, 0, 0, -10,
+          -20, -10, -10, -5, -5, -10, -10, -20],
+    "K": [-30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -20, -30, -30, -40, -40, -30, -30, -20,
+          -10, -20, -20, -20, -20, -20, -20, -10,
+          20, 20, 0, 0, 0, 0, 20, 20,
+          20, 30, 10, 0, 0, 10, 30, 20]
+}
+
+# Name -> the score of that piece on each square from white's view, rank 8 first. The
+# tables are from white's view, so black's are read with the ranks flipped. Empty squares
+# are in too so that placing a piece never needs a check
+SCORES = {"--": [0] * 64, "-e": [0] * 64}
+for name in NAMES:
+    if name[0] == "w":
+        SCORES[name] = [VALUES[name[1]] + TABLES[name[1]][sq] for sq in range(64)]
+    else:
+        SCORES[name] = [-(VALUES[name[1]] + TABLES[name[1]][(7 - sq // 8)*8 + sq % 8]) for sq in range(64)]
+
+def squareScore(name, pos):
+    '''
+    Returns the score of a piece on a square from white's view; empty squares score nothing
+        String name: The name of the piece
+        Tuple pos: The position of the piece
+    '''
+    return SCORES[name][pos[0]*8 + pos[1]]
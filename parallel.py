@@ -0,0 +1,164 @@
+'''
+Parallel search by root splitting: each iteration of the search hands the root moves out to a
+pool of worker processes. The best move of the previous iteration is searched first, then the
+others are searched at the same time against the score it set. Positions are sent to the
+workers as the 65 bytes of GameState.pack rather than as pickled GameState objects.
+'''
+import os
+import time
+import rules
+import engine
+from gamestate import GameState
+
+# Each worker process keeps one Engine and one GameState for its lifetime. Every pool of
+# searching processes, here and in server and selfplay, is set up by startWorker
+worker = None
+position = None
+
+def startWorker(tableSize, stopEvent=None, nodeCount=None):
+    '''
+    Sets up a worker process
+        Int tableSize: The number of entries in the worker's transposition table
+        Event stopEvent: Set by the main process to stop every worker's search, or None
+        Value nodeCount: The nodes searched by every worker, which a nodes budget is spent
+                         from, or None for each search to have its own
+    '''
+    global worker, position
+    worker = engine.Engine(tableSize)
+    worker.stopEvent = stopEvent
+    worker.sharedNodes = nodeCount
+    position = GameState()
+    return
+
+def searchRootMove(data, previous, move, depth, alpha, deadline, nodes):
+    '''
+    Searches one root move in a worker process.
+    Returns (score, nodes searched, whether the search finished, principal variation)
+        Bytes data: The root position from GameState.pack
+        Set previous: Keys of the positions played before the root, for repetitions
+        Tuple move: The root move to search
+        Int depth: The depth of the iteration, including the root move
+        Int alpha: The score the root side is already guaranteed by another move
+        Float deadline: The time.time() to stop at, or None; tasks can wait in the queue, so
+            the time left is only known once one starts
+        Int nodes: The number of nodes the whole search may use, shared by every task, or None
+    '''
+    movetime = None
+    if deadline is not None:
+        movetime = deadline - time.time()
+        if movetime <= 0:
+            return (0, 0, False, [move])
+    if nodes is not None and worker.sharedNodes.value >= nodes:
+        return (0, 0, False, [move])
+    position.unpack(data)
+    worker.previous = previous
+    worker.prepare(depth, movetime, nodes)
+    position.makeMove(*move)
+    score = -worker.negamax(position, depth - 1, -engine.INFINITY, -alpha, 1)
+    pv = [move]
+    if not worker.stopped:
+        pv += worker.principalVariation(position, depth - 1)
+    # The last few nodes, searched since the budget was last checked
+    worker.countNodes()
+    return (score, worker.nodes, not worker.stopped, pv)
+
+class ParallelSearch:
+    def __init__(self, workers=None, tableSize=1 << 16):
+        '''
+        A search spread over a pool of processes, with the same search interface as Engine
+            Int workers: The number of processes, by default one per CPU
+            Int tableSize: The number of transposition table entries of each process
+        '''
+        # Imported here as they take longer to import than the rest of the search together
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        self.workers = workers or os.cpu_count() or 1
+        self.stopEvent = multiprocessing.Event()
+        self.nodeCount = multiprocessing.Value("q", 0)
+        self.pool = ProcessPoolExecutor(self.workers, initializer=startWorker,
+            initargs=(tableSize, self.stopEvent, self.nodeCount))
+        # Start the workers now rather than at the first search: forked from a search thread
+        # while another thread reads stdin, a worker would wait forever to close its copy
+        self.pool.submit(int).result()
+        self.previous = set()   # Keys of positions before the root, as Engine.previous
+
+    def stop(self):
+        '''
+        Asks a running search to finish as soon as possible
+        '''
+        self.stopEvent.set()
+        return
+
+    def close(self):
+        '''
+        Shuts down the worker processes
+        '''
+        self.pool.shutdown()
+        return
+
+    def search(self, gs, depth=64, movetime=None, nodes=None, info=None):
+        '''
+        Searches the position by iterative deepening until a budget runs out and returns a
+        SearchResult for the deepest iteration completed
+            GameState gs: The position to search; it is not changed
+            Int depth: The deepest iteration to run
+            Float movetime: The number of seconds to stop after, or None
+            Int nodes: The number of nodes to stop after, or None
+            Function info: Called with a SearchResult after each completed iteration
+        '''
+        from concurrent.futures import as_completed
+        start = time.perf_counter()
+        moves = rules.legalMoves(gs)
+        if not moves:
+            return engine.SearchResult(None, 0, 0, 0, 0, [])
+        result = engine.SearchResult(moves[0], 0, 0, 0, 0, [moves[0]])
+        data = gs.pack()
+        previous = self.previous | set(record.zobrist for record in gs.history)
+        total = 0
+        # Every task spends from the one budget, so nodes means the same for any number of workers
+        self.nodeCount.value = 0
+        deadline = None
+        if movetime is not None:
+            deadline = time.time() + movetime
+
+        for d in range(1, depth + 1):
+            # The first move sets the score the others have to beat
+            score, count, completed, pv = self.pool.submit(searchRootMove, data, previous,
+                moves[0], d, -engine.INFINITY, deadline, nodes).result()
+            total += count
+            if not completed:
+                break
+            best, bestMove, bestPv = score, moves[0], pv
+            scores = {moves[0]: score}
+
+            futures = {}
+            for move in moves[1:]:
+                futures[self.pool.submit(searchRootMove, data, previous, move, d, best,
+                    deadline, nodes)] = move
+            for future in as_completed(futures):
+                score, count, completed, pv = future.result()
+                total += count
+                if not completed:
+                    continue
+                scores[futures[future]] = score
+                if score > best:
+                    best, bestMove, bestPv = score, futures[future], pv
+            if len(scores) < len(moves):
+                break
+
+            # Search the best moves first in the next iteration
+            moves.sort(key=scores.get, reverse=True)
+            moves.remove(bestMove)
+            moves.insert(0, bestMove)
+            result = engine.SearchResult(bestMove, best, d, total, time.perf_counter() - start, bestPv)
+            if info is not None:
+                info(result)
+            if abs(best) > engine.MATE_BOUND:
+                break
+
+        # Cleared at the end rather than the start, so a stop which comes first is not lost
+        self.stopEvent.clear()
+        result.nodes = total
+        result.elapsed = time.perf_counter() - start
+        result.nps = int(result.nodes / max(result.elapsed, 1e-9))
+        return result
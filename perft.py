@@ -0,0 +1,140 @@
+'''
+Perft: counts the leaf nodes of the legal move tree to a fixed depth and compares them
+against the known counts, as a correctness check and speed measure of move generation.
+
+    python perft.py                     Runs every position to depth 2
+    python perft.py -d 3 kiwipete       Runs one position to depth 3
+    python perft.py -d 3 --divide start Splits the count by root move, for debugging
+'''
+import sys
+import time
+import rules
+from gamestate import GameState
+
+# name: (FEN, leaf counts by depth)
+POSITIONS = {
+    "start": ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        [20, 400, 8902, 197281, 4865609]),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        [48, 2039, 97862, 4085603]),
+    "position3": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624]),
+    "position4": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        [6, 264, 9467, 422333]),
+    "position5": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        [44, 1486, 62379, 2103487]),
+    "position6": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        [46, 2079, 89890, 3894594]),
+    "illegalEp": ("3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",
+        [18, 92, 1670]),
+    "epCheck": ("8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1",
+        [15, 126, 1928]),
+    "castleCheck": ("5k2/8/8/8/8/8/8/4K2R w K - 0 1",
+        [15, 66, 1198]),
+    "queensideCheck": ("3k4/8/8/8/8/8/8/R3K3 w Q - 0 1",
+        [16, 71, 1286]),
+    "castleRights": ("r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1",
+        [26, 1141, 27826]),
+    "castlePrevented": ("r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1",
+        [44, 1494, 50509]),
+    "promoteOutOfCheck": ("2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1",
+        [11, 133, 1442]),
+    "underpromote": ("8/P1k5/K7/8/8/8/8/8 w - - 0 1",
+        [6, 27, 273])
+}
+
+def makePosition(name, backend="piece"):
+    '''
+    Returns a GameState set up with one of the perft positions
+        String name: The key of the position in POSITIONS
+        String backend: The move generation backend the GameState uses
+    '''
+    gs = GameState(backend)
+    gs.loadFen(POSITIONS[name][0])
+    return gs
+
+def perft(gs, depth):
+    '''
+    Returns the number of leaf nodes of the legal move tree below the current position
+        GameState gs: The current Game State object
+        Int depth: The number of plies to search
+    '''
+    if depth == 0:
+        return 1
+    moves = rules.legalMoves(gs)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(*move)
+        nodes += perft(gs, depth - 1)
+        gs.unmakeMove()
+    return nodes
+
+def divide(gs, depth):
+    '''
+    Returns a dictionary of the perft count below each legal move, keyed by coordinate notation
+        GameState gs: The current Game State object
+        Int depth: The number of plies to search, including the root move
+    '''
+    counts = {}
+    for move in rules.legalMoves(gs):
+        gs.makeMove(*move)
+        counts[rules.moveName(move)] = perft(gs, depth - 1)
+        gs.unmakeMove()
+    return counts
+
+def runSuite(names, depth, backend="piece"):
+    '''
+    Runs perft on each position up to the given depth, printing counts and nodes per second.
+    Returns the number of counts which did not match
+        List names: The keys of the positions in POSITIONS to run
+        Int depth: The deepest depth to run each position to
+        String backend: The move generation backend to test
+    '''
+    failures = 0
+    totalNodes = 0
+    totalTime = 0
+    for name in names:
+        counts = POSITIONS[name][1]
+        for d in range(1, min(depth, len(counts)) + 1):
+            gs = makePosition(name, backend)
+            start = time.perf_counter()
+            nodes = perft(gs, d)
+            elapsed = time.perf_counter() - start
+            totalNodes += nodes
+            totalTime += elapsed
+            if nodes == counts[d-1]:
+                result = "ok"
+            else:
+                result = "FAIL (expected {a})".format(a=counts[d-1])
+                failures += 1
+            print("{a:18} depth {b}  {c:9} nodes  {d:9.0f} nps  {e}".format(
+                a=name, b=d, c=nodes, d=nodes / elapsed, e=result))
+    print("{a} nodes in {b:.2f} s, {c:.0f} nps, {d} failures".format(
+        a=totalNodes, b=totalTime, c=totalNodes / max(totalTime, 1e-9), d=failures))
+    return failures
+
+def main(argv):
+    # Imported here so the module stays quick to import for tools which only want perft()
+    import argparse
+    parser = argparse.ArgumentParser(description="Perft for the move generator")
+    parser.add_argument("positions", nargs="*", help="positions to run (default: all)")
+    parser.add_argument("-d", "--depth", type=int, default=2)
+    parser.add_argument("--divide", action="store_true", help="split the count by root move")
+    parser.add_argument("--backend", choices=["piece", "bitboard", "mailbox"], default="piece")
+    args = parser.parse_args(argv)
+    names = args.positions or list(POSITIONS)
+
+    if args.divide:
+        for name in names:
+            counts = divide(makePosition(name, args.backend), args.depth)
+            for move in sorted(counts):
+                print("{a}: {b}".format(a=move, b=counts[move]))
+            print("{a} moves, {b} nodes".format(a=len(counts), b=sum(counts.values())))
+        return 0
+
+    return 1 if runSuite(names, args.depth, args.backend) else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,362 @@
+'''
+Reading and writing games in Portable Game Notation. Games are streamed one at a time, so
+files of any size are read in constant memory, and moves in Standard Algebraic Notation
+are replayed through the rules with movePiece and promotePawn.
+
+    python pgn.py games.pgn             Replays every game, reporting games per second
+    python pgn.py -j 4 games.pgn        Splits the file into chunks replayed by 4 processes
+'''
+import os
+import sys
+import time
+import rules
+from gamestate import GameState
+
+# The tags every PGN game starts with, in order
+ROSTER = ["Event", "Site", "Date", "Round", "White", "Black", "Result"]
+RESULTS = ["1-0", "0-1", "1/2-1/2", "*"]
+
+def sanName(gs, move):
+    '''
+    Returns a move in Standard Algebraic Notation, e.g. "Nbd7", "exd6", "e8=Q+" or "O-O#"
+        GameState gs: The position before the move; it is left as it was found
+        Tuple move: A (from, to, promotion) tuple as returned by legalMoves
+    '''
+    board = gs.getBoard()
+    pos1, pos2, promotion = move
+    kind = board[pos1[0]][pos1[1]].getName()[1]
+    target = board[pos2[0]][pos2[1]].getName()
+    capture = target[0] != "-" or (kind == "p" and target[1] == "e")
+
+    if kind == "K" and abs(pos2[1] - pos1[1]) == 2:
+        if pos2[1] == 6:
+            san = "O-O"
+        else:
+            san = "O-O-O"
+    elif kind == "p":
+        san = ""
+        if capture:
+            san = "abcdefgh"[pos1[1]] + "x"
+        san += rules.squareName(pos2)
+        if promotion is not None:
+            san += "=" + promotion[1]
+    else:
+        # Other pieces of the same kind which can reach the same square
+        others = [m[0] for m in rules.legalMovesTo(gs, pos2, kind) if m[0] != pos1]
+        san = kind
+        if others:
+            if all(other[1] != pos1[1] for other in others):
+                san += "abcdefgh"[pos1[1]]
+            elif all(other[0] != pos1[0] for other in others):
+                san += str(8 - pos1[0])
+            else:
+                san += rules.squareName(pos1)
+        if capture:
+            san += "x"
+        san += rules.squareName(pos2)
+
+    gs = rules.playMove(gs, move)
+    status = rules.updateGameStatus(gs)
+    if status == "#":
+        san += "#"
+    elif gs.inCheck("w" if gs.whitesTurn() else "b"):
+        san += "+"
+    gs.unmakeMove()
+    return san
+
+def parseSan(gs, san):
+    '''
+    Returns the (from, to, promotion) tuple of a legal move written in Standard Algebraic
+    Notation. Raises ValueError if no legal move, or more than one, matches
+        GameState gs: The current Game State object
+        String san: The move, e.g. "Nf3", "exd6", "e8=Q+", "O-O"
+    '''
+    text = san.rstrip("+#!?")
+    if text in ["O-O", "0-0", "O-O-O", "0-0-0"]:
+        if gs.whitesTurn():
+            r = 7
+        else:
+            r = 0
+        if len(text) == 3:
+            target = (r, 6)
+        else:
+            target = (r, 2)
+        matches = [m for m in rules.legalMovesTo(gs, target, "K") if m[0] == (r, 4)]
+    else:
+        promotion = None
+        if "=" in text:
+            text, promotion = text.split("=")
+        elif text[-1] in "QRBN" and len(text) > 2 and text[-2].isdigit():
+            text, promotion = text[:-1], text[-1]
+        kind = "p"
+        if text[0] in "KQRBN":
+            kind = text[0]
+            text = text[1:]
+        if len(text) < 2:
+            raise ValueError("Invalid SAN {a!r}".format(a=san))
+        target = rules.squarePos(text[-2:])
+        hint = text[:-2].replace("x", "")
+        matches = []
+        for m in rules.legalMovesTo(gs, target, kind):
+            if m[2] is not None and m[2][1] != promotion:
+                continue
+            if m[2] is None and promotion is not None:
+                continue
+            if any(rules.squareName(m[0])[0 if c.isalpha() else 1] != c for c in hint):
+                continue
+            matches.append(m)
+    if len(matches) != 1:
+        raise ValueError("{a} move {b!r} in {c}".format(
+            a="Illegal" if not matches else "Ambiguous", b=san, c=gs.getFen()))
+    return matches[0]
+
+def readGames(lines):
+    '''
+    Generates the (tags, movetext) of each game in an iterable of PGN lines, one game at a
+    time, where tags is a dictionary of the tag pairs and movetext the moves as one string
+        Iterable lines: The lines, e.g. an open file
+    '''
+    tags = {}
+    movetext = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("%"):
+            continue
+        if line.startswith("["):
+            # A tag after movetext starts the next game
+            if movetext:
+                yield tags, "\n".join(movetext)
+                tags = {}
+                movetext = []
+            name, sep, value = line[1:-1].partition(" ")
+            tags[name] = value.strip().strip('"')
+        elif line:
+            movetext.append(line)
+    if tags or movetext:
+        yield tags, "\n".join(movetext)
+    return
+
+def tokenize(movetext):
+    '''
+    Generates the moves of some movetext, leaving out move numbers, comments, variations,
+    annotation glyphs and the result
+        String movetext: The moves of one game
+    '''
+    depth = 0   # How many variations deep the text is
+    i = 0
+    n = len(movetext)
+    while i < n:
+        c = movetext[i]
+        if c == "{":
+            end = movetext.find("}", i)
+            i = n if end < 0 else end + 1
+            continue
+        elif c == ";":
+            end = movetext.find("\n", i)
+            i = n if end < 0 else end + 1
+            continue
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        if c in "()" or c.isspace():
+            i += 1
+            continue
+        j = i
+        while j < n and not movetext[j].isspace() and movetext[j] not in "{};()":
+            j += 1
+        token = movetext[i:j]
+        i = j
+        if depth > 0 or token in RESULTS or token[0] == "$":
+            continue
+        # Move numbers, possibly run into the move as in "1.e4"
+        token = token.lstrip("0123456789").lstrip(".")
+        if token:
+            yield token
+    return
+
+def replayGame(tags, movetext, gs=None):
+    '''
+    Plays through the moves of a game, returning the GameState at the end and the list of
+    moves played. Raises ValueError at the first illegal move
+        Dict tags: The tag pairs of the game; a FEN tag gives the starting position
+        String movetext: The moves of the game
+        GameState gs: A GameState to reuse, or None for a new one
+    '''
+    if gs is None:
+        gs = GameState()
+    if "FEN" in tags:
+        gs.loadFen(tags["FEN"])
+    else:
+        gs.makeDefaultBoard()
+    moves = []
+    for san in tokenize(movetext):
+        move = parseSan(gs, san)
+        rules.playMove(gs, move)
+        moves.append(move)
+    return gs, moves
+
+def gameResult(gs):
+    '''
+    Returns the PGN result of the game in the position reached: "1-0", "0-1", "1/2-1/2", or
+    "*" while it goes on
+        GameState gs: The current Game State object
+    '''
+    status = rules.updateGameStatus(gs)
+    if status == "#":
+        if gs.whitesTurn():
+            return "0-1"
+        return "1-0"
+    elif status in [".", "+"]:
+        return "*"
+    return "1/2-1/2"
+
+def writeGame(out, tags, moves, startFen=None, width=80):
+    '''
+    Writes one game as PGN: the seven tag roster, then any other tags, then the moves in
+    Standard Algebraic Notation wrapped to a line width
+        File out: Where to write the game, e.g. an open file or sys.stdout
+        Dict tags: The tag pairs; missing roster tags are written as "?"
+        List moves: The (from, to, promotion) tuples played
+        String startFen: The starting position, or None for the usual one
+        Int width: The longest line of movetext
+    '''
+    gs = GameState()
+    if startFen is None:
+        gs.makeDefaultBoard()
+    else:
+        gs.loadFen(startFen)
+    words = []
+    for move in moves:
+        number = gs.fullmoves
+        if gs.whitesTurn():
+            words.append("{a}.".format(a=number))
+        elif not words:
+            words.append("{a}...".format(a=number))
+        words.append(sanName(gs, move))
+        rules.playMove(gs, move)
+    result = tags.get("Result", gameResult(gs))
+    words.append(result)
+
+    tags = dict(tags)
+    tags["Result"] = result
+    if startFen is not None:
+        tags["SetUp"] = "1"
+        tags["FEN"] = startFen
+    for name in ROSTER:
+        out.write('[{a} "{b}"]\n'.format(a=name, b=tags.get(name, "?")))
+    for name, value in tags.items():
+        if name not in ROSTER:
+            out.write('[{a} "{b}"]\n'.format(a=name, b=value))
+    out.write("\n")
+    line = ""
+    for word in words:
+        if line and len(line) + 1 + len(word) > width:
+            out.write(line + "\n")
+            line = word
+        elif line:
+            line += " " + word
+        else:
+            line = word
+    out.write(line + "\n\n")
+    return
+
+def replayLines(lines):
+    '''
+    Replays every game of some PGN lines, returning (games, plies, errors)
+        Iterable lines: The lines, e.g. an open file
+    '''
+    games = 0
+    plies = 0
+    errors = 0
+    gs = GameState()
+    for tags, movetext in readGames(lines):
+        games += 1
+        try:
+            gs, moves = replayGame(tags, movetext, gs)
+            plies += len(moves)
+        except ValueError:
+            errors += 1
+    return games, plies, errors
+
+def findChunks(path, count):
+    '''
+    Returns (start, end) byte offsets splitting a PGN file into about count chunks, each
+    starting at the first tag of a game
+        String path: The file to split
+        Int count: The number of chunks wanted
+    '''
+    size = os.path.getsize(path)
+    starts = [0]
+    with open(path, "rb") as f:
+        for i in range(1, count):
+            f.seek(max(size * i // count, starts[-1]))
+            f.readline()    # Skip to the start of a line
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line or line.startswith(b"[Event "):
+                    break
+            if offset > starts[-1] and offset < size:
+                starts.append(offset)
+    return list(zip(starts, starts[1:] + [size]))
+
+def readChunk(path, start, end):
+    '''
+    Generates the lines of a file between two byte offsets
+        String path: The file to read
+        Int start: The offset of the first line
+        Int end: The offset to stop at
+    '''
+    with open(path, "rb") as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line.decode("utf-8", "replace")
+    return
+
+def replayChunk(path, start, end):
+    '''
+    Replays the games of one chunk of a file in a worker process, returning (games, plies, errors)
+    '''
+    return replayLines(readChunk(path, start, end))
+
+def replayFile(path, workers=1):
+    '''
+    Replays every game of a PGN file, in parallel chunks if workers > 1.
+    Returns (games, plies, errors)
+        String path: The file to read
+        Int workers: The number of processes to use
+    '''
+    if workers <= 1:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return replayLines(f)
+    # Imported here as only parallel replays need it
+    from concurrent.futures import ProcessPoolExecutor
+    totals = [0, 0, 0]
+    with ProcessPoolExecutor(workers) as pool:
+        chunks = findChunks(path, workers * 4)
+        for counts in pool.map(replayChunk, [path] * len(chunks), *zip(*chunks)):
+            for i in range(3):
+                totals[i] += counts[i]
+    return tuple(totals)
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay PGN files through the rules")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes")
+    args = parser.parse_args(argv)
+    for path in args.files:
+        start = time.perf_counter()
+        games, plies, errors = replayFile(path, args.jobs)
+        elapsed = time.perf_counter() - start
+        print("{a}: {b} games, {c} plies, {d} errors in {e:.2f} s, {f:.1f} games/s, {g:.0f} plies/s".format(
+            a=path, b=games, c=plies, d=errors, e=elapsed, f=games / max(elapsed, 1e-9),
+            g=plies / max(elapsed, 1e-9)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
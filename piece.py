@@ -1,6 +1,12 @@
 from abc import ABC, abstractmethod
 
+# Every piece's name, in the order tables indexed by piece use, e.g. Zobrist keys and bitboards
+NAMES = ["wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK"]
+
 class Piece(ABC):
+    # Pieces are created and copied often enough that a fixed layout is worth having
+    __slots__ = ("name", "colour", "moved", "pos")
+
     def __init__(self, name):
         '''
         Data structure for a generic Chess Piece
@@ -21,6 +27,10 @@ class Piece(ABC):
         return self.colour
 
     def getPos(self):
+        '''
+        Returns the piece's square. Only real pieces know theirs: every empty square shares
+        one Space, which always returns (-1, -1), so use the square the board was read at
+        '''
         return self.pos
 
     def hasMoved(self):
@@ -30,6 +40,10 @@ class Piece(ABC):
         self.moved = True
         return
 
+    def setMoved(self, moved):
+        self.moved = moved
+        return
+
     def setPos(self, pos):
         self.pos = pos
         return
@@ -41,67 +55,110 @@ class Piece(ABC):
         '''
         pass
 
-def checkDiagonals(r, f, colour, board):
+    @abstractmethod
+    def checkWatchedSquares(self, board):
+        '''
+        Returns every square whose contents can change the moves returned by checkValidMoves
+        '''
+        pass
+
+DIAGONALS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+STRAIGHTS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+KNIGHT_STEPS = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+KING_STEPS = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+
+def buildSteps(steps):
     '''
-    Helper function for checking the possible diagonal moves of a piece
+    Returns a table of the squares a single step away from each square, in the order of the
+    steps, leaving out those off the board. Tables are indexed [rank][file]
+        List steps: (rank, file) steps, e.g. a knight's jumps
+    '''
+    return [[tuple((r + dr, f + df) for dr, df in steps if 0 <= r + dr <= 7 and 0 <= f + df <= 7)
+        for f in range(8)] for r in range(8)]
+
+def buildRay(dr, df):
+    '''
+    Returns a table of the squares from each square to the edge of the board in one direction,
+    nearest first
+        Int dr: The rank step
+        Int df: The file step
+    '''
+    table = []
+    for r in range(8):
+        rank = []
+        for f in range(8):
+            ray = []
+            i = r + dr
+            j = f + df
+            while 0 <= i <= 7 and 0 <= j <= 7:
+                ray.append((i, j))
+                i += dr
+                j += df
+            rank.append(tuple(ray))
+        table.append(rank)
+    return table
+
+# Built once here so that move generation only has to walk them
+KNIGHT_TARGETS = buildSteps(KNIGHT_STEPS)
+KING_TARGETS = buildSteps(KING_STEPS)
+RAYS = {d: buildRay(*d) for d in DIAGONALS + STRAIGHTS}
+# Pawns by colour: the square ahead and the one after it, the squares captured on, and
+# every square that can change the pawn's moves
+PAWN_PUSHES = {"w": buildSteps([(-1, 0), (-2, 0)]), "b": buildSteps([(1, 0), (2, 0)])}
+PAWN_CAPTURES = {"w": buildSteps([(-1, -1), (-1, 1)]), "b": buildSteps([(1, -1), (1, 1)])}
+PAWN_WATCHED = {"w": buildSteps([(-1, -1), (-1, 0), (-1, 1)]), "b": buildSteps([(1, -1), (1, 0), (1, 1)])}
+
+def watchRays(r, f, board, directions):
+    '''
+    Helper function for the squares a sliding piece watches: each ray up to and including
+    the first piece on it, whatever its colour
         Int r: The piece's corresponding rank on the board
         Int f: The piece's corresponding file on the board
-        String colour: A letter corresponding to the piece's colour
         List board: A list of lists of pieces, each corresponding to a rank
+        List directions: (rank, file) steps of the rays
     '''
-    diagonalMoves = []
-    b = 7 - r # Number of rows below the piece
-    a = 7 - b # Number of rows above the piece
-    # Checking diagonally down-right
-    for i in range(b):
-        if 1 <= (r+i+1) <= 7 and 1 <= (f+i+1) <= 7:
-            c = board[r+i+1][f+i+1].getColour()
-            if c != colour:
-                diagonalMoves.append((r+i+1, f+i+1))
-                if c != "-":
-                    break
-            else:
+    watched = []
+    for d in directions:
+        for i, j in RAYS[d][r][f]:
+            watched.append((i, j))
+            if board[i][j].colour != "-":
                 break
-        else:
-            break
-    # Checking diagonally down-left
-    for i in range(b):
-        if 1 <= (r+i+1) <= 7 and 0 <= (f-i-1) <= 6:
-            c = board[r+i+1][f-i-1].getColour()
-            if c != colour:
-                diagonalMoves.append((r+i+1, f-i-1))
-                if c != "-":
-                    break
-            else: 
-                break
-        else:
-            break
-    # Checking diagonally up-right
-    for i in range(a):
-        if 0 <= (r-i-1) <= 6 and 1 <= (f+i+1) <= 7:
-            c = board[r-i-1][f+i+1].getColour()
-            if c != colour:
-                diagonalMoves.append((r-i-1, f+i+1))
-                if c != "-":
-                    break
-            else: 
-                break
-        else:
-            break
-    # Checking diagonally up-left
-    for i in range(a):
-        if 0 <= (r-i-1) <= 6 and 0 <= (f-i-1) <= 6:
-            c = board[r-i-1][f-i-1].getColour()
-            if c != colour:
-                diagonalMoves.append((r-i-1, f-i-1))
-                if c != "-":
-                    break
+    return watched
+
+def checkRays(r, f, colour, board, directions):
+    '''
+    Helper function for the moves of a sliding piece: each ray up to the first piece on it,
+    including that piece if it can be captured
+        Int r: The piece's corresponding rank on the board
+        Int f: The piece's corresponding file on the board
+        String colour: A letter corresponding to the piece's colour
+        List board: A list of lists of pieces, each corresponding to a rank
+        List directions: (rank, file) steps of the rays
+    '''
+    moves = []
+    for d in directions:
+        for i, j in RAYS[d][r][f]:
+            c = board[i][j].colour
+            if c == "-":
+                moves.append((i, j))
             else:
+                if c != colour:
+                    moves.append((i, j))
                 break
-        else:
-            break
+    return moves
+
+# The order checkStraights has always returned moves in: up, down, left, right
+FILE_RANK_ORDER = [(-1, 0), (1, 0), (0, -1), (0, 1)]
 
-    return diagonalMoves
+def checkDiagonals(r, f, colour, board):
+    '''
+    Helper function for checking the possible diagonal moves of a piece
+        Int r: The piece's corresponding rank on the board
+        Int f: The piece's corresponding file on the board
+        String colour: A letter corresponding to the piece's colour
+        List board: A list of lists of pieces, each corresponding to a rank
+    '''
+    return checkRays(r, f, colour, board, DIAGONALS)
 
 def checkStraights(r, f, colour, board):
     '''
@@ -111,116 +168,77 @@ def checkStraights(r, f, colour, board):
         String colour: A letter corresponding to the piece's colour
         List board: A list of lists of pieces, each corresponding to a rank
     '''
-    straightMoves = []
-    # Checking upwards in the file
-    for i in range(r-1, -1, -1):
-        c = board[i][f].getColour()
-        if c != colour:
-            straightMoves.append((i, f))
-            if c != "-":
-                break
-        else:
-            break
-    # Checking downwards in the file
-    for i in range(r+1, 8):
-        c = board[i][f].getColour()
-        if c != colour:
-            straightMoves.append((i, f))
-            if c != "-":
-                break
-        else:
-            break
-    # Checking to the left in the rank
-    for i in range(f-1, -1, -1):
-        c = board[r][i].getColour()
-        if c != colour:
-            straightMoves.append((r, i))
-            if c != "-":
-                break
-        else:
-            break
-    # Checking to the right in the rank
-    for i in range(f+1, 8):
-        c = board[r][i].getColour()
-        if c != colour:
-            straightMoves.append((r, i))
-            if c != "-":
-                break
-        else:
-            break 
-    return straightMoves
+    return checkRays(r, f, colour, board, FILE_RANK_ORDER)
 
 class Pawn(Piece):
+    __slots__ = ()
+
     def checkValidMoves(self, board):
         r = self.pos[0]
         f = self.pos[1]
         validMoves = []
-        blocked = True #Whether or not there is a piece directly in front of it
-        # White Pawn
         if self.colour == "w":
-            if board[r-1][f].getName() == "--":
-                validMoves.append((r-1, f))
-                blocked = False
-            if f > 0:
-                if board[r-1][f-1].getColour() == "b" or board[r-1][f-1].getName()[1] == "e":
-                    validMoves.append((r-1, f-1))
-            if f < 7:
-                if board[r-1][f+1].getColour() == "b" or board[r-1][f+1].getName()[1] == "e":
-                    validMoves.append((r-1, f+1))
-            if not self.moved and not blocked:
-                if board[r-2][f].getName() == "--":
-                    validMoves.append((r-2, f))
-        # Black Pawn
+            enemy = "b"
         else:
-            if board[r+1][f].getName() == "--":
-                validMoves.append((r+1, f))
-                blocked = False
-            if f > 0:
-                if board[r+1][f-1].getColour() == "w" or board[r+1][f-1].getName()[1] == "e":
-                    validMoves.append((r+1, f-1))
-            if f < 7:
-                if board[r+1][f+1].getColour() == "w" or board[r+1][f+1].getName()[1] == "e":
-                    validMoves.append((r+1, f+1))
-            if not self.moved and not blocked:
-                if board[r+2][f].getName() == "--":
-                    validMoves.append((r+2, f))
+            enemy = "w"
+        pushes = PAWN_PUSHES[self.colour][r][f]
+        blocked = True #Whether or not there is a piece directly in front of it
+        if pushes and board[pushes[0][0]][pushes[0][1]].name == "--":
+            validMoves.append(pushes[0])
+            blocked = False
+        for i, j in PAWN_CAPTURES[self.colour][r][f]:
+            p = board[i][j]
+            if p.colour == enemy or p.name[1] == "e":
+                validMoves.append((i, j))
+        if not self.moved and not blocked and len(pushes) > 1:
+            if board[pushes[1][0]][pushes[1][1]].name == "--":
+                validMoves.append(pushes[1])
 
         return validMoves
 
-class Knight(Piece):
-    def checkValidMoves(self, board):
-        validMoves = []
-        possibleMoves = []
+    def checkWatchedSquares(self, board):
         r = self.pos[0]
         f = self.pos[1]
-        possibleMoves.append((r-2, f-1))
-        possibleMoves.append((r-2, f+1))
-        possibleMoves.append((r-1, f-2))
-        possibleMoves.append((r-1, f+2))
-        possibleMoves.append((r+1, f-2))
-        possibleMoves.append((r+1, f+2))
-        possibleMoves.append((r+2, f-1))
-        possibleMoves.append((r+2, f+1))
-        for move in possibleMoves:
-            if 0 <= move[0] <= 7 and 0 <= move[1] <= 7:
-                if board[move[0]][move[1]].getColour() != self.colour:
-                    validMoves.append(move)
+        watched = PAWN_WATCHED[self.colour][r][f]
+        if not self.moved:
+            return watched + PAWN_PUSHES[self.colour][r][f][1:]
+        return watched
 
-        return validMoves
+class Knight(Piece):
+    __slots__ = ()
+
+    def checkValidMoves(self, board):
+        colour = self.colour
+        return [(i, j) for i, j in KNIGHT_TARGETS[self.pos[0]][self.pos[1]] if board[i][j].colour != colour]
+
+    def checkWatchedSquares(self, board):
+        return KNIGHT_TARGETS[self.pos[0]][self.pos[1]]
 
 class Bishop(Piece):
+    __slots__ = ()
+
     def checkValidMoves(self, board):
         r = self.pos[0]
         f = self.pos[1]
         return checkDiagonals(r, f, self.colour, board)
 
+    def checkWatchedSquares(self, board):
+        return watchRays(self.pos[0], self.pos[1], board, DIAGONALS)
+
 class Rook(Piece):
+    __slots__ = ()
+
     def checkValidMoves(self, board):
         r = self.pos[0]
         f = self.pos[1]
         return checkStraights(r, f, self.colour, board)
 
+    def checkWatchedSquares(self, board):
+        return watchRays(self.pos[0], self.pos[1], board, STRAIGHTS)
+
 class Queen(Piece):
+    __slots__ = ()
+
     def checkValidMoves(self, board):
         r = self.pos[0]
         f = self.pos[1]
@@ -228,24 +246,17 @@ class Queen(Piece):
         straights = checkStraights(r, f, self.colour, board)
         return diagonals + straights
 
+    def checkWatchedSquares(self, board):
+        return watchRays(self.pos[0], self.pos[1], board, DIAGONALS + STRAIGHTS)
+
 class King(Piece):
+    __slots__ = ()
+
     def checkValidMoves(self, board):
-        validMoves = []
         r = self.pos[0]
         f = self.pos[1]
-        possibleMoves = []
-        possibleMoves.append((r-1, f-1))
-        possibleMoves.append((r-1, f))
-        possibleMoves.append((r-1, f+1))
-        possibleMoves.append((r, f+1))
-        possibleMoves.append((r+1, f+1))
-        possibleMoves.append((r+1, f))
-        possibleMoves.append((r+1, f-1))
-        possibleMoves.append((r, f-1))
-        for move in possibleMoves:
-            if 0 <= move[0] <= 7 and 0 <= move[1] <= 7:
-                if board[move[0]][move[1]].getColour() != self.colour:
-                    validMoves.append(move)
+        colour = self.colour
+        validMoves = [(i, j) for i, j in KING_TARGETS[r][f] if board[i][j].colour != colour]
 
         # Checking for castling
         if not self.moved:
@@ -260,7 +271,35 @@ class King(Piece):
 
         return validMoves
 
-# Not an actual chess piece, just an empty space on the board
+    def checkWatchedSquares(self, board):
+        r = self.pos[0]
+        f = self.pos[1]
+        watched = KING_TARGETS[r][f]
+        # The squares between the king and the rooks, and the rooks themselves
+        if not self.moved:
+            watched = watched + tuple((r, i) for i in [0, 1, 2, 3, 5, 6, 7])
+        return watched
+
+# Not an actual chess piece, just an empty space on the board. Every empty square shares
+# one of the two instances below, so a Space never moves and has no position of its own:
+# its getPos is always (-1, -1)
 class Space(Piece):
+    __slots__ = ()
+
+    def move(self):
+        return
+
+    def setMoved(self, moved):
+        return
+
+    def setPos(self, pos):
+        return
+
     def checkValidMoves(self, board):
         return []
+
+    def checkWatchedSquares(self, board):
+        return []
+
+EMPTY = Space("--")
+PASSANT = Space("-e")   # The square a pawn just skipped, which can be captured en passant
@@ -0,0 +1,59 @@
+'''
+Bulk loading of positions in Forsyth-Edwards Notation, for test suites, benchmarks and
+analysis jobs. Every line is loaded into the same GameState in turn, so millions of
+positions can be streamed from a file without building a new board for each.
+
+    python positions.py suite.epd       Loads every position, reporting positions per second
+'''
+import sys
+import time
+from gamestate import GameState
+
+def readFens(lines, gs=None, backend="piece"):
+    '''
+    Generates a GameState for each position in an iterable of FEN or EPD lines. The same
+    GameState is returned every time, set up with the next position, so copy anything needed
+    before asking for the next one. Blank lines and lines starting with "#" are skipped
+        Iterable lines: The lines, e.g. an open file
+        GameState gs: The GameState to load the positions into, or None for a new one
+        String backend: The move generation backend of the new GameState
+    '''
+    if gs is None:
+        gs = GameState(backend)
+    for line in lines:
+        fields = line.split(";")[0].split()
+        if not fields or fields[0].startswith("#"):
+            continue
+        # EPD lines have operations such as "bm e4" where FEN has its clocks
+        fen = fields[:4]
+        if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():
+            fen += fields[4:6]
+        gs.loadFen(" ".join(fen))
+        yield gs
+    return
+
+def loadFile(path, gs=None, backend="piece"):
+    '''
+    Generates a GameState for each position in a FEN or EPD file, as readFens
+        String path: The file to read
+        GameState gs: The GameState to load the positions into, or None for a new one
+        String backend: The move generation backend of the new GameState
+    '''
+    with open(path) as f:
+        for position in readFens(f, gs, backend):
+            yield position
+    return
+
+def main(argv):
+    for path in argv:
+        count = 0
+        start = time.perf_counter()
+        for gs in loadFile(path):
+            count += 1
+        elapsed = time.perf_counter() - start
+        print("{a}: {b} positions in {c:.2f} s, {d:.0f} positions/s".format(
+            a=path, b=count, c=elapsed, d=count / max(elapsed, 1e-9)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,436 @@
+'''
+The rules of Chess, independent of the pygame interface
+'''
+from piece import KNIGHT_TARGETS, KING_TARGETS, PAWN_CAPTURES, RAYS, DIAGONALS, STRAIGHTS
+
+def movePiece(gs, activePiece, newpos):
+    '''
+    Moves the active piece to the specified new position on the board
+        GameState gs: The current Game State object
+        Piece activePiece: The piece which is moving to a new position
+        Tuple newpos: The position to which the active piece is moving
+    '''
+    gs.makeMove(activePiece.getPos(), newpos)
+    return gs
+
+def promotePawn(gs, activePiece, promotionSquare, rank):
+    '''
+    Promoting the active pawn to a piece determined by the rank
+        GameState gs: The current Game State object
+        Piece activePiece: The piece which is being promoted
+    '''
+    r = activePiece.getPos()[0]
+    f = activePiece.getPos()[1]
+    colour = activePiece.getColour()
+    if rank in [0, 7]:
+        t = "Q"
+    elif rank in [1, 6]:
+        t = "N"
+    elif rank in [2, 5]:
+        t = "R"
+    else:
+        t = "B"
+    name = colour + t
+    gs.makeMove((r, f), promotionSquare, name)
+
+    return gs
+
+# Promotion pieces mapped to the rank promotePawn reads the choice from
+PROMOTION_RANKS = {"Q": 0, "N": 1, "R": 2, "B": 3}
+
+def playMove(gs, move):
+    '''
+    Plays a move through movePiece or promotePawn, as the UI does
+        GameState gs: The current Game State object
+        Tuple move: A (from, to, promotion) tuple as returned by legalMoves or Engine.search
+    '''
+    board = gs.getBoard()
+    p = board[move[0][0]][move[0][1]]
+    if move[2] is None:
+        return movePiece(gs, p, move[1])
+    return promotePawn(gs, p, move[1], PROMOTION_RANKS[move[2][1]])
+
+def checkKingSafety(gs, colour, activepos, newpos):
+    '''
+    Checks whether or not the given move would leave the player's king immediately vulnerable
+        GameState gs: The current Game State object
+        String colour: The colour of the player whose turn it is
+        Tuple activepos: The current position of the piece being moved
+        Tuple newpos: The new position of the active piece if the move is played
+    '''
+    # A pawn reaching the last rank is tried as a queen; the choice of piece cannot expose the king
+    promotion = None
+    if gs.getBoard()[activepos[0]][activepos[1]].getName()[1] == "p" and newpos[0] in [0, 7]:
+        promotion = colour + "Q"
+    gs.makeMove(activepos, newpos, promotion)
+    safe = not gs.inCheck(colour)
+    gs.unmakeMove()
+
+    return safe
+
+def findAttackers(board, pos, colour, empty=(), blocked=()):
+    '''
+    Returns the positions of the pieces of one colour attacking a square
+        List board: A list of lists of pieces, each corresponding to a rank
+        Tuple pos: The square being attacked
+        String colour: The colour of the attacking side
+        Tuple empty: Squares to treat as empty, e.g. the king's own square when it steps away
+        Tuple blocked: Empty squares to treat as occupied by a piece that attacks nothing
+    '''
+    r = pos[0]
+    f = pos[1]
+    attackers = []
+
+    # Pawns attack diagonally towards the other side of the board, so they attack from the
+    # squares a pawn of the other colour would capture on
+    if colour == "w":
+        pawnSquares = PAWN_CAPTURES["b"][r][f]
+    else:
+        pawnSquares = PAWN_CAPTURES["w"][r][f]
+    for i, j in pawnSquares:
+        if board[i][j].name == colour + "p" and (i, j) not in empty:
+            attackers.append((i, j))
+
+    # Knights and kings attack the squares they could move to, so the same tables serve
+    for targets, name in [(KNIGHT_TARGETS, colour + "N"), (KING_TARGETS, colour + "K")]:
+        for i, j in targets[r][f]:
+            if board[i][j].name == name and (i, j) not in empty:
+                attackers.append((i, j))
+
+    for directions, sliders in [(DIAGONALS, "BQ"), (STRAIGHTS, "RQ")]:
+        for d in directions:
+            for i, j in RAYS[d][r][f]:
+                if (i, j) in blocked:
+                    break
+                p = board[i][j]
+                if p.colour != "-" and (i, j) not in empty:
+                    if p.colour == colour and p.name[1] in sliders:
+                        attackers.append((i, j))
+                    break
+
+    return attackers
+
+def findPins(board, kingpos, colour):
+    '''
+    Returns a dictionary from the position of each piece pinned to its king to the squares
+    it may still move to: the line between the king and the pinning piece, inclusive of the latter
+        List board: A list of lists of pieces, each corresponding to a rank
+        Tuple kingpos: The position of the king
+        String colour: The colour of the king
+    '''
+    pins = {}
+    for directions, sliders in [(DIAGONALS, "BQ"), (STRAIGHTS, "RQ")]:
+        for d in directions:
+            line = set()
+            shield = None   # The first piece of the king's colour along the line
+            for i, j in RAYS[d][kingpos[0]][kingpos[1]]:
+                line.add((i, j))
+                p = board[i][j]
+                if p.colour == colour:
+                    if shield is not None:
+                        break
+                    shield = (i, j)
+                elif p.colour != "-":
+                    if shield is not None and p.name[1] in sliders:
+                        pins[shield] = line
+                    break
+    return pins
+
+def analysePosition(gs, colour):
+    '''
+    Works out once per position what constrains the legal moves of one side: the pieces
+    giving check, the squares where a check can be blocked or captured, and the pinned pieces.
+    Returns a (kingpos, checkers, blocks, pins) tuple
+        GameState gs: The current Game State object
+        String colour: The colour of the side whose moves are wanted
+    '''
+    board = gs.getBoard()
+    if colour == "w":
+        kingpos = gs.kingpos[0]
+        enemy = "b"
+    else:
+        kingpos = gs.kingpos[1]
+        enemy = "w"
+    checkers = findAttackers(board, kingpos, enemy)
+
+    blocks = set()
+    if len(checkers) == 1:
+        r, f = checkers[0]
+        blocks.add((r, f))
+        if board[r][f].getName()[1] in "BRQ":
+            dr = (kingpos[0] > r) - (kingpos[0] < r)
+            df = (kingpos[1] > f) - (kingpos[1] < f)
+            i = r + dr
+            j = f + df
+            while (i, j) != kingpos:
+                blocks.add((i, j))
+                i += dr
+                j += df
+
+    return (kingpos, checkers, blocks, findPins(board, kingpos, colour))
+
+def findLegalMoves(gs, activePiece, moves, analysis):
+    '''
+    Returns the moves from a list of the piece's moves which are legal, using the analysis of
+    the position from analysePosition rather than trying each move
+        GameState gs: The current Game State object
+        Piece activePiece: The piece whose moves are being validated
+        List moves: The moves to check the validity of
+        Tuple analysis: The result of analysePosition for the piece's colour
+    '''
+    board = gs.getBoard()
+    kingpos, checkers, blocks, pins = analysis
+    pos = activePiece.getPos()
+    colour = activePiece.getColour()
+    if colour == "w":
+        enemy = "b"
+    else:
+        enemy = "w"
+    legal = []
+
+    if activePiece.getName()[1] == "K":
+        for move in moves:
+            if not activePiece.hasMoved() and abs(move[1] - pos[1]) == 2:
+                # Castling: not out of, through or into check
+                passing = (pos[0], (pos[1] + move[1]) // 2)
+                if checkers or findAttackers(board, passing, enemy) or findAttackers(board, move, enemy):
+                    continue
+            elif findAttackers(board, move, enemy, (pos,)):
+                continue
+            legal.append(move)
+        return legal
+
+    # Only the king can move out of double check
+    if len(checkers) > 1:
+        return legal
+
+    pin = pins.get(pos)
+    for move in moves:
+        if pin is not None and move not in pin:
+            continue
+        if activePiece.getName()[1] == "p" and board[move[0]][move[1]].getName()[1] == "e":
+            # En passant takes two pieces off the line, so look again at the king
+            captured = (pos[0], move[1])
+            if findAttackers(board, kingpos, enemy, (pos, captured), (move,)):
+                continue
+        elif checkers and move not in blocks:
+            continue
+        legal.append(move)
+    return legal
+
+def filterValidMoves(gs, activePiece, moves):
+    '''
+    Given a list of moves, returns all moves where the king is not under attack
+        GameState gs: The current Game State object
+        Piece activePiece: The piece whose moves are being validated
+        List moves: The moves to check the validity of
+    '''
+    analysis = analysePosition(gs, activePiece.getColour())
+    return findLegalMoves(gs, activePiece, moves, analysis)
+
+# Move-based statuses ("+", "#", "." or "-") by Zobrist key, so asking again is free
+STATUS_CACHE = {}
+STATUS_CACHE_SIZE = 1 << 16
+
+def candidateMoves(gs, colour, analysis):
+    '''
+    Generates the legal moves of a side as (from, to) pairs one piece at a time, starting
+    with the moves most likely to exist: the king's, then captures of a lone checker
+        GameState gs: The current Game State object
+        String colour: The side to move
+        Tuple analysis: The result of analysePosition for that side
+    '''
+    board = gs.getBoard()
+    kingpos, checkers, blocks, pins = analysis
+    king = board[kingpos[0]][kingpos[1]]
+    for move in findLegalMoves(gs, king, gs.checkValidMoves(king), analysis):
+        yield (kingpos, move)
+    # Only the king can move out of double check
+    if len(checkers) > 1:
+        return
+
+    tried = [kingpos]
+    if checkers:
+        for pos in findAttackers(board, checkers[0], colour):
+            if pos not in tried:
+                tried.append(pos)
+                p = board[pos[0]][pos[1]]
+                for move in findLegalMoves(gs, p, gs.checkValidMoves(p), analysis):
+                    yield (pos, move)
+    for r in board:
+        for p in r:
+            if p.getColour() == colour and p.getPos() not in tried:
+                for move in findLegalMoves(gs, p, gs.checkValidMoves(p), analysis):
+                    yield (p.getPos(), move)
+    return
+
+def insufficientMaterial(board):
+    '''
+    Returns whether neither side has the pieces to checkmate: bare kings, a single knight or
+    bishop, or only bishops which all stand on squares of the same colour
+        List board: A list of lists of pieces, each corresponding to a rank
+    '''
+    minors = []
+    for r in range(8):
+        for f in range(8):
+            name = board[r][f].getName()
+            if name[1] in "pRQ":
+                return False
+            elif name[1] in "NB":
+                minors.append((name[1], (r + f) % 2))
+    if len(minors) <= 1:
+        return True
+    return all(kind == "B" for kind, shade in minors) and len(set(shade for kind, shade in minors)) == 1
+
+def checkPosition(gs):
+    '''
+    Raises ValueError if a position could not arise in a game: each side must have exactly
+    one king, and the side which has just moved must not be in check
+        GameState gs: The position, e.g. just loaded from a FEN
+    '''
+    names = [p.getName() for rank in gs.getBoard() for p in rank]
+    if names.count("wK") != 1 or names.count("bK") != 1:
+        raise ValueError("position needs one king a side")
+    if gs.whitesTurn():
+        waiting = "b"
+    else:
+        waiting = "w"
+    if gs.inCheck(waiting):
+        raise ValueError("side not to move is in check")
+    return
+
+def updateGameStatus(gs):
+    '''
+    Returns the status of the game: "." playing, "+" check, "#" checkmate, "-" stalemate,
+    or a draw by "r" threefold repetition, "f" the fifty-move rule or "m" insufficient material
+        GameState gs: The current Game State object
+    '''
+    key = gs.getZobrist()
+    status = STATUS_CACHE.get(key)
+    if status is None:
+        if gs.whitesTurn():
+            colour = "w"
+        else:
+            colour = "b"
+        # One legal move is enough to know the game goes on
+        canMove = next(candidateMoves(gs, colour, analysePosition(gs, colour)), None) is not None
+
+        if gs.inCheck(colour):
+            if canMove:
+                status = "+"    # Check
+            else:
+                status = "#"    # Checkmate
+        else:
+            if canMove:
+                status = "."    # Playing
+            else:
+                status = "-"    # Stalemate
+        if len(STATUS_CACHE) >= STATUS_CACHE_SIZE:
+            STATUS_CACHE.clear()
+        STATUS_CACHE[key] = status
+
+    if status in ["#", "-"]:
+        return status
+    if insufficientMaterial(gs.getBoard()):
+        return "m"
+    if gs.repetitions() >= 3:
+        return "r"
+    if gs.halfmoves >= 100:
+        return "f"
+    return status
+
+def legalMoves(gs):
+    '''
+    Returns every legal move for the side to move as (from, to, promotion) tuples,
+    where promotion is the name of the piece a pawn promotes to, or None
+        GameState gs: The current Game State object
+    '''
+    if gs.whitesTurn():
+        colour = "w"
+    else:
+        colour = "b"
+    board = gs.getBoard()
+    analysis = analysePosition(gs, colour)
+    moves = []
+    for r in board:
+        for p in r:
+            if p.getColour() == colour:
+                pos = p.getPos()
+                for move in findLegalMoves(gs, p, gs.checkValidMoves(p), analysis):
+                    if p.getName()[1] == "p" and move[0] in [0, 7]:
+                        for t in ["Q", "N", "R", "B"]:
+                            moves.append((pos, move, colour + t))
+                    else:
+                        moves.append((pos, move, None))
+    return moves
+
+def legalMovesTo(gs, target, kind=None):
+    '''
+    Returns the legal moves of the side to move onto one square, as legalMoves does, checking
+    only the pieces whose stored moves reach it
+        GameState gs: The current Game State object
+        Tuple target: The square being moved to
+        String kind: The letter of the kind of piece moving, e.g. "N" or "p", or None for any
+    '''
+    if gs.whitesTurn():
+        colour = "w"
+        side = 0
+    else:
+        colour = "b"
+        side = 1
+    board = gs.getBoard()
+    analysis = None
+    moves = []
+    for pos, entry in gs.pieceMoves.items():
+        if entry[0] != side or target not in entry[1]:
+            continue
+        p = board[pos[0]][pos[1]]
+        if kind is not None and p.getName()[1] != kind:
+            continue
+        if analysis is None:
+            analysis = analysePosition(gs, colour)
+        if findLegalMoves(gs, p, [target], analysis):
+            if p.getName()[1] == "p" and target[0] in [0, 7]:
+                for t in ["Q", "N", "R", "B"]:
+                    moves.append((pos, target, colour + t))
+            else:
+                moves.append((pos, target, None))
+    return moves
+
+def squareName(pos):
+    '''
+    Returns the name of a square, e.g. (4, 4) -> "e4"
+        Tuple pos: The position on the board
+    '''
+    return "abcdefgh"[pos[1]] + str(8 - pos[0])
+
+def squarePos(name):
+    '''
+    Returns the position of a named square, e.g. "e4" -> (4, 4)
+        String name: The file letter followed by the rank number
+    '''
+    return (8 - int(name[1]), "abcdefgh".index(name[0]))
+
+def moveName(move):
+    '''
+    Returns a move in coordinate notation, e.g. "e2e4" or "e7e8q"
+        Tuple move: A (from, to, promotion) tuple as returned by legalMoves
+    '''
+    name = squareName(move[0]) + squareName(move[1])
+    if move[2] is not None:
+        name += move[2][1].lower()
+    return name
+
+def parseMove(gs, name):
+    '''
+    Returns the (from, to, promotion) tuple for a move in coordinate notation
+        GameState gs: The current Game State object, used for the promoting side
+        String name: The move, e.g. "e2e4" or "e7e8q"
+    '''
+    promotion = None
+    if len(name) > 4:
+        if gs.whitesTurn():
+            promotion = "w" + name[4].upper()
+        else:
+            promotion = "b" + name[4].upper()
+    return (squarePos(name[:2]), squarePos(name[2:4]), promotion)
@@ -0,0 +1,237 @@
+'''
+Self-play: the engine plays games against itself across a pool of processes, for training
+and regression data. Each game starts from an opening, either a position from a FEN/EPD file,
+the first moves of a game from a PGN file, or a few random moves, and is played until
+updateGameStatus ends it or it is adjudicated. Finished games are written out as they come
+in, to PGN or to a game archive, so nothing is held in memory but the games in progress.
+
+    python selfplay.py -n 100 --nodes 5000 games.pgn
+    python selfplay.py -n 1000 -j 4 --movetime 0.05 --openings book.epd games.cga
+'''
+import os
+import sys
+import time
+import random
+import rules
+import parallel
+import pgn
+import archive
+import positions
+from gamestate import GameState
+
+TERMINATIONS = {"#": "checkmate", "-": "stalemate", "r": "threefold repetition",
+    "f": "fifty-move rule", "m": "insufficient material"}
+
+class Budget:
+    def __init__(self, depth=64, movetime=None, nodes=None, maxPlies=400, resignScore=1000, resignPlies=8):
+        '''
+        How long each move may take and when a game is adjudicated
+            Int depth: The deepest iteration of each search
+            Float movetime: Seconds per move, or None
+            Int nodes: Nodes per move, or None
+            Int maxPlies: Plies after which the game is called a draw
+            Int resignScore: The score, in centipawns, at which a game is given up as lost
+            Int resignPlies: How many plies in a row the score must be past resignScore
+        '''
+        self.depth = depth
+        self.movetime = movetime
+        self.nodes = nodes
+        self.maxPlies = maxPlies
+        self.resignScore = resignScore
+        self.resignPlies = resignPlies
+
+def readOpenings(path, plies=8):
+    '''
+    Returns the openings in a file as (FEN or None, list of moves in coordinate notation):
+    each game of a PGN file up to a number of plies, or each position of a FEN/EPD file
+        String path: The file to read
+        Int plies: How many moves of each PGN game to keep
+    '''
+    openings = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        if path.endswith(".pgn"):
+            gs = GameState()
+            for tags, movetext in pgn.readGames(f):
+                if "FEN" in tags:
+                    gs.loadFen(tags["FEN"])
+                else:
+                    gs.makeDefaultBoard()
+                # Only the opening moves are replayed, not the whole game
+                names = []
+                try:
+                    for san in pgn.tokenize(movetext):
+                        if len(names) >= plies:
+                            break
+                        move = pgn.parseSan(gs, san)
+                        rules.playMove(gs, move)
+                        names.append(rules.moveName(move))
+                except ValueError:
+                    continue
+                openings.append((tags.get("FEN"), names))
+        else:
+            for gs in positions.readFens(f):
+                openings.append((gs.getFen(), []))
+    return openings
+
+def randomOpening(seed, plies=4):
+    '''
+    Returns an opening of a few random moves from the usual starting position, as readOpenings
+        Int seed: Picks the moves; the same seed gives the same opening
+        Int plies: The number of moves
+    '''
+    rng = random.Random(seed)
+    gs = GameState()
+    gs.makeDefaultBoard()
+    moves = []
+    for i in range(plies):
+        legal = rules.legalMoves(gs)
+        if not legal:
+            break
+        move = rng.choice(legal)
+        rules.playMove(gs, move)
+        moves.append(rules.moveName(move))
+    return (None, moves)
+
+def adjudicate(gs, budget, streak):
+    '''
+    Returns (result, termination) if the game should end here, or None to play on
+        GameState gs: The position reached
+        Budget budget: The adjudication rules
+        Int streak: Plies in a row with the score past resignScore; positive when white is winning
+    '''
+    status = rules.updateGameStatus(gs)
+    if status in TERMINATIONS:
+        return pgn.gameResult(gs), TERMINATIONS[status]
+    if abs(streak) >= budget.resignPlies:
+        if streak > 0:
+            return "1-0", "adjudication"
+        return "0-1", "adjudication"
+    if len(gs.history) >= budget.maxPlies:
+        return "1/2-1/2", "adjudication"
+    return None
+
+def playGame(number, opening, budget):
+    '''
+    Plays one game in a worker process.
+    Returns (number, tags, moves, starting FEN, seconds taken, worker's process id)
+        Int number: The number of the game, from 0
+        Tuple opening: (FEN or None, moves in coordinate notation) to start from
+        Budget budget: The search budget and adjudication rules
+    '''
+    start = time.perf_counter()
+    startFen, openingMoves = opening
+    gs = GameState()
+    if startFen is None:
+        gs.makeDefaultBoard()
+    else:
+        gs.loadFen(startFen)
+    moves = []
+    for name in openingMoves:
+        move = rules.parseMove(gs, name)
+        rules.playMove(gs, move)
+        moves.append(move)
+
+    player = parallel.worker
+    player.clear()
+    streak = 0
+    ending = adjudicate(gs, budget, streak)
+    while ending is None:
+        result = player.search(gs, budget.depth, budget.movetime, budget.nodes)
+        whiteScore = result.score
+        if not gs.whitesTurn():
+            whiteScore = -whiteScore
+        if whiteScore >= budget.resignScore:
+            streak = max(streak, 0) + 1
+        elif whiteScore <= -budget.resignScore:
+            streak = min(streak, 0) - 1
+        else:
+            streak = 0
+        rules.playMove(gs, result.move)
+        moves.append(result.move)
+        ending = adjudicate(gs, budget, streak)
+
+    tags = {"Event": "Self-play", "Site": "?", "Date": time.strftime("%Y.%m.%d"),
+        "Round": str(number + 1), "White": "ChessPorting", "Black": "ChessPorting",
+        "Result": ending[0], "Termination": ending[1], "PlyCount": str(len(moves))}
+    return (number, tags, moves, startFen, time.perf_counter() - start, os.getpid())
+
+def selfPlay(count, outPath, budget, openings=None, workers=None, tableSize=1 << 16, seed=0):
+    '''
+    Plays games and writes each one out as soon as it is finished, to a game archive if the
+    path ends in .cga and to PGN otherwise. Reports games per hour and the share of the time
+    each worker spent playing
+        Int count: The number of games
+        String outPath: The file to write
+        Budget budget: The search budget and adjudication rules
+        List openings: Openings as returned by readOpenings, used in turn, or None for random ones
+        Int workers: The number of processes, by default one per CPU
+        Int tableSize: The number of transposition table entries of each process
+        Int seed: Picks the random openings
+    '''
+    # Imported here as they take longer to import than the rest of the module together
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+    workers = workers or os.cpu_count() or 1
+    if outPath.endswith(".cga"):
+        out = archive.ArchiveWriter(outPath)
+    else:
+        out = open(outPath, "w", encoding="utf-8")
+    busy = {}       # Process id -> seconds spent playing
+    results = {"1-0": 0, "0-1": 0, "1/2-1/2": 0}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=parallel.startWorker, initargs=(tableSize,)) as pool:
+        pending = set()
+        number = 0
+        while number < count or pending:
+            # Keep a few games queued per worker, so finished games never pile up in memory
+            while number < count and len(pending) < workers * 2:
+                if openings:
+                    opening = openings[number % len(openings)]
+                else:
+                    opening = randomOpening(seed + number)
+                pending.add(pool.submit(playGame, number, opening, budget))
+                number += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                n, tags, moves, startFen, seconds, pid = future.result()
+                if outPath.endswith(".cga"):
+                    out.add(tags, moves, startFen)
+                else:
+                    pgn.writeGame(out, tags, moves, startFen)
+                busy[pid] = busy.get(pid, 0) + seconds
+                results[tags["Result"]] += 1
+    out.close()
+
+    elapsed = time.perf_counter() - start
+    print("{a} games in {b:.1f} s, {c:.0f} games/hour: +{d} ={e} -{f}".format(a=count, b=elapsed,
+        c=count / max(elapsed, 1e-9) * 3600, d=results["1-0"], e=results["1/2-1/2"], f=results["0-1"]))
+    for i, pid in enumerate(sorted(busy)):
+        print("worker {a}: {b:.1f} s playing, {c:.0%} busy".format(a=i, b=busy[pid], c=busy[pid] / max(elapsed, 1e-9)))
+    return
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Have the engine play itself")
+    parser.add_argument("out", help="PGN file, or game archive if it ends in .cga")
+    parser.add_argument("-n", "--games", type=int, default=10)
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--depth", type=int, default=64)
+    parser.add_argument("--movetime", type=float, default=None, help="seconds per move")
+    parser.add_argument("--nodes", type=int, default=None, help="nodes per move")
+    parser.add_argument("--openings", default=None, help="FEN/EPD or PGN file of openings")
+    parser.add_argument("--opening-plies", type=int, default=8, help="moves kept from each PGN opening")
+    parser.add_argument("--max-plies", type=int, default=400)
+    parser.add_argument("--resign", type=int, default=1000, help="score in centipawns to give up at")
+    parser.add_argument("--resign-plies", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.movetime is None and args.nodes is None and args.depth == 64:
+        args.nodes = 5000
+    budget = Budget(args.depth, args.movetime, args.nodes, args.max_plies, args.resign, args.resign_plies)
+    openings = None
+    if args.openings is not None:
+        openings = readOpenings(args.openings, args.opening_plies)
+    selfPlay(args.games, args.out, budget, openings, args.jobs, seed=args.seed)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,320 @@
+'''
+A server hosting many games at once over TCP, on the rules alone without pygame. Clients
+send one command per line and get one reply per line, in order:
+
+    new [fen]               ok <game>               Starts a game, from a FEN or the usual position
+    moves <game>            ok e2e4 g1f3 ...        The legal moves, in coordinate notation
+    move <game> <move>      ok <status>             Plays a move if it is legal
+    engine <game> <ms>      ok <move> <status>      The engine plays a move after thinking for ms
+    fen <game>              ok <fen>
+    close <game>            ok
+    stats                   ok games <n> moves <n>
+
+Statuses are those of updateGameStatus, and errors are answered "error <reason>". Between
+moves a game is kept as its 65 packed bytes, clocks and the keys of its positions since the
+last capture or pawn move, and is unpacked into one shared GameState to answer a command.
+Engine searches run in a pool of worker processes so they never hold up other games.
+
+    python server.py serve [--port 8765] [--workers 2]
+    python server.py load [--port 8765] [--connections 50] [--games 20] [--moves 20000]
+'''
+import os
+import sys
+import time
+import re
+import array
+import random
+import asyncio
+import rules
+import parallel
+from gamestate import GameState, START_FEN
+
+PORT = 8765
+MOVE_PATTERN = re.compile(r"[a-h][1-8][a-h][1-8][qrbn]?$")
+
+def searchPosition(data, halfmoves, previous, movetime):
+    '''
+    Searches a packed position in a worker process and returns the best move, or None
+        Bytes data: The position from GameState.pack
+        Int halfmoves: Halfmoves since the last capture or pawn move
+        Array previous: Keys of the positions since then, for repetitions
+        Float movetime: The number of seconds to search for
+    '''
+    parallel.position.unpack(data)
+    parallel.position.halfmoves = halfmoves
+    parallel.worker.previous = set(previous)
+    return parallel.worker.search(parallel.position, 64, movetime).move
+
+class Game:
+    __slots__ = ("data", "halfmoves", "fullmoves", "keys", "status")
+
+    def __init__(self, gs):
+        '''
+        A game between commands, in as little memory as it can be played on from
+            GameState gs: The position the game starts from
+        '''
+        self.keys = array.array("Q")    # Keys of the positions since the last capture or pawn move
+        self.store(gs)
+
+    def store(self, gs):
+        '''
+        Keeps the position of a GameState
+            GameState gs: The position reached
+        '''
+        self.data = gs.pack()
+        self.halfmoves = gs.halfmoves
+        self.fullmoves = gs.fullmoves
+        self.status = rules.updateGameStatus(gs)
+        # The GameState holds little or no history, so repetitions are counted from the stored keys
+        if self.status in [".", "+"] and self.keys.count(gs.getZobrist()) >= 2:
+            self.status = "r"
+        return
+
+    def load(self, gs):
+        '''
+        Sets up a GameState with the game's position
+            GameState gs: The GameState to reuse
+        '''
+        gs.unpack(self.data)
+        gs.halfmoves = self.halfmoves
+        gs.fullmoves = self.fullmoves
+        return gs
+
+    def play(self, gs, move):
+        '''
+        Plays a move on the game's position, already loaded into gs
+            GameState gs: The game's position
+            Tuple move: A legal (from, to, promotion) tuple
+        '''
+        key = gs.getZobrist()
+        rules.playMove(gs, move)
+        if gs.halfmoves == 0:
+            del self.keys[:]
+        else:
+            self.keys.append(key)
+        self.store(gs)
+        return
+
+class GameServer:
+    def __init__(self, workers=None, tableSize=1 << 16):
+        '''
+        The games being played and the pool their engine searches run in
+            Int workers: The number of engine processes, by default one per CPU
+            Int tableSize: The number of transposition table entries of each process
+        '''
+        # Imported here as only servers which run the engine need it
+        from concurrent.futures import ProcessPoolExecutor
+        self.games = {}
+        self.nextId = 1
+        self.moves = 0
+        self.gs = GameState()       # Every command is answered on this one GameState
+        self.loaded = None          # The packed position self.gs holds, so it is not unpacked again
+        self.pool = ProcessPoolExecutor(workers or os.cpu_count() or 1, initializer=parallel.startWorker,
+            initargs=(tableSize,))
+
+    def close(self):
+        self.pool.shutdown()
+        return
+
+    def load(self, game):
+        '''
+        Returns the shared GameState set up with a game's position
+            Game game: The game
+        '''
+        # Clients usually ask for the moves and then play one, so the position is often there already
+        if self.loaded is not game.data:
+            game.load(self.gs)
+        self.loaded = game.data
+        return self.gs
+
+    def game(self, args):
+        '''
+        Returns the game named by a command's first argument. Raises ValueError if there is none
+            List args: The command's arguments
+        '''
+        if not args or not args[0].isdigit() or int(args[0]) not in self.games:
+            raise ValueError("no such game")
+        return self.games[int(args[0])]
+
+    async def command(self, line):
+        '''
+        Returns the reply to one line from a client
+            String line: The command
+        '''
+        args = line.split()
+        if not args:
+            return "error empty command"
+        name = args[0]
+        try:
+            if name == "new":
+                self.loaded = None
+                if len(args) > 1:
+                    self.gs.loadFen(" ".join(args[1:]))
+                    rules.checkPosition(self.gs)
+                else:
+                    self.gs.loadFen(START_FEN)
+                self.games[self.nextId] = Game(self.gs)
+                self.loaded = self.games[self.nextId].data
+                self.nextId += 1
+                return "ok {a}".format(a=self.nextId - 1)
+            elif name == "moves":
+                gs = self.load(self.game(args[1:]))
+                return " ".join(["ok"] + [rules.moveName(m) for m in rules.legalMoves(gs)])
+            elif name == "move":
+                game = self.game(args[1:])
+                if game.status not in [".", "+"]:
+                    return "error game over"
+                if len(args) < 3:
+                    return "error no move"
+                if not MOVE_PATTERN.match(args[2]):
+                    return "error bad move"
+                gs = self.load(game)
+                move = rules.parseMove(gs, args[2])
+                if move not in rules.legalMovesTo(gs, move[1]):
+                    return "error illegal move"
+                game.play(gs, move)
+                self.loaded = game.data
+                self.moves += 1
+                return "ok " + game.status
+            elif name == "engine":
+                game = self.game(args[1:])
+                if game.status not in [".", "+"]:
+                    return "error game over"
+                movetime = 0.1
+                if len(args) > 2:
+                    movetime = int(args[2]) / 1000
+                data = game.data
+                move = await asyncio.get_running_loop().run_in_executor(self.pool, searchPosition,
+                    data, game.halfmoves, game.keys, movetime)
+                # Another command may have played on while the engine thought
+                if game.data is not data or self.games.get(int(args[1])) is not game:
+                    return "error game changed"
+                game.play(self.load(game), move)
+                self.loaded = game.data
+                self.moves += 1
+                return "ok {a} {b}".format(a=rules.moveName(move), b=game.status)
+            elif name == "fen":
+                gs = self.load(self.game(args[1:]))
+                return "ok " + gs.getFen()
+            elif name == "close":
+                self.game(args[1:])
+                del self.games[int(args[1])]
+                return "ok"
+            elif name == "stats":
+                return "ok games {a} moves {b}".format(a=len(self.games), b=self.moves)
+        except (ValueError, IndexError) as e:
+            # Anything a client sends that cannot be parsed gets an error, never a dropped connection
+            return "error {a}".format(a=e)
+        return "error unknown command"
+
+    async def handle(self, reader, writer):
+        '''
+        Answers the commands of one connection until it closes
+        '''
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self.command(line.decode("utf-8", "replace"))
+                writer.write(reply.encode("utf-8") + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+        return
+
+    async def serve(self, host="127.0.0.1", port=PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        print("serving on {a}:{b}".format(a=host, b=port))
+        async with server:
+            await server.serve_forever()
+        return
+
+async def loadConnection(host, port, games, budget, latencies, rng):
+    '''
+    Plays random games on one connection, several at a time in turn, until the budget of
+    moves is used up. Appends the seconds each move took to latencies
+        String host: The server's address
+        Int port: The server's port
+        Int games: The number of games kept going at once
+        List budget: A one item list of the moves left to play, shared by every connection
+        List latencies: Where to add each move's round trip
+        Random rng: Picks the moves
+    '''
+    reader, writer = await asyncio.open_connection(host, port)
+
+    async def ask(line):
+        writer.write(line.encode("utf-8") + b"\n")
+        await writer.drain()
+        return (await reader.readline()).decode("utf-8").split()
+
+    playing = []
+    for i in range(games):
+        playing.append((await ask("new"))[1])
+    while budget[0] > 0:
+        for i in range(len(playing)):
+            if budget[0] <= 0:
+                break
+            budget[0] -= 1
+            start = time.perf_counter()
+            moves = (await ask("moves " + playing[i]))[1:]
+            reply = await ask("move {a} {b}".format(a=playing[i], b=rng.choice(moves)))
+            latencies.append(time.perf_counter() - start)
+            if reply[0] != "ok" or reply[1] not in [".", "+"]:
+                await ask("close " + playing[i])
+                playing[i] = (await ask("new"))[1]
+    for game in playing:
+        await ask("close " + game)
+    writer.close()
+    return
+
+async def generateLoad(host=None, port=PORT, connections=50, games=20, moves=20000):
+    '''
+    Plays random games against a server from many connections at once and reports the moves
+    per second served and the latency of each move, from asking for the legal moves to the
+    reply to playing one
+        String host: The server's address
+        Int port: The server's port
+        Int connections: The number of connections
+        Int games: The number of games each connection plays at once
+        Int moves: The number of moves to play in all
+    '''
+    host = host or "127.0.0.1"
+    budget = [moves]
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[loadConnection(host, port, games, budget, latencies, random.Random(i))
+        for i in range(connections)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print("{a} games on {b} connections: {c} moves in {d:.2f} s, {e:.0f} moves/s".format(
+        a=connections * games, b=connections, c=len(latencies), d=elapsed, e=len(latencies) / max(elapsed, 1e-9)))
+    print("latency p50 {a:.1f} ms, p99 {b:.1f} ms, max {c:.1f} ms".format(
+        a=latencies[len(latencies) // 2] * 1000, b=latencies[len(latencies) * 99 // 100] * 1000,
+        c=latencies[-1] * 1000))
+    return
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Host many games over TCP, or load test a server")
+    parser.add_argument("mode", choices=["serve", "load"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=None, help="engine processes")
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--games", type=int, default=20, help="games played at once per connection")
+    parser.add_argument("--moves", type=int, default=20000, help="moves to play in all")
+    args = parser.parse_args(argv)
+    if args.mode == "serve":
+        server = GameServer(args.workers)
+        try:
+            asyncio.run(server.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        server.close()
+    else:
+        asyncio.run(generateLoad(args.host, args.port, args.connections, args.games, args.moves))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
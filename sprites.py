@@ -0,0 +1,152 @@
+'''
+Piece sprites at any square size. Each piece is rasterized from its SVG, or smooth-scaled
+from its PNG where SDL_image cannot read SVG, once per size. The last few sizes are kept in
+memory so going back to one is instant, and every size made is saved to a cache directory
+as an atlas of raw RGBA pixels, which later runs read back without decoding anything.
+'''
+import os
+import io
+import re
+import time
+import hashlib
+from collections import OrderedDict
+import pygame as pg
+from piece import NAMES
+
+CACHE_SIZES = 4         # Sizes kept in memory
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "chessporting")
+
+def svgAtSize(data, size):
+    '''
+    Returns an SVG document changed to draw at size x size pixels, scaling its contents
+        Bytes data: The SVG document
+        Int size: The width and height wanted
+    '''
+    tag = re.search(rb"<svg[^>]*>", data)
+    head = tag.group(0)
+    if b"viewBox" not in head:
+        width = re.search(rb'width="([\d.]+)', head).group(1)
+        height = re.search(rb'height="([\d.]+)', head).group(1)
+        head = head.replace(b"<svg", b'<svg viewBox="0 0 ' + width + b" " + height + b'"', 1)
+    head = re.sub(rb'width="[^"]*"', b'width="%d"' % size, head, count=1)
+    head = re.sub(rb'height="[^"]*"', b'height="%d"' % size, head, count=1)
+    return data[:tag.start()] + head + data[tag.end():]
+
+class SpriteCache:
+    def __init__(self, directory="./Pieces/", cacheDir=CACHE_DIR):
+        '''
+        The piece sprites for each square size asked for
+            String directory: Where the piece SVGs and PNGs are
+            String cacheDir: Where atlases are saved, or None not to save them
+        '''
+        self.directory = directory
+        self.cacheDir = cacheDir
+        self.key = self.sourceKey()
+        self.sizes = OrderedDict()  # Size -> {name: Surface}, least recently used first
+        self.lastSource = None      # How the last sizes asked for were found: "memory", "disk" or "drawn"
+        self.lastTime = 0.0         # And the seconds it took
+
+    def sourceKey(self):
+        '''
+        Returns a short hash of the piece files' names, sizes and times, so atlases made from
+        older pieces are not used
+        '''
+        h = hashlib.sha1()
+        for name in sorted(os.listdir(self.directory)):
+            stat = os.stat(os.path.join(self.directory, name))
+            h.update("{a} {b} {c}\n".format(a=name, b=stat.st_size, c=stat.st_mtime_ns).encode())
+        return h.hexdigest()[:12]
+
+    def atlasPath(self, size):
+        return os.path.join(self.cacheDir, "pieces-{a}-{b}.rgba".format(a=size, b=self.key))
+
+    def draw(self, name, size):
+        '''
+        Returns one piece drawn at a size, from its SVG if SDL_image reads SVG, else its PNG
+            String name: The piece, e.g. "wK"
+            Int size: The width and height of the sprite
+        '''
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path + ".svg"):
+            with open(path + ".svg", "rb") as f:
+                data = svgAtSize(f.read(), size)
+            try:
+                image = pg.image.load(io.BytesIO(data), name + ".svg")
+            except pg.error:
+                image = None
+            # Older SDL_image draws SVGs at their own size whatever they say
+            if image is not None and image.get_size() == (size, size):
+                if pg.display.get_surface():
+                    image = image.convert_alpha()
+                return image
+        image = pg.image.load(path + ".png")
+        if pg.display.get_surface():
+            image = image.convert_alpha()
+        return pg.transform.smoothscale(image, (size, size))
+
+    def loadAtlas(self, size):
+        '''
+        Returns the sprites of a size from the cache directory, or None if they are not there
+            Int size: The width and height of each sprite
+        '''
+        if self.cacheDir is None:
+            return None
+        try:
+            with open(self.atlasPath(size), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        step = size * size * 4
+        if len(data) != step * len(NAMES):
+            return None
+        images = {}
+        for i, name in enumerate(NAMES):
+            image = pg.image.frombuffer(data[i*step:(i + 1)*step], (size, size), "RGBA")
+            if pg.display.get_surface():
+                images[name] = image.convert_alpha()
+            else:
+                images[name] = image.copy()
+        return images
+
+    def saveAtlas(self, size, images):
+        '''
+        Writes the sprites of a size to the cache directory; failing to is not an error
+            Int size: The width and height of each sprite
+            Dict images: The sprites by piece name
+        '''
+        if self.cacheDir is None:
+            return
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            path = self.atlasPath(size)
+            # Written under another name first so a reader never sees half an atlas
+            with open(path + ".tmp", "wb") as f:
+                for name in NAMES:
+                    f.write(pg.image.tostring(images[name], "RGBA"))
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+        return
+
+    def get(self, size):
+        '''
+        Returns a dictionary of the twelve piece sprites at a size, keyed by piece name
+            Int size: The width and height of each sprite, usually the square size
+        '''
+        start = time.perf_counter()
+        if size in self.sizes:
+            self.sizes.move_to_end(size)
+            self.lastSource = "memory"
+        else:
+            images = self.loadAtlas(size)
+            self.lastSource = "disk"
+            if images is None:
+                images = {name: self.draw(name, size) for name in NAMES}
+                self.saveAtlas(size, images)
+                self.lastSource = "drawn"
+            self.sizes[size] = images
+            if len(self.sizes) > CACHE_SIZES:
+                self.sizes.popitem(last=False)
+        self.lastTime = time.perf_counter() - start
+        return self.sizes[size]
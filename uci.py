@@ -0,0 +1,293 @@
+'''
+A Universal Chess Interface front-end for the engine, so it can be run by tournament
+managers and analysis GUIs. Commands are read from stdin and answered on stdout; searches
+run on a background thread so the command loop never waits for one.
+
+    python uci.py
+'''
+import os
+import sys
+import threading
+import rules
+import engine
+from gamestate import GameState, START_FEN
+
+NAME = "ChessPorting"
+AUTHOR = "rogerrain"
+ENTRY_BYTES = 128           # Rough memory taken by one transposition table entry
+MOVE_OVERHEAD = 0.05        # Seconds kept back from each move for communication
+
+def scoreText(score):
+    '''
+    Returns a score in UCI form: "cp 35", or "mate 3" / "mate -2" in moves
+        Int score: The engine's score from the side to move's view
+    '''
+    if score > engine.MATE_BOUND:
+        return "mate {a}".format(a=(engine.MATE - score + 1) // 2)
+    elif score < -engine.MATE_BOUND:
+        return "mate {a}".format(a=-((engine.MATE + score) // 2))
+    return "cp {a}".format(a=score)
+
+def allotTime(gs, options):
+    '''
+    Returns the seconds to think for a move from the clock in a go command, or None for no limit
+        GameState gs: The position being searched
+        Dict options: The go command's arguments, e.g. {"wtime": 60000, "winc": 1000}
+    '''
+    if "movetime" in options:
+        return max(options["movetime"] / 1000 - MOVE_OVERHEAD, 0.01)
+    if gs.whitesTurn():
+        left, increment = options.get("wtime"), options.get("winc", 0)
+    else:
+        left, increment = options.get("btime"), options.get("binc", 0)
+    if left is None:
+        return None
+    share = left / options.get("movestogo", 30) + increment * 0.8
+    return max(min(share, left / 2) / 1000 - MOVE_OVERHEAD, 0.01)
+
+class UciEngine:
+    def __init__(self, out=sys.stdout):
+        '''
+        The state of a UCI session: the position, the searcher and any search in progress
+            File out: Where responses are written
+        '''
+        self.out = out
+        self.lock = threading.Lock()        # Keeps lines from the two threads apart
+        self.gs = GameState()
+        self.gs.loadFen(START_FEN)
+        self.hash = 16                      # Transposition table size in MB
+        self.threads = 1
+        self.searcher = None
+        self.thread = None
+        self.released = threading.Event()   # Set once bestmove may be sent after infinite or ponder
+        self.timer = None
+        self.options = {}
+
+    def send(self, line):
+        with self.lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+        return
+
+    def getSearcher(self):
+        '''
+        Returns the searcher for the current options, making it if they have changed
+        '''
+        if self.searcher is None:
+            tableSize = max(self.hash * (1 << 20) // ENTRY_BYTES, 1024)
+            if self.threads > 1:
+                import parallel
+                self.searcher = parallel.ParallelSearch(self.threads, tableSize // self.threads)
+            else:
+                self.searcher = engine.Engine(tableSize)
+                # Checked by the search, so a stop sent before it starts is not lost
+                self.searcher.stopEvent = threading.Event()
+        return self.searcher
+
+    def dropSearcher(self):
+        if self.searcher is not None and hasattr(self.searcher, "close"):
+            self.searcher.close()
+        self.searcher = None
+        return
+
+    def info(self, result):
+        '''
+        Sends an info line for a completed iteration
+            SearchResult result: The iteration's result
+        '''
+        line = "info depth {a} score {b} nodes {c} nps {d} time {e}".format(a=result.depth,
+            b=scoreText(result.score), c=result.nodes, d=result.nps, e=int(result.elapsed * 1000))
+        if hasattr(self.searcher, "hashfull"):
+            line += " hashfull {a}".format(a=self.searcher.hashfull())
+        self.send(line + " pv " + " ".join(rules.moveName(m) for m in result.pv))
+        return
+
+    def think(self, gs, depth, movetime, nodes, wait):
+        '''
+        Runs a search on the background thread and sends bestmove when it is allowed to
+            GameState gs: A copy of the position to search
+            Int depth: The deepest iteration
+            Float movetime: The seconds to search for, or None
+            Int nodes: The nodes to search, or None
+            Bool wait: Whether bestmove must wait for stop or ponderhit (infinite and ponder)
+        '''
+        result = self.getSearcher().search(gs, depth, movetime, nodes, self.info)
+        if wait:
+            self.released.wait()
+        if result.move is None:
+            self.send("bestmove 0000")
+        elif len(result.pv) > 1:
+            self.send("bestmove {a} ponder {b}".format(a=rules.moveName(result.move), b=rules.moveName(result.pv[1])))
+        else:
+            self.send("bestmove {a}".format(a=rules.moveName(result.move)))
+        return
+
+    def stopSearch(self):
+        '''
+        Stops any search in progress and waits for it to send bestmove
+        '''
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.thread is not None:
+            self.searcher.stopEvent.set()
+            self.searcher.stop()
+            self.released.set()
+            self.thread.join()
+            self.thread = None
+        return
+
+    def position(self, args):
+        '''
+        Handles "position startpos|fen <fen> [moves <moves>]". Raises ValueError for a FEN
+        that is malformed or has not got one king a side, keeping the previous position
+        '''
+        if "moves" in args:
+            moves = args[args.index("moves") + 1:]
+            args = args[:args.index("moves")]
+        else:
+            moves = []
+        gs = GameState()
+        if args and args[0] == "fen":
+            gs.loadFen(" ".join(args[1:]))
+            rules.checkPosition(gs)
+        else:
+            gs.loadFen(START_FEN)
+        self.gs = gs
+        for name in moves:
+            move = rules.parseMove(gs, name)
+            # The position stays at the last legal move, so a search never starts from a broken one
+            if move not in rules.legalMovesTo(gs, move[1]):
+                self.send("info string illegal move {a}, ignoring it and the moves after it".format(a=name))
+                break
+            gs.makeMove(*move)
+        return
+
+    def go(self, args):
+        '''
+        Handles "go" with depth, movetime, wtime/btime/winc/binc/movestogo, nodes, infinite and ponder
+        '''
+        self.stopSearch()
+        options = {}
+        i = 0
+        while i < len(args):
+            if args[i] in ["infinite", "ponder"]:
+                options[args[i]] = True
+                i += 1
+            elif args[i] == "searchmoves":
+                break
+            else:
+                options[args[i]] = int(args[i + 1])
+                i += 2
+        self.options = options
+
+        wait = "infinite" in options or "ponder" in options
+        movetime = None
+        if not wait:
+            movetime = allotTime(self.gs, options)
+        # The search gets its own copy so "position" can arrive while it runs
+        gs = GameState(self.gs.backend)
+        gs.loadFen(self.gs.getFen())
+        searcher = self.getSearcher()
+        searcher.previous = set(record.zobrist for record in self.gs.history)
+
+        searcher.stopEvent.clear()
+        self.released.clear()
+        self.thread = threading.Thread(target=self.think, args=(gs, options.get("depth", 64),
+            movetime, options.get("nodes"), wait), daemon=True)
+        self.thread.start()
+        return
+
+    def ponderhit(self):
+        '''
+        The opponent played the expected move: keep searching, now on our own clock
+        '''
+        self.released.set()
+        movetime = allotTime(self.gs, self.options)
+        if movetime is not None and self.thread is not None:
+            self.timer = threading.Timer(movetime, self.searcher.stopEvent.set)
+            self.timer.daemon = True
+            self.timer.start()
+        elif self.thread is not None:
+            self.searcher.stopEvent.set()
+        return
+
+    def setOption(self, args):
+        '''
+        Handles "setoption name <name> value <value>"
+        '''
+        if "value" not in args:
+            return
+        name = " ".join(args[1:args.index("value")]).lower()
+        value = " ".join(args[args.index("value") + 1:])
+        if name == "hash":
+            self.hash = max(1, int(value))
+            self.dropSearcher()
+        elif name == "threads":
+            self.threads = max(1, int(value))
+            self.dropSearcher()
+        return
+
+    def command(self, line):
+        '''
+        Handles one line of input. Returns False once the session should end
+            String line: The command
+        '''
+        args = line.split()
+        if not args:
+            return True
+        try:
+            return self.dispatch(args[0], args)
+        except (ValueError, IndexError) as e:
+            # A GUI sending a bad command should not end the session
+            self.send("info string cannot handle {a!r}: {b}".format(a=line.strip(), b=e))
+        return True
+
+    def dispatch(self, name, args):
+        '''
+        Handles one command. Returns False once the session should end
+            String name: The command's name
+            List args: The whole line split into words
+        '''
+        if name == "uci":
+            self.send("id name " + NAME)
+            self.send("id author " + AUTHOR)
+            self.send("option name Hash type spin default 16 min 1 max 4096")
+            self.send("option name Threads type spin default 1 min 1 max {a}".format(a=os.cpu_count() or 1))
+            self.send("option name Ponder type check default false")
+            self.send("uciok")
+        elif name == "isready":
+            self.send("readyok")
+        elif name == "ucinewgame":
+            self.stopSearch()
+            if self.searcher is not None and hasattr(self.searcher, "clear"):
+                self.searcher.clear()
+        elif name == "setoption":
+            self.stopSearch()
+            self.setOption(args[1:])
+        elif name == "position":
+            self.position(args[1:])
+        elif name == "go":
+            self.go(args[1:])
+        elif name == "stop":
+            self.stopSearch()
+        elif name == "ponderhit":
+            self.ponderhit()
+        elif name == "quit":
+            self.stopSearch()
+            self.dropSearcher()
+            return False
+        return True
+
+def main():
+    session = UciEngine()
+    for line in sys.stdin:
+        if not session.command(line):
+            break
+    else:
+        session.stopSearch()
+        session.dropSearcher()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
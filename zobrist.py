@@ -0,0 +1,32 @@
+'''
+Random 64-bit keys for Zobrist hashing. A position's key is the XOR of the keys of each
+piece on its square, the side to move, the castling rights and the en passant file.
+'''
+import random
+from piece import NAMES
+
+# A fixed seed keeps keys the same between runs, so they can be stored on disk
+rng = random.Random(0x5A0B)
+
+PIECES = {name: [rng.getrandbits(64) for sq in range(64)] for name in NAMES}
+BLACK_TO_MOVE = rng.getrandbits(64)
+CASTLING = [rng.getrandbits(64) for rights in range(16)]
+EN_PASSANT = [rng.getrandbits(64) for f in range(8)]
+# The keys of the pawns alone make a key of the pawn structure; every other name has none
+PAWNS = {name: PIECES[name] if name[1] == "p" else [0] * 64 for name in NAMES + ["--", "-e"]}
+
+# Bits of the castling rights, as returned by GameState.castlingRights
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+
+def pieceKey(name, pos):
+    '''
+    Returns the key of a piece on a square; empty squares have no key
+        String name: The name of the piece
+        Tuple pos: The position of the piece
+    '''
+    if name[0] == "-":
+        return 0
+    return PIECES[name][pos[0]*8 + pos[1]]